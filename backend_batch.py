@@ -0,0 +1,239 @@
+# backend_batch.py
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import ExitStack
+from dotenv import load_dotenv
+import backend_financiero
+import backend_marketing
+import backend_mercado
+from backend_coalesce import coalesce, flight_key
+from backend_db import DB_CONNECTION_ERROR, db_connection, run_db
+from backend_deadline import DeadlineExceeded
+from backend_facts import current_facts
+from backend_intents import UNROUTED, match_intent
+from backend_metrics import ERRORS, REQUESTS
+from backend_scheduler import BATCH_PRIORITY, LLM_MAX_CONCURRENCY, AdmissionError, llm_priority
+from backend_templates import templated_answer
+from backend_tiers import select_model
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Preguntas máximas por petición de lote (el CLI parte los archivos más grandes)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+# Generaciones simultáneas de un lote; por defecto las que admite el planificador, para no llenar su cola
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(LLM_MAX_CONCURRENCY)))
+# Reintentos de una pregunta rechazada por el planificador (cola llena o sin turno)
+BATCH_ADMISSION_RETRIES = int(os.getenv("BATCH_ADMISSION_RETRIES", "5"))
+
+# Cómo resuelve un lote las preguntas de cada agente
+class BatchAgent:
+    def __init__(self, module, params, query, build_prompt, from_facts=None):
+        self.module = module
+        self.name = module.AGENT_NAME
+        # Campos de la petición que usan las consultas del agente, en el orden de sus argumentos
+        self.params = params
+        self.query = query
+        self.build_prompt = build_prompt
+        self.from_facts = from_facts
+
+    def param_values(self, item):
+        return tuple(getattr(item, param, None) for param in self.params)
+
+    # Los mismos parámetros por nombre (clave de la caché semántica)
+    def param_map(self, item):
+        return dict(zip(self.params, self.param_values(item)))
+
+    # Los datos dependen sólo de la intención y los parámetros: preguntas distintas comparten consulta
+    def lookup_key(self, item, intent):
+        return (self.name, intent, *self.param_values(item))
+
+    def intent(self, item):
+        return match_intent(self.name, item.user_input)
+
+BATCH_AGENTS = {
+    "financiero": BatchAgent(
+        backend_financiero, (),
+        backend_financiero.query_financial_data, backend_financiero.build_financial_prompt,
+        backend_financiero.financial_data_from_facts,
+    ),
+    "marketing": BatchAgent(
+        backend_marketing, ("producto", "objetivo", "presupuesto"),
+        backend_marketing.query_marketing_data, backend_marketing.build_marketing_prompt,
+    ),
+    "mercado": BatchAgent(
+        backend_mercado, ("categoria", "ubicacion"),
+        backend_mercado.query_market_data, backend_mercado.build_market_prompt,
+        backend_mercado.market_data_from_facts,
+    ),
+}
+
+# Resolver todas las consultas distintas del lote con una sola conexión (sólo si los hechos no bastan)
+# groups: {clave: (agente, petición, intención)}; devuelve {clave: (conectado, datos)}
+def lookup_all(groups):
+    facts = current_facts()
+    results = {}
+    with ExitStack() as stack:
+        cursor = None
+        db_failed = False
+        for key, (agent, item, intent) in groups.items():
+            params = agent.param_values(item)
+            if facts is not None and agent.from_facts is not None:
+                results[key] = (True, agent.from_facts(item.user_input, facts, *params, intent=intent))
+                continue
+            if cursor is None and not db_failed:
+                try:
+                    conn = stack.enter_context(db_connection())
+                    cursor = stack.enter_context(conn.cursor())
+                except Exception as e:
+                    logger.error("Error al conectar a la base de datos: %s", e)
+                    db_failed = True
+            if db_failed:
+                ERRORS.inc(agent.name, "bd")
+                results[key] = (False, None)
+                continue
+            results[key] = (True, agent.query(item.user_input, cursor, *params, intent=intent))
+    return results
+
+# Generar una respuesta; si el planificador la rechaza, esperar lo que indica y reintentar
+# Las generaciones de lotes esperan turno detrás de las interactivas (BATCH_PRIORITY)
+async def generate_answer(agent, question, data, params=None, modo=None, intent=UNROUTED):
+    prompt = agent.build_prompt(question, data)
+    model = select_model(agent.name, agent.module.MODEL_NAME, question, data, intent=intent)
+    # Lo mismo que distingue las peticiones interactivas (parámetros y modo), más los datos y el modelo elegido
+    key = flight_key(agent.name, question, data, model, modo, *(params or {}).values())
+    for attempt in range(BATCH_ADMISSION_RETRIES + 1):
+        try:
+            # Preguntas repetidas en el lote se generan una sola vez
+            with llm_priority(BATCH_PRIORITY):
+                return await coalesce(key, lambda: agent.module.get_llama_response_async(prompt, question, data, model=model, params=params))
+        except AdmissionError as e:
+            if attempt == BATCH_ADMISSION_RETRIES:
+                raise
+            await asyncio.sleep(e.retry_after)
+
+# Responder un lote de peticiones heterogéneas; produce un evento por petición en orden de finalización
+# y un resumen al final. Cada petición necesita 'agente', 'user_input' y opcionalmente 'id', 'modo' y sus parámetros.
+async def run_batch(items, concurrency=None):
+    start = time.perf_counter()
+    groups = {}
+    keys = []
+    # Cada pregunta se enruta una sola vez: la intención sirve para la consulta, la plantilla y el modelo
+    intents = []
+    for item in items:
+        agent = BATCH_AGENTS[item.agente]
+        REQUESTS.inc(agent.name, "batch")
+        intent = agent.intent(item)
+        key = agent.lookup_key(item, intent)
+        groups.setdefault(key, (agent, item, intent))
+        keys.append(key)
+        intents.append(intent)
+
+    lookups = await run_db(lookup_all, groups)
+    semaphore = asyncio.Semaphore(concurrency or BATCH_CONCURRENCY)
+
+    async def answer(index, item, key, intent):
+        agent = BATCH_AGENTS[item.agente]
+        result = {"tipo": "resultado", "id": item.id if item.id is not None else index, "agente": agent.name}
+        connected, data = lookups[key]
+        if not connected:
+            return {**result, "error": DB_CONNECTION_ERROR}
+        item_start = time.perf_counter()
+        # Intenciones con plantilla: la respuesta sale de los datos sin pasar por el modelo
+        respuesta = templated_answer(agent.name, intent, data, item.modo)
+        if respuesta is not None:
+            return {**result, "respuesta": respuesta, "plantilla": True, "ms": round((time.perf_counter() - item_start) * 1000, 1)}
+        try:
+            async with semaphore:
+                respuesta = await generate_answer(agent, item.user_input, data, agent.param_map(item), item.modo, intent)
+        except AdmissionError as e:
+            ERRORS.inc(agent.name, "admision")
+            return {**result, "error": str(e)}
+        except DeadlineExceeded as e:
+            # Plazo del lote (cabecera X-Deadline-Ms): las preguntas pendientes terminan con error
+            ERRORS.inc(agent.name, "plazo")
+            return {**result, "error": str(e)}
+        except Exception as e:
+            logger.exception("Ocurrió una excepción en run_batch", extra={"agente": agent.name})
+            ERRORS.inc(agent.name, "inesperado")
+            return {**result, "error": f"Error inesperado: {e}"}
+        return {**result, "respuesta": respuesta, "ms": round((time.perf_counter() - item_start) * 1000, 1)}
+
+    tasks = [asyncio.ensure_future(answer(i, item, key, intent)) for i, (item, key, intent) in enumerate(zip(items, keys, intents))]
+    errors = 0
+    templated = 0
+    try:
+        for future in asyncio.as_completed(tasks):
+            result = await future
+            errors += "error" in result
+            templated += result.get("plantilla", False)
+            yield result
+    finally:
+        # Si el cliente se desconecta, no seguir generando para él
+        for task in tasks:
+            task.cancel()
+
+    yield {
+        "tipo": "resumen",
+        "peticiones": len(items),
+        "consultas_bd": len(groups),
+        "errores": errors,
+        "plantillas": templated,
+        "segundos": round(time.perf_counter() - start, 3),
+    }
+
+# CLI: envía un archivo JSONL (una petición por línea) a /agentes/batch y escribe los resultados en NDJSON
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                item = json.loads(line)
+                item.setdefault("id", number)
+                yield item
+
+def chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def main():
+    import httpx
+
+    parser = argparse.ArgumentParser(description="Enviar preguntas en lote a los agentes")
+    parser.add_argument("entrada", help="archivo JSONL: {\"id\", \"agente\", \"user_input\", ...} por línea")
+    parser.add_argument("--url", default=os.getenv("API_URL", "http://localhost:8000"))
+    parser.add_argument("--salida", help="archivo NDJSON de resultados (por defecto, la salida estándar)")
+    parser.add_argument("--lote", type=int, default=BATCH_MAX_ITEMS, help="peticiones por llamada al API")
+    parser.add_argument("--concurrencia", type=int, help="generaciones simultáneas en el servidor")
+    args = parser.parse_args()
+
+    out = open(args.salida, "w", encoding="utf-8") if args.salida else sys.stdout
+    try:
+        with httpx.Client(base_url=args.url, timeout=None) as client:
+            for chunk in chunks(read_jsonl(args.entrada), args.lote):
+                body = {"peticiones": chunk, "concurrencia": args.concurrencia}
+                with client.stream("POST", "/agentes/batch", json=body) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if line:
+                            out.write(line + "\n")
+                            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
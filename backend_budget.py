@@ -0,0 +1,187 @@
+# backend_budget.py
+
+import os
+import threading
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+# Cortar la generación en cuanto empieza el cuarto párrafo (desactivable para comparar)
+GENERATION_BUDGET_ENABLED = os.getenv("GENERATION_BUDGET_ENABLED", "1") == "1"
+
+MAX_PARAGRAPHS = 3
+
+# Máximo de tokens por agente: 3 párrafos concisos rara vez superan este número
+AGENT_NUM_PREDICT = {
+    "financiero": int(os.getenv("NUM_PREDICT_FINANCIERO", "384")),
+    "marketing": int(os.getenv("NUM_PREDICT_MARKETING", "384")),
+    "mercado": int(os.getenv("NUM_PREDICT_MERCADO", "320")),
+    # Resumen de las tres respuestas en /agentes: un solo párrafo
+    "resumen": int(os.getenv("NUM_PREDICT_RESUMEN", "160")),
+}
+
+# El modelo a veces continúa el patrón del prompt con una nueva pregunta; ahí ya terminó
+STOP_SEQUENCES = ["Pregunta del usuario:", "Datos relevantes:"]
+
+# Opciones de Ollama para un agente (None si el presupuesto está desactivado)
+def generation_options(agent):
+    if not GENERATION_BUDGET_ENABLED:
+        return None
+    options = {"stop": STOP_SEQUENCES}
+    if agent in AGENT_NUM_PREDICT:
+        options["num_predict"] = AGENT_NUM_PREDICT[agent]
+    return options
+
+# Aplica el límite de párrafos a medida que llegan los fragmentos del modelo
+class ParagraphLimiter:
+    def __init__(self, max_paragraphs=MAX_PARAGRAPHS):
+        self.max_paragraphs = max_paragraphs
+        self.text = ''
+        self.emitted = 0
+        self.done = False
+
+    # Añadir un fragmento y devolver el texto que ya se puede enviar al cliente
+    def feed(self, piece):
+        if self.done:
+            return ''
+        if not self.text:
+            piece = piece.lstrip()
+        self.text += piece
+
+        # Buscar el separador que daría inicio al párrafo max_paragraphs + 1
+        pos = -1
+        for _ in range(self.max_paragraphs):
+            pos = self.text.find('\n\n', pos + 2 if pos >= 0 else 0)
+            if pos < 0:
+                break
+        if pos >= 0:
+            self.text = self.text[:pos]
+            self.done = True
+            return self._emit(self.text)
+
+        # Retener el espacio final: puede formar parte de un separador o descartarse
+        return self._emit(self.text.rstrip())
+
+    # Texto pendiente al terminar la generación
+    def finish(self):
+        if not self.done:
+            self.text = self.text.rstrip()
+            self.done = True
+        return self._emit(self.text)
+
+    def _emit(self, safe):
+        new = safe[self.emitted:]
+        self.emitted = max(self.emitted, len(safe))
+        return new
+
+# Presupuesto de una generación: vigila el stream y decide cuándo abortar la petición a Ollama
+# stop_early=False sigue leyendo hasta el final (p. ej. para recibir el 'context' de Ollama en sesiones)
+class GenerationBudget:
+    def __init__(self, agent=None, max_paragraphs=MAX_PARAGRAPHS, stop_early=True):
+        self.agent = agent
+        self.enabled = GENERATION_BUDGET_ENABLED and stop_early
+        self.options = generation_options(agent)
+        self.limiter = ParagraphLimiter(max_paragraphs)
+        self.chunks = 0
+        self.wasted = 0
+        self.final_chunk = None
+        self.stopped_early = False
+
+    @property
+    def text(self):
+        return self.limiter.text
+
+    # Registrar un fragmento; devuelve el texto nuevo que cabe en el límite
+    def feed(self, piece):
+        self.chunks += 1
+        if self.limiter.done:
+            # Tokens generados después del corte: sólo ocurre sin presupuesto
+            self.wasted += 1
+            return ''
+        return self.limiter.feed(piece)
+
+    # True cuando ya no tiene sentido seguir leyendo del modelo
+    @property
+    def exhausted(self):
+        return self.enabled and self.limiter.done
+
+    # Cerrar el presupuesto y registrar métricas; devuelve el texto pendiente
+    def finish(self):
+        # Sin fragmento final significa que abortamos la petición nosotros
+        self.stopped_early = self.final_chunk is None and self.limiter.done
+        text = self.limiter.finish()
+        record_generation(self)
+        return text
+
+    @property
+    def generated_tokens(self):
+        if self.final_chunk is not None and getattr(self.final_chunk, 'eval_count', None):
+            return self.final_chunk.eval_count
+        return self.chunks
+
+    # Tokens que ya no se generarán si se corta ahora: el resto del num_predict
+    @property
+    def remaining_tokens(self):
+        if not self.options or "num_predict" not in self.options:
+            return 0
+        return max(0, self.options["num_predict"] - self.generated_tokens)
+
+    # Estimación de tokens evitados por el corte anticipado
+    @property
+    def saved_tokens(self):
+        return self.remaining_tokens if self.stopped_early else 0
+
+    def summary(self):
+        return {
+            "generados": self.generated_tokens,
+            "descartados": self.wasted,
+            "ahorrados_estimados": self.saved_tokens,
+            "corte_anticipado": self.stopped_early,
+        }
+
+# Métricas acumuladas por agente (el camino síncrono corre en hilos, de ahí el lock)
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _agent_stats(agent):
+    return _stats.setdefault(agent or "desconocido", {
+        "peticiones": 0,
+        "cortes_anticipados": 0,
+        "tokens_generados": 0,
+        "tokens_descartados": 0,
+        "tokens_ahorrados_estimados": 0,
+        "canceladas": 0,
+        "tokens_evitados_cancelacion": 0,
+    })
+
+def record_generation(budget):
+    with _stats_lock:
+        stats = _agent_stats(budget.agent)
+        stats["peticiones"] += 1
+        stats["cortes_anticipados"] += int(budget.stopped_early)
+        stats["tokens_generados"] += budget.generated_tokens
+        stats["tokens_descartados"] += budget.wasted
+        stats["tokens_ahorrados_estimados"] += budget.saved_tokens
+
+# Generación abortada porque el cliente se fue o venció su plazo
+def record_cancellation(budget):
+    with _stats_lock:
+        stats = _agent_stats(budget.agent)
+        stats["canceladas"] += 1
+        stats["tokens_generados"] += budget.generated_tokens
+        stats["tokens_evitados_cancelacion"] += budget.remaining_tokens
+
+def get_generation_stats():
+    with _stats_lock:
+        result = {}
+        for agent, stats in _stats.items():
+            result[agent] = dict(stats)
+            result[agent]["tokens_ahorrados_por_peticion"] = round(
+                stats["tokens_ahorrados_estimados"] / stats["peticiones"], 1
+            ) if stats["peticiones"] else 0.0
+        return result
+
+def reset_generation_stats():
+    with _stats_lock:
+        _stats.clear()
@@ -0,0 +1,226 @@
+# backend_cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+# Número máximo de respuestas en memoria antes de expulsar la menos usada
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+# Ruta del fichero SQLite para sobrevivir a reinicios (vacío = sólo memoria)
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")
+
+# Segundos que vive una respuesta por agente: los datos de mercado cambian más a menudo
+RESPONSE_CACHE_TTL = {
+    "financiero": float(os.getenv("CACHE_TTL_FINANCIERO", "3600")),
+    "marketing": float(os.getenv("CACHE_TTL_MARKETING", "1800")),
+    "mercado": float(os.getenv("CACHE_TTL_MERCADO", "600")),
+}
+RESPONSE_CACHE_DEFAULT_TTL = float(os.getenv("CACHE_TTL_DEFAULT", "600"))
+
+# Tabla de la que dependen las respuestas de cada agente
+AGENT_TABLES = {
+    "financiero": "agente_financiero",
+    "marketing": "agente_marketing",
+    "mercado": "agente_mercado",
+}
+
+# Normalizar el prompt: mayúsculas y espacios no cambian la respuesta esperada
+def normalize_prompt(prompt):
+    return " ".join(prompt.lower().split())
+
+def cache_key(model, prompt, options=None):
+    payload = json.dumps([model, normalize_prompt(prompt), options or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Copia en disco de la caché (SQLite); las escrituras se serializan con un lock
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS respuestas (
+                    clave TEXT PRIMARY KEY,
+                    agente TEXT,
+                    respuesta TEXT NOT NULL,
+                    expira REAL NOT NULL
+                )
+            """)
+
+    # Entradas vigentes, de la más antigua a la más reciente
+    def load(self, now):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT clave, agente, respuesta, expira FROM respuestas WHERE expira > ? ORDER BY rowid",
+                (now,),
+            ).fetchall()
+        return rows
+
+    def put(self, key, agent, value, expires):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO respuestas VALUES (?, ?, ?, ?)", (key, agent, value, expires))
+
+    def delete(self, keys):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM respuestas WHERE clave = ?", [(key,) for key in keys])
+
+    def clear(self, agent=None):
+        with self._lock, self._conn:
+            if agent is None:
+                self._conn.execute("DELETE FROM respuestas")
+            else:
+                self._conn.execute("DELETE FROM respuestas WHERE agente = ?", (agent,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Caché LRU con TTL por agente; segura entre hilos (el camino síncrono corre en hilos)
+class ResponseCache:
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=None, default_ttl=RESPONSE_CACHE_DEFAULT_TTL, store=None):
+        self.max_entries = max_entries
+        self.ttl = dict(RESPONSE_CACHE_TTL if ttl is None else ttl)
+        self.default_ttl = default_ttl
+        self.store = store
+        self._lock = threading.Lock()
+        # clave -> (agente, respuesta, expira)
+        self._entries = OrderedDict()
+        self._counters = {
+            "aciertos": 0,
+            "fallos": 0,
+            "expiradas": 0,
+            "expulsadas": 0,
+            "invalidadas": 0,
+            "guardadas": 0,
+        }
+        if store is not None:
+            for key, agent, value, expires in store.load(time.time()):
+                self._entries[key] = (agent, value, expires)
+            self._evict()
+
+    def ttl_for(self, agent):
+        return self.ttl.get(agent, self.default_ttl)
+
+    def get(self, key):
+        now = time.time()
+        expired = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["fallos"] += 1
+                return None
+            if entry[2] <= now:
+                del self._entries[key]
+                self._counters["expiradas"] += 1
+                self._counters["fallos"] += 1
+                expired = True
+            else:
+                self._entries.move_to_end(key)
+                self._counters["aciertos"] += 1
+                return entry[1]
+        if expired and self.store is not None:
+            self.store.delete([key])
+        return None
+
+    def put(self, key, value, agent=None):
+        expires = time.time() + self.ttl_for(agent)
+        with self._lock:
+            self._entries[key] = (agent, value, expires)
+            self._entries.move_to_end(key)
+            self._counters["guardadas"] += 1
+            evicted = self._evict()
+        if self.store is not None:
+            self.store.put(key, agent, value, expires)
+            if evicted:
+                self.store.delete(evicted)
+
+    # Expulsar las entradas menos usadas por encima del máximo (llamar con el lock tomado)
+    def _evict(self):
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            key, _ = self._entries.popitem(last=False)
+            evicted.append(key)
+        self._counters["expulsadas"] += len(evicted)
+        return evicted
+
+    # Borrar las respuestas de un agente (o todas) cuando cambian sus tablas
+    def invalidate(self, agent=None):
+        with self._lock:
+            if agent is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [key for key, entry in self._entries.items() if entry[0] == agent]
+                for key in keys:
+                    del self._entries[key]
+                removed = len(keys)
+            self._counters["invalidadas"] += removed
+        if self.store is not None:
+            self.store.clear(agent)
+        return removed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                "entradas": len(self._entries),
+                "maximo": self.max_entries,
+                "ttl_segundos": dict(self.ttl),
+                "persistente": self.store is not None,
+            })
+        consultas = stats["aciertos"] + stats["fallos"]
+        stats["tasa_aciertos"] = round(stats["aciertos"] / consultas, 3) if consultas else 0.0
+        return stats
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# Caché única del proceso, creada en el primer uso
+def get_response_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                store = SQLiteStore(RESPONSE_CACHE_PATH) if RESPONSE_CACHE_PATH else None
+                _cache = ResponseCache(store=store)
+    return _cache
+
+# Respuesta guardada para (modelo, prompt, opciones) o None
+def cached_response(model, prompt, options=None):
+    if not RESPONSE_CACHE_ENABLED:
+        return None, None
+    key = cache_key(model, prompt, options)
+    return key, get_response_cache().get(key)
+
+def store_response(key, value, agent=None):
+    if key is None:
+        return
+    get_response_cache().put(key, value, agent)
+
+# Nombre de agente a partir de un agente o de su tabla (agente_financiero, agente_marketing, agente_mercado)
+def resolve_agent(target):
+    if target is None or target in AGENT_TABLES:
+        return target
+    for agent, table in AGENT_TABLES.items():
+        if table == target:
+            return agent
+    raise ValueError(f"Agente o tabla desconocida: {target}")
+
+# Invalidar por agente o por tabla; sin destino se vacía la caché entera
+def invalidate_responses(target=None):
+    return get_response_cache().invalidate(resolve_agent(target))
+
+def get_cache_stats():
+    if not RESPONSE_CACHE_ENABLED:
+        return {"habilitada": False}
+    return {"habilitada": True, **get_response_cache().stats()}
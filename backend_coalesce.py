@@ -0,0 +1,203 @@
+# backend_coalesce.py
+
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import weakref
+from dotenv import load_dotenv
+from backend_deadline import RequestScope, cancel_reason, enter_scope, within_deadline
+from backend_tracing import Trace, enter_trace, merge_trace
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Unir peticiones idénticas en curso (desactivable para comparar)
+COALESCING_ENABLED = os.getenv("COALESCING_ENABLED", "1") == "1"
+
+# Contadores por agente: ejecuciones reales y peticiones que se unieron a una en curso
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _record(key, joined):
+    agent = key[0] if key else "desconocido"
+    with _stats_lock:
+        stats = _stats.setdefault(agent, {"ejecutadas": 0, "unidas": 0})
+        stats["unidas" if joined else "ejecutadas"] += 1
+
+def get_coalescing_stats():
+    with _stats_lock:
+        return {"habilitada": COALESCING_ENABLED, **{agent: dict(stats) for agent, stats in _stats.items()}}
+
+# Clave de coalescencia; las partes no hashables (p. ej. listas de conversación) se usan por su repr
+def flight_key(agent, *parts):
+    key = [agent]
+    for part in parts:
+        try:
+            hash(part)
+            key.append(part)
+        except TypeError:
+            key.append(repr(part))
+    return tuple(key)
+
+# Una llamada síncrona en curso (caminos de los frontends, que corren en hilos)
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+_sync_calls = {}
+_sync_lock = threading.Lock()
+
+# Ejecutar func() una sola vez por clave mientras esté en curso; el resto espera su resultado
+def coalesce_sync(key, func):
+    if not COALESCING_ENABLED:
+        return func()
+    with _sync_lock:
+        call = _sync_calls.get(key)
+        leader = call is None
+        if leader:
+            call = _sync_calls[key] = _Call()
+    _record(key, not leader)
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+    try:
+        call.result = func()
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _sync_lock:
+            del _sync_calls[key]
+        call.done.set()
+
+# Quitar una entrada en curso sólo si sigue siendo la misma (una cancelada pudo ser reemplazada)
+def forget(entries, key, entry):
+    if entries.get(key) is entry:
+        del entries[key]
+
+# Contexto limpio para una ejecución compartida: no hereda el plazo ni la traza de quien la inició.
+# Lleva su propio alcance (sin plazo; cada petición aplica el suyo al esperarla) y su propia traza,
+# que se suma a la de cada petición que la esperó hasta el final
+def flight_context(name):
+    context = contextvars.Context()
+    scope = context.run(enter_scope, RequestScope())
+    trace = context.run(enter_trace, Trace("compartida", name))
+    return context, scope, trace
+
+# Una tarea asíncrona en curso y cuántas peticiones esperan su resultado
+class _Flight:
+    def __init__(self, factory, key):
+        context, self.scope, self.trace = flight_context(key[0] if key else "desconocido")
+        self.task = asyncio.get_running_loop().create_task(factory(), context=context)
+        self.waiters = 0
+
+# Tareas asíncronas en curso por clave; cada event loop tiene las suyas
+_async_calls = weakref.WeakKeyDictionary()
+
+async def coalesce(key, factory):
+    if not COALESCING_ENABLED:
+        return await factory()
+    loop = asyncio.get_running_loop()
+    calls = _async_calls.setdefault(loop, {})
+    flight = calls.get(key)
+    _record(key, flight is not None)
+    if flight is None:
+        flight = calls[key] = _Flight(factory, key)
+        flight.task.add_done_callback(lambda _: forget(calls, key, flight))
+    flight.waiters += 1
+    try:
+        # shield: si el cliente que la inició se desconecta, la tarea sigue para los demás;
+        # cada petición espera como mucho su propio plazo
+        return await within_deadline(asyncio.shield(flight.task), "la respuesta compartida")
+    finally:
+        flight.waiters -= 1
+        if flight.task.done():
+            merge_trace(flight.trace)
+        # Si ya no la espera nadie (todos se desconectaron o venció su plazo), cancelarla
+        elif not flight.waiters:
+            flight.scope.reason = cancel_reason()
+            flight.task.cancel()
+            # Quien llegue ahora empieza una nueva en lugar de unirse a la cancelada
+            forget(calls, key, flight)
+
+# Difunde los eventos de un stream a todos los suscriptores; los que llegan tarde reciben primero lo ya emitido
+# (el plazo de cada suscriptor lo aplica main.guarded_events entre eventos)
+class _Broadcast:
+    def __init__(self, events, key):
+        self.events = []
+        self.done = False
+        self.subscribers = 0
+        self.abandoned = False
+        self._changed = asyncio.Event()
+        context, self.scope, self.trace = flight_context(key[0] if key else "desconocido")
+        self.task = asyncio.get_running_loop().create_task(self._pump(events), context=context)
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self, events):
+        try:
+            async for event in events:
+                self.events.append(event)
+                self._notify()
+        except Exception as e:
+            logger.error("Ocurrió una excepción en el stream compartido: %s", e)
+            self.events.append({"tipo": "error", "detalle": f"Error inesperado: {e}"})
+        finally:
+            self.done = True
+            self._notify()
+
+    async def subscribe(self, joined):
+        self.subscribers += 1
+        try:
+            i = 0
+            while True:
+                changed = self._changed
+                while i < len(self.events):
+                    event = self.events[i]
+                    i += 1
+                    if joined and event.get("tipo") == "fin":
+                        event = {**event, "compartida": True}
+                    yield event
+                if self.done:
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.done:
+                merge_trace(self.trace)
+            # El último suscriptor se fue antes del final: abortar la generación compartida
+            elif not self.subscribers:
+                self.abandoned = True
+                self.scope.reason = cancel_reason()
+                self.task.cancel()
+
+_streams = weakref.WeakKeyDictionary()
+
+# Variante en streaming de coalesce: factory() devuelve el generador asíncrono de eventos
+async def coalesce_stream(key, factory):
+    if not COALESCING_ENABLED:
+        async for event in factory():
+            yield event
+        return
+    loop = asyncio.get_running_loop()
+    streams = _streams.setdefault(loop, {})
+    broadcast = streams.get(key)
+    # Un stream abandonado se está cancelando: no unirse a él
+    joined = broadcast is not None and not broadcast.abandoned
+    _record(key, joined)
+    if not joined:
+        broadcast = streams[key] = _Broadcast(factory(), key)
+        broadcast.task.add_done_callback(lambda _: forget(streams, key, broadcast))
+    async for event in broadcast.subscribe(joined):
+        yield event
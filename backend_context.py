@@ -0,0 +1,111 @@
+# backend_context.py
+
+import math
+import os
+import threading
+from dotenv import load_dotenv
+from backend_metrics import counter
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+CONTEXT_BUDGET_ENABLED = os.getenv("CONTEXT_BUDGET_ENABLED", "1") == "1"
+# Caracteres por token para estimar sin tokenizador (los modelos tipo llama rondan 3.5 en español)
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3.5"))
+
+# Tokens máximos de datos de la BD en el prompt, por agente
+CONTEXT_BUDGETS = {
+    "financiero": int(os.getenv("CONTEXT_TOKENS_FINANCIERO", "200")),
+    "marketing": int(os.getenv("CONTEXT_TOKENS_MARKETING", "250")),
+    "mercado": int(os.getenv("CONTEXT_TOKENS_MERCADO", "150")),
+}
+CONTEXT_DEFAULT_BUDGET = int(os.getenv("CONTEXT_TOKENS_DEFAULT", "200"))
+
+CONTEXT_TOKENS_SAVED = counter("agente_contexto_tokens_ahorrados_total", "Tokens de datos recortados del prompt por el presupuesto de contexto.", ("agente",))
+
+# Estimación rápida: basta para decidir cuántos elementos caben, no para contar con exactitud
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+# Texto de datos ya recortado para el prompt que conserva la versión completa: las plantillas
+# (backend_templates) responden sin modelo y no deben perder elementos
+class FittedText(str):
+    def __new__(cls, text, full):
+        obj = super().__new__(cls, text)
+        obj.full = full
+        return obj
+
+# Datos completos, sin el recorte del presupuesto de contexto
+def untrimmed(data):
+    return getattr(data, "full", data)
+
+# Recorta las listas de datos (ya ordenadas de más a menos relevante) al presupuesto de cada agente
+class ContextBudgeter:
+    def __init__(self, budgets=None, default_budget=CONTEXT_DEFAULT_BUDGET, enabled=CONTEXT_BUDGET_ENABLED):
+        self.budgets = dict(CONTEXT_BUDGETS if budgets is None else budgets)
+        self.default_budget = default_budget
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def budget(self, agent):
+        return self.budgets.get(agent, self.default_budget)
+
+    # "prefijo a, b, c y N más" con tantos elementos como quepan en el presupuesto
+    # (al menos uno, para no dejar el dato vacío)
+    def fit(self, agent, prefix, items, separator=", ", suffix=""):
+        full = f"{prefix}{separator.join(items)}{suffix}"
+        if not self.enabled or not items:
+            return FittedText(full, full)
+        full_tokens = estimate_tokens(full)
+        if full_tokens <= self.budget(agent):
+            self._record(agent, full_tokens, 0, 0)
+            return FittedText(full, full)
+
+        # Caracteres disponibles para los elementos, reservando sitio para " y N más"
+        room = self.budget(agent) * CHARS_PER_TOKEN - len(prefix) - len(suffix) - len(f" y {len(items)} más")
+        kept = [items[0]]
+        length = len(items[0])
+        for item in items[1:]:
+            length += len(separator) + len(item)
+            if length > room:
+                break
+            kept.append(item)
+        dropped = len(items) - len(kept)
+        text = f"{prefix}{separator.join(kept)}{f' y {dropped} más' if dropped else ''}{suffix}"
+        tokens = estimate_tokens(text)
+        self._record(agent, tokens, max(0, full_tokens - tokens), dropped)
+        return FittedText(text, full)
+
+    def _record(self, agent, tokens, saved, dropped):
+        if saved:
+            CONTEXT_TOKENS_SAVED.inc(agent, amount=saved)
+        with self._lock:
+            stats = self._stats.setdefault(agent, {
+                "datos": 0, "recortados": 0, "elementos_descartados": 0, "tokens_enviados": 0, "tokens_ahorrados": 0,
+            })
+            stats["datos"] += 1
+            stats["recortados"] += bool(dropped)
+            stats["elementos_descartados"] += dropped
+            stats["tokens_enviados"] += tokens
+            stats["tokens_ahorrados"] += saved
+
+    def stats(self):
+        with self._lock:
+            return {
+                "activado": self.enabled,
+                "caracteres_por_token": CHARS_PER_TOKEN,
+                "presupuestos": dict(self.budgets),
+                "agentes": {agent: dict(stats) for agent, stats in self._stats.items()},
+            }
+
+_budgeter = ContextBudgeter()
+
+def get_context_budgeter():
+    return _budgeter
+
+def fit_items(agent, prefix, items, separator=", ", suffix=""):
+    return _budgeter.fit(agent, prefix, items, separator, suffix)
+
+def get_context_stats():
+    return _budgeter.stats()
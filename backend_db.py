@@ -0,0 +1,263 @@
+# backend_db.py
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+from dotenv import load_dotenv
+from backend_deadline import check_deadline, within_deadline
+from backend_tracing import STAGE_DB_CONNECT, span
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+# Tamaño del pool de conexiones compartido por los tres agentes
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "8"))
+# Segundos máximos esperando una conexión libre antes de fallar
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "5"))
+# Una conexión ociosa más tiempo que esto se verifica con SELECT 1 antes de entregarla
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "30"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+
+# Número máximo de consultas bloqueantes (psycopg2) ejecutándose a la vez
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", str(DB_POOL_MAX)))
+
+DB_CONNECTION_ERROR = "Error al conectar con la base de datos."
+
+# No hay conexión libre dentro del tiempo de espera
+class PoolTimeout(Exception):
+    pass
+
+# Conexión que recuerda qué sentencias preparadas existen en su sesión
+class PooledConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+# Pool acotado y seguro entre hilos, con verificación de salud y espera con timeout
+class ConnectionPool:
+    def __init__(self, minconn, maxconn, acquire_timeout, health_check_interval, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._connect_kwargs = connect_kwargs
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._counters = {
+            "adquisiciones": 0,
+            "timeouts": 0,
+            "conexiones_creadas": 0,
+            "conexiones_descartadas": 0,
+            "chequeos_fallidos": 0,
+            "espera_total_ms": 0.0,
+            "espera_max_ms": 0.0,
+        }
+
+    def _connect(self):
+        conn = psycopg2.connect(connection_factory=PooledConnection, **self._connect_kwargs)
+        # Sólo hay lecturas: autocommit evita transacciones abiertas entre peticiones
+        conn.autocommit = True
+        with self._cond:
+            self._counters["conexiones_creadas"] += 1
+        return conn
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self, timeout=None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        conn = None
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        # Reservar el hueco; la conexión se abre fuera del lock
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise PoolTimeout(f"No hay conexiones libres tras {timeout:.1f}s (máximo {self.maxconn})")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._in_use += 1
+            waited_ms = (time.monotonic() - start) * 1000
+            self._counters["adquisiciones"] += 1
+            self._counters["espera_total_ms"] += waited_ms
+            self._counters["espera_max_ms"] = max(self._counters["espera_max_ms"], waited_ms)
+
+        try:
+            if conn is not None and not self._is_healthy(conn):
+                with self._cond:
+                    self._counters["chequeos_fallidos"] += 1
+                    self._counters["conexiones_descartadas"] += 1
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            # Liberar el hueco reservado si no se pudo abrir la conexión
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn):
+        # Una conexión cerrada o en estado desconocido no vuelve al pool
+        broken = conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        with self._cond:
+            self._in_use -= 1
+            if broken:
+                self._size -= 1
+                self._counters["conexiones_descartadas"] += 1
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+            self._cond.notify()
+        if broken:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        # Esperar una conexión libre (o abrirla) cuenta como etapa db_connect de la petición
+        with span(STAGE_DB_CONNECT):
+            conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    # Abrir las conexiones mínimas por adelantado
+    def prefill(self):
+        conns = [self.getconn() for _ in range(self.minconn)]
+        for conn in conns:
+            self.putconn(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                "tamano": self._size,
+                "minimo": self.minconn,
+                "maximo": self.maxconn,
+                "ociosas": len(self._idle),
+                "en_uso": self._in_use,
+                "esperando": self._waiting,
+            })
+        stats["espera_media_ms"] = round(stats["espera_total_ms"] / stats["adquisiciones"], 2) if stats["adquisiciones"] else 0.0
+        stats["espera_total_ms"] = round(stats["espera_total_ms"], 2)
+        stats["espera_max_ms"] = round(stats["espera_max_ms"], 2)
+        return stats
+
+# Parámetros de conexión a PostgreSQL tomados del .env
+def connection_params():
+    return {
+        "host": os.getenv("HOST"),
+        "user": "postgres",
+        "password": os.getenv("PASSWORD"),
+        "dbname": os.getenv("DATABASE"),
+        "port": os.getenv("PORT"),
+        "connect_timeout": DB_CONNECT_TIMEOUT,
+    }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Pool único del proceso, creado en el primer uso
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    DB_POOL_MIN,
+                    DB_POOL_MAX,
+                    DB_ACQUIRE_TIMEOUT,
+                    DB_HEALTH_CHECK_INTERVAL,
+                    **connection_params(),
+                )
+    return _pool
+
+# Conexión prestada del pool compartido
+def db_connection(timeout=None):
+    return get_pool().connection(timeout)
+
+def get_pool_stats():
+    if _pool is None:
+        return {"tamano": 0, "minimo": DB_POOL_MIN, "maximo": DB_POOL_MAX}
+    return _pool.stats()
+
+# Sentencias fijas de los agentes, preparadas una vez por conexión (PREPARE/EXECUTE)
+_statements = {}
+
+def register_statement(name, sql):
+    _statements[name] = sql
+    return name
+
+def execute_prepared(cursor, name, params=()):
+    conn = cursor.connection
+    if name not in conn.prepared:
+        cursor.execute(f"PREPARE {name} AS {_statements[name]}")
+        conn.prepared.add(name)
+    if params:
+        placeholders = ", ".join(["%s"] * len(params))
+        cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+# Executor acotado: las llamadas a psycopg2 no bloquean el event loop de uvicorn
+_db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="db")
+
+# Ejecutar una función bloqueante de base de datos sin bloquear el event loop
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Copiar el contexto para que las variables de contexto lleguen al hilo
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    # Con el plazo de la petición vencido no se empieza la consulta, y no se la espera más allá de él
+    check_deadline("la consulta a la base de datos")
+    return await within_deadline(loop.run_in_executor(_db_executor, call), "la consulta a la base de datos")
@@ -0,0 +1,95 @@
+# backend_deadline.py
+
+import asyncio
+import contextvars
+import os
+import time
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+# Segundos que puede durar una petición (BD + cola + generación); 0 = sin plazo
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "120"))
+# Plazo máximo que un cliente puede pedir con la cabecera
+REQUEST_DEADLINE_MAX = float(os.getenv("REQUEST_DEADLINE_MAX", "300"))
+# Cabecera con el plazo del cliente en milisegundos desde que envía la petición
+DEADLINE_HEADER = "x-deadline-ms"
+
+# Motivos por los que se cancela una generación en curso
+REASON_DEADLINE = "plazo"
+REASON_DISCONNECT = "desconexion"
+
+# El plazo venció antes de terminar una etapa: main.py responde 504
+class DeadlineExceeded(Exception):
+    pass
+
+# Estado de una petición que comparten todas sus etapas (y las tareas que crea) vía contextvars
+class RequestScope:
+    def __init__(self, timeout=None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        # Quién canceló la petición (ver cancel_reason)
+        self.reason = None
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def check(self, stage):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            self.reason = REASON_DEADLINE
+            raise DeadlineExceeded(f"Plazo agotado antes de {stage}.")
+
+_scope = contextvars.ContextVar("request_scope", default=None)
+
+# Plazo de la petición: el de la cabecera (acotado) o el configurado; default=None para no poner ninguno
+def scope_from_headers(headers, default=REQUEST_DEADLINE):
+    value = headers.get(DEADLINE_HEADER)
+    timeout = default
+    if value:
+        try:
+            timeout = min(float(value) / 1000, REQUEST_DEADLINE_MAX)
+        except ValueError:
+            pass
+    return RequestScope(timeout if timeout and timeout > 0 else None)
+
+def enter_scope(scope):
+    _scope.set(scope)
+    return scope
+
+def current_scope():
+    return _scope.get()
+
+# Segundos restantes de la petición actual (None = sin plazo)
+def remaining():
+    scope = _scope.get()
+    return scope.remaining() if scope is not None else None
+
+def check_deadline(stage):
+    scope = _scope.get()
+    if scope is not None:
+        scope.check(stage)
+
+# Motivo de una cancelación recibida en la petición actual: el indicado, el plazo si ya venció
+# o, si no, que el cliente se desconectó
+def cancel_reason():
+    scope = _scope.get()
+    if scope is None:
+        return REASON_DISCONNECT
+    if scope.reason is not None:
+        return scope.reason
+    left = scope.remaining()
+    return REASON_DEADLINE if left is not None and left <= 0 else REASON_DISCONNECT
+
+# Esperar una etapa sin pasarse del plazo de la petición
+async def within_deadline(awaitable, stage):
+    timeout = remaining()
+    if timeout is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(timeout, 0))
+    except asyncio.TimeoutError:
+        _scope.get().reason = REASON_DEADLINE
+        raise DeadlineExceeded(f"Plazo agotado durante {stage}.") from None
@@ -0,0 +1,275 @@
+# backend_facts.py
+
+import logging
+import os
+import select
+import threading
+import time
+import psycopg2
+from dotenv import load_dotenv
+from backend_cache import invalidate_responses, resolve_agent
+from backend_db import connection_params, db_connection
+from backend_semantic_cache import invalidate_semantic
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+FACTS_ENABLED = os.getenv("FACTS_ENABLED", "1") == "1"
+# Segundos tras los que la instantánea se recarga aunque no llegue ninguna notificación
+FACTS_TTL = float(os.getenv("FACTS_TTL", "300"))
+# Segundos de espera tras una recarga fallida antes de volver a intentarla desde una petición
+# (mientras tanto se sirve la instantánea anterior, o los agentes consultan la BD si no hay)
+FACTS_RETRY_INTERVAL = float(os.getenv("FACTS_RETRY_INTERVAL", "30"))
+# Escuchar NOTIFY de los triggers de migrations/001_notificar_cambios.sql
+FACTS_LISTEN = os.getenv("FACTS_LISTEN", "1") == "1"
+FACTS_CHANNEL = "agentes_cambios"
+
+# Consultas que derivan los hechos que usan los agentes (una pasada por tabla)
+SQL_HECHOS = {
+    # Listas de más a menos frecuente, en el mismo orden que las consultas de los agentes
+    "opciones_pequeno": """
+        SELECT btrim(opcion)
+        FROM agente_financiero, unnest(string_to_array(opciones_financiamiento, ',')) AS opcion
+        WHERE tipo_negocio = 'Pequeño'
+        GROUP BY 1
+        ORDER BY COUNT(*) DESC, 1
+    """,
+    "documentos": """
+        SELECT btrim(documento)
+        FROM agente_financiero, unnest(string_to_array(documentos_necesarios, ',')) AS documento
+        GROUP BY 1
+        ORDER BY COUNT(*) DESC, 1
+    """,
+    "endeudamiento": """
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE nivel_endeudamiento = 'Bajo'), AVG(ingresos_mensuales)
+        FROM agente_financiero
+    """,
+    "mercados_internacionales": """
+        SELECT btrim(mercado)
+        FROM agente_mercado, unnest(string_to_array(mercados_internacionales, ',')) AS mercado
+        GROUP BY 1
+        ORDER BY COUNT(*) DESC, 1
+    """,
+    "precio_promedio": """
+        SELECT categoria, AVG(precio) FROM agente_mercado
+        GROUP BY categoria
+    """,
+    "competidores": """
+        SELECT ubicacion_geografica, COUNT(*) FROM agente_mercado
+        GROUP BY ubicacion_geografica
+    """,
+}
+
+def load_facts(cursor):
+    facts = {}
+    cursor.execute(SQL_HECHOS["opciones_pequeno"])
+    facts["opciones_pequeno"] = [row[0] for row in cursor.fetchall()]
+    cursor.execute(SQL_HECHOS["documentos"])
+    facts["documentos"] = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute(SQL_HECHOS["endeudamiento"])
+    total, bajos, ingresos = cursor.fetchone()
+    facts["endeudamiento"] = {
+        "filas": total,
+        "bajo_pct": bajos / total * 100 if total else None,
+        "ingresos_promedio": float(ingresos or 0),
+    }
+
+    cursor.execute(SQL_HECHOS["mercados_internacionales"])
+    facts["mercados_internacionales"] = [row[0] for row in cursor.fetchall()]
+    cursor.execute(SQL_HECHOS["precio_promedio"])
+    facts["precio_promedio"] = {row[0]: float(row[1]) for row in cursor.fetchall() if row[1] is not None}
+    cursor.execute(SQL_HECHOS["competidores"])
+    facts["competidores"] = {row[0]: row[1] for row in cursor.fetchall()}
+    return facts
+
+# Instantánea en memoria de los hechos derivados de las tablas agente_*
+class FactStore:
+    def __init__(self, ttl=FACTS_TTL, loader=load_facts, retry_interval=FACTS_RETRY_INTERVAL):
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._loader = loader
+        self._facts = None
+        self._loaded_at = None
+        self._failed_at = None
+        self._dirty = False
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._counters = {
+            "recargas": 0,
+            "recargas_fallidas": 0,
+            "notificaciones": 0,
+            "ultima_recarga_ms": None,
+            "recarga_max_ms": 0.0,
+        }
+
+    # Recargar desde la BD; devuelve True si la instantánea quedó actualizada
+    def refresh(self):
+        start = time.perf_counter()
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cursor:
+                    facts = self._loader(cursor)
+        except Exception as e:
+            logger.error("No se pudieron cargar los hechos de la base de datos: %s", e)
+            with self._lock:
+                self._refreshing = False
+                self._failed_at = time.monotonic()
+                self._counters["recargas_fallidas"] += 1
+            return False
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._facts = facts
+            self._loaded_at = time.time()
+            self._dirty = False
+            self._refreshing = False
+            self._failed_at = None
+            self._counters["recargas"] += 1
+            self._counters["ultima_recarga_ms"] = round(elapsed_ms, 2)
+            self._counters["recarga_max_ms"] = max(self._counters["recarga_max_ms"], round(elapsed_ms, 2))
+        return True
+
+    def _stale(self):
+        return self._dirty or time.time() - self._loaded_at >= self.ttl
+
+    # Tras una recarga fallida no se reintenta en cada petición: la BD caída doblaría su latencia
+    def _backing_off(self):
+        return self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_interval
+
+    # Hechos actuales, o None si nunca se pudieron cargar (los agentes consultan la BD)
+    def snapshot(self):
+        with self._lock:
+            if self._facts is not None and not self._stale():
+                return self._facts
+            if self._refreshing or self._backing_off():
+                # Otro hilo ya está recargando, o la última recarga falló hace poco:
+                # servir la instantánea anterior mientras tanto
+                return self._facts
+            self._refreshing = True
+        self.refresh()
+        with self._lock:
+            return self._facts
+
+    # Marcar la instantánea como desactualizada (notificación de cambio en una tabla)
+    def mark_dirty(self):
+        with self._lock:
+            self._dirty = True
+            self._counters["notificaciones"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                "cargada": self._facts is not None,
+                "antiguedad_s": round(time.time() - self._loaded_at, 1) if self._loaded_at else None,
+                "pendiente_recarga": self._dirty,
+                "ttl_segundos": self.ttl,
+                "esperando_reintento": self._backing_off(),
+            })
+        return stats
+
+# Hilo que escucha NOTIFY sobre una conexión propia (LISTEN no funciona con conexiones del pool)
+class ChangeListener:
+    def __init__(self, store, channel=FACTS_CHANNEL, poll_interval=5.0):
+        self.store = store
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.connected = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="facts-listener", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=self.poll_interval + 1)
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self._listen()
+                backoff = 1.0
+            except Exception as e:
+                self.connected = False
+                logger.error("Conexión LISTEN perdida: %s", e)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+
+    def _listen(self):
+        conn = psycopg2.connect(**connection_params())
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+            self.connected = True
+            # Pudo haber cambios mientras no escuchábamos
+            self.store.mark_dirty()
+            while not self._stop.is_set():
+                if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                conn.poll()
+                tables = set()
+                while conn.notifies:
+                    tables.add(conn.notifies.pop(0).payload)
+                for table in tables:
+                    handle_table_change(self.store, table)
+        finally:
+            self.connected = False
+            conn.close()
+
+# Una tabla cambió: recargar los hechos y descartar las respuestas que dependían de ella
+def handle_table_change(store, table):
+    store.mark_dirty()
+    try:
+        agent = resolve_agent(table)
+    except ValueError:
+        agent = None
+    invalidate_responses(agent)
+    invalidate_semantic(agent)
+
+_store = None
+_store_lock = threading.Lock()
+_listener = None
+
+# Almacén único del proceso, creado en el primer uso
+def get_fact_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = FactStore()
+    return _store
+
+# Hechos actuales para los agentes (None si está desactivado o la BD no responde)
+def current_facts():
+    if not FACTS_ENABLED:
+        return None
+    return get_fact_store().snapshot()
+
+# Carga inicial y escucha de cambios; llamar al arrancar el servicio
+def start_facts():
+    global _listener
+    if not FACTS_ENABLED:
+        return False
+    loaded = get_fact_store().refresh()
+    if FACTS_LISTEN and _listener is None:
+        _listener = ChangeListener(get_fact_store())
+        _listener.start()
+    return loaded
+
+def stop_facts():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def get_facts_stats():
+    if not FACTS_ENABLED:
+        return {"habilitado": False}
+    stats = {"habilitado": True, **get_fact_store().stats()}
+    stats["escuchando_cambios"] = _listener is not None and _listener.connected
+    return stats
@@ -0,0 +1,144 @@
+# backend_fanout.py
+
+import asyncio
+import logging
+import os
+import time
+from dotenv import load_dotenv
+from backend_financiero import financial_agent_stream
+from backend_marketing import marketing_agent_stream
+from backend_mercado import market_agent_stream
+from backend_deadline import REASON_DEADLINE, REQUEST_DEADLINE_MAX, current_scope
+from backend_metrics import ERRORS
+from backend_ollama import OLLAMA_MODEL, stream_response_async
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Segundos máximos para la pregunta a los tres agentes (y el resumen); lo que no termine se descarta
+FANOUT_DEADLINE = float(os.getenv("FANOUT_DEADLINE", "30"))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", OLLAMA_MODEL)
+SUMMARY_AGENT = "resumen"
+
+DEADLINE_MESSAGE = "Plazo agotado antes de terminar la respuesta."
+
+# Eventos de un agente, etiquetados con su nombre, hacia la cola común
+async def pump(agent, events, queue):
+    start = time.perf_counter()
+    try:
+        async for event in events:
+            await queue.put({**event, "agente": agent})
+    except Exception as e:
+        logger.exception("Ocurrió una excepción en el agente %s", agent)
+        ERRORS.inc(agent, "inesperado")
+        await queue.put({"tipo": "error", "agente": agent, "detalle": f"Error inesperado: {e}"})
+    finally:
+        # Marca de fin del agente (también si se canceló por el plazo)
+        queue.put_nowait({"tipo": "_terminado", "agente": agent, "ms": round((time.perf_counter() - start) * 1000, 1)})
+
+def summary_prompt(user_input, answers):
+    sections = "\n\n".join(f"Asesor {agent}:\n{answer}" for agent, answer in answers.items())
+    return f"""Eres un consultor de negocios. Tres asesores respondieron a la misma pregunta.
+
+Pregunta del usuario:
+{user_input}
+
+{sections}
+
+Resume en un solo párrafo breve las recomendaciones principales, sin repetir datos innecesarios.
+
+Resumen:
+"""
+
+# Preguntar a los tres agentes a la vez con un plazo común.
+# Produce sus eventos intercalados (cada uno con "agente") a medida que llegan, un resumen opcional
+# y un evento "completo" con la respuesta y el tiempo de cada agente.
+async def ask_all(user_input, producto=None, objetivo=None, presupuesto=None, categoria=None, ubicacion=None,
+                  deadline=None, summary=False, modo=None):
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    # Acotado a REQUEST_DEADLINE_MAX, como el plazo de la cabecera X-Deadline-Ms
+    deadline_at = loop.time() + min(deadline or FANOUT_DEADLINE, REQUEST_DEADLINE_MAX)
+    streams = {
+        "financiero": financial_agent_stream(user_input, modo=modo),
+        "marketing": marketing_agent_stream(user_input, producto, objetivo, presupuesto, modo=modo),
+        "mercado": market_agent_stream(user_input, categoria, ubicacion, modo=modo),
+    }
+    queue = asyncio.Queue()
+    tasks = {agent: loop.create_task(pump(agent, events, queue)) for agent, events in streams.items()}
+    answers = {}
+    results = {agent: {"estado": "pendiente"} for agent in streams}
+    pending = set(streams)
+
+    try:
+        while pending:
+            remaining = deadline_at - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            agent = event["agente"]
+            if event["tipo"] == "_terminado":
+                pending.discard(agent)
+                results[agent]["ms"] = event["ms"]
+                continue
+            if event["tipo"] == "fin":
+                answers[agent] = event["respuesta"]
+                results[agent].update({"estado": "completa", "respuesta": event["respuesta"], "tiempos": event.get("tiempos")})
+            elif event["tipo"] == "error":
+                results[agent].update({"estado": "error", "detalle": event["detalle"]})
+            yield event
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+    # Los que no terminaron a tiempo: avisar con un error propio del agente
+    if pending and current_scope() is not None:
+        # Sus generaciones se cancelaron por el plazo, no por el cliente
+        current_scope().reason = REASON_DEADLINE
+    for agent in pending:
+        results[agent].update({"estado": "plazo_agotado", "ms": round((time.perf_counter() - start) * 1000, 1)})
+        yield {"tipo": "error", "agente": agent, "detalle": DEADLINE_MESSAGE}
+
+    if summary and answers:
+        events = stream_response_async(summary_prompt(user_input, answers), SUMMARY_MODEL, SUMMARY_AGENT)
+        summary_text = None
+        try:
+            while True:
+                remaining = deadline_at - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                event = await asyncio.wait_for(events.__anext__(), remaining)
+                if event["tipo"] == "fin":
+                    summary_text = event["respuesta"]
+                yield {**event, "agente": SUMMARY_AGENT}
+        except StopAsyncIteration:
+            pass
+        except asyncio.TimeoutError:
+            yield {"tipo": "error", "agente": SUMMARY_AGENT, "detalle": DEADLINE_MESSAGE}
+        finally:
+            await events.aclose()
+        results[SUMMARY_AGENT] = {"estado": "completa" if summary_text else "plazo_agotado", "respuesta": summary_text}
+
+    timed = {agent: result["ms"] for agent, result in results.items() if result.get("ms") is not None}
+    yield {
+        "tipo": "completo",
+        "respuestas": results,
+        "tiempos": {
+            "por_agente_ms": timed,
+            "mas_lento": max(timed, key=timed.get) if timed else None,
+            "total_ms": round((time.perf_counter() - start) * 1000, 1),
+        },
+    }
+
+# Versión no streaming: sólo el evento "completo" con todas las respuestas
+async def ask_all_collect(*args, **kwargs):
+    final = None
+    async for event in ask_all(*args, **kwargs):
+        if event["tipo"] == "completo":
+            final = event
+    return final
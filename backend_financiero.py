@@ -1,100 +1,91 @@
 # backend_financiero.py
 
-import ollama
+import logging
 import os
-import psycopg2
+import time
 from dotenv import load_dotenv
+from backend_context import fit_items
+from backend_coalesce import coalesce, coalesce_stream, coalesce_sync, flight_key
+from backend_db import DB_CONNECTION_ERROR, db_connection, execute_prepared, register_statement, run_db
+from backend_facts import current_facts
+from backend_metrics import DB_SECONDS, ERRORS, INTENTS, PROMPT_SECONDS, REQUESTS
+from backend_intents import INTENT_CALIFICO_PRESTAMO, INTENT_DOCUMENTOS, INTENT_OPCIONES_PEQUENO, UNROUTED, match_intent, resolve_intent
+from backend_deadline import DeadlineExceeded
+from backend_scheduler import AdmissionError
+from backend_sessions import get_user_input, session_prompt
+from backend_tiers import select_model
+from backend_tracing import STAGE_DB_QUERY, STAGE_PROMPT, span
+from backend_templates import register_template, template_events, template_for
+from backend_logging import configure_logging
+from backend_ollama import OLLAMA_MODEL, generate_response, generate_response_async, stream_response_async
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuración de Ollama y el modelo
-MODEL_NAME = "llama3.2:3b"
+MODEL_NAME = os.getenv("MODEL_FINANCIERO", OLLAMA_MODEL)
+AGENT_NAME = "financiero"
+# Cierre del prompt; en sesiones se repite al final de cada turno
+ANSWER_LABEL = "Respuesta del asesor:"
 
-# Conexión a la base de datos PostgreSQL
-def get_db_connection():
-    try:
-        return psycopg2.connect(
-            host=os.getenv("HOST"),
-            user="postgres",
-            password=os.getenv("PASSWORD"),
-            dbname=os.getenv("DATABASE"),
-            port=os.getenv("PORT")
-        )
-    except Exception as e:
-        print(f"[ERROR] Error al conectar a la base de datos: {e}")
-        return None
+# Consultas fijas del agente, preparadas en el servidor una vez por conexión
+# Las listas salen de la más frecuente a la menos: si el presupuesto de contexto recorta, quedan las más comunes
+SQL_OPCIONES_PEQUENO = register_statement("fin_opciones_pequeno", """
+    SELECT btrim(opcion)
+    FROM agente_financiero, unnest(string_to_array(opciones_financiamiento, ',')) AS opcion
+    WHERE tipo_negocio = 'Pequeño'
+    GROUP BY 1
+    ORDER BY COUNT(*) DESC, 1
+""")
+SQL_ENDEUDAMIENTO_INGRESOS = register_statement("fin_endeudamiento_ingresos", """
+    SELECT COUNT(*), COUNT(*) FILTER (WHERE nivel_endeudamiento = 'Bajo'), AVG(ingresos_mensuales)
+    FROM agente_financiero
+""")
+SQL_DOCUMENTOS = register_statement("fin_documentos", """
+    SELECT btrim(documento)
+    FROM agente_financiero, unnest(string_to_array(documentos_necesarios, ',')) AS documento
+    GROUP BY 1
+    ORDER BY COUNT(*) DESC, 1
+""")
 
 # Función para obtener respuesta del modelo Llama 3.2 utilizando Ollama
-def get_llama_response(prompt):
-    try:
-        # Imprimir el prompt para depuración
-        print("\n[DEBUG] Prompt enviado al modelo:")
-        print(prompt)
-        print("\n[DEBUG] Generando respuesta...\n")
-
-        response = ''
-        for chunk in ollama.generate(model=MODEL_NAME, prompt=prompt):
-            # Agregar declaración de depuración
-            print(f"[DEBUG] Chunk recibido: {repr(chunk)}")
-            # Manejar diferentes tipos de 'chunk'
-            if isinstance(chunk, tuple):
-                if chunk[0] == 'response':
-                    # Asegurarse de que chunk[1] es una cadena de texto
-                    response += str(chunk[1])
-            elif isinstance(chunk, dict):
-                if 'response' in chunk:
-                    response += str(chunk['response'])
-            elif isinstance(chunk, str):
-                # Ignorar strings que no están bajo 'response'
-                pass
-
-        # Limpiar la respuesta
-        response = response.strip()
-
-        # Si la respuesta está vacía, informar
-        if not response:
-            print("[DEBUG] La respuesta del modelo está vacía.")
-            return "Lo siento, no pude generar una respuesta adecuada. Por favor, intenta con otra pregunta."
-
-        # Limitar la respuesta a los primeros 3 párrafos
-        paragraphs = response.split('\n\n')
-        limited_response = '\n\n'.join(paragraphs[:3])
-
-        return limited_response
-    except Exception as e:
-        print(f"[ERROR] Ocurrió una excepción en get_llama_response: {e}")
-        return f"Error inesperado: {e}"
+# question/context/params permiten reutilizar respuestas de preguntas equivalentes (caché semántica)
+# model: el que elige backend_tiers (por defecto, MODEL_NAME)
+def get_llama_response(prompt, question=None, context=None, model=None, params=None):
+    return generate_response(prompt, model or MODEL_NAME, AGENT_NAME, question, context, params)
 
-# Función para manejar la lógica del agente financiero
-def financial_agent(conversation):
-    try:
-        # Verificar si 'conversation' es una cadena de texto
-        if isinstance(conversation, str):
-            # Convertir la cadena en una lista de diccionarios
-            conversation = [{"role": "user", "content": conversation}]
-        
-        # Ahora, 'conversation' es una lista de diccionarios
-        user_input = conversation[-1]['content']
-
-        # Establecer conexión con la base de datos
-        conn = get_db_connection()
-        if not conn:
-            return "Error al conectar con la base de datos."
+# Variante asíncrona para los endpoints de FastAPI
+async def get_llama_response_async(prompt, question=None, context=None, session=None, model=None, params=None):
+    return await generate_response_async(prompt, model or MODEL_NAME, AGENT_NAME, question, context, session, params)
 
-        cursor = conn.cursor()
-
-        # Obtener datos relevantes de la base de datos
-        data = query_financial_data(user_input, cursor)
-
-        # Cerrar la conexión a la base de datos
-        cursor.close()
-        conn.close()
+# Consultar la base de datos para la pregunta; devuelve (conectado, datos)
+def lookup_financial_data(user_input, intent=UNROUTED):
+    # Los hechos precalculados evitan la consulta; sin ellos se va a la BD
+    facts = current_facts()
+    if facts is not None:
+        with span(STAGE_DB_QUERY):
+            return True, financial_data_from_facts(user_input, facts, intent=intent)
+    try:
+        # Tomar una conexión del pool compartido; se devuelve al salir del bloque
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                # Obtener datos relevantes de la base de datos
+                with span(STAGE_DB_QUERY):
+                    data = query_financial_data(user_input, cursor, intent=intent)
+    except Exception as e:
+        logger.error("Error al conectar a la base de datos: %s", e, extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "bd")
+        return False, None
+    return True, data
 
-        # Determinar si se encontró información en la base de datos
-        if data:
-            # Construir el prompt con datos
-            prompt = f"""Eres un asesor financiero experto que proporciona respuestas detalladas basadas en los datos proporcionados.
+# Construir el prompt del asesor a partir de los datos encontrados
+def build_financial_prompt(user_input, data):
+    # Determinar si se encontró información en la base de datos
+    if data:
+        # Construir el prompt con datos
+        return f"""Eres un asesor financiero experto que proporciona respuestas detalladas basadas en los datos proporcionados.
 
 Datos relevantes:
 {data}
@@ -106,9 +97,8 @@ Proporciona una respuesta concisa y práctica, limitada a un máximo de 3 párra
 
 Respuesta del asesor:
 """
-        else:
-            # Construir el prompt sin datos, indicando que uses tu conocimiento
-            prompt = f"""Eres un asesor financiero experto. Proporciona una respuesta concisa y práctica a la siguiente pregunta, basada en tu conocimiento. No incluyas ninguna metadata ni información adicional.
+    # Construir el prompt sin datos, indicando que uses tu conocimiento
+    return f"""Eres un asesor financiero experto. Proporciona una respuesta concisa y práctica a la siguiente pregunta, basada en tu conocimiento. No incluyas ninguna metadata ni información adicional.
 
 Pregunta del usuario:
 {user_input}
@@ -118,63 +108,195 @@ Proporciona una respuesta concisa y práctica, limitada a un máximo de 3 párra
 Respuesta del asesor:
 """
 
-        # Obtener respuesta del modelo
-        assistant_reply = get_llama_response(prompt)
-        return assistant_reply
+# Consulta y generación de una pregunta (compartidas entre peticiones idénticas en curso)
+def answer_financial(user_input, modo=None):
+    # Intención de la pregunta, resuelta una sola vez para la consulta, la plantilla y el nivel de modelo
+    intent = match_intent(AGENT_NAME, user_input)
+    with DB_SECONDS.time(AGENT_NAME):
+        connected, data = lookup_financial_data(user_input, intent=intent)
+    if not connected:
+        return DB_CONNECTION_ERROR
+
+    # Si los datos ya responden la pregunta, plantilla en lugar del modelo (ver backend_templates)
+    respuesta = template_for(AGENT_NAME, user_input, data, modo, intent=intent)
+    if respuesta is not None:
+        return respuesta
+
+    with PROMPT_SECONDS.time(AGENT_NAME), span(STAGE_PROMPT):
+        prompt = build_financial_prompt(user_input, data)
+
+    # Obtener respuesta del modelo: el pequeño o el grande según la pregunta y la carga (ver backend_tiers)
+    model = select_model(AGENT_NAME, MODEL_NAME, user_input, data, intent=intent)
+    return get_llama_response(prompt, user_input, data, model)
+
+async def answer_financial_async(user_input, session=None, modo=None):
+    intent = match_intent(AGENT_NAME, user_input)
+    with DB_SECONDS.time(AGENT_NAME):
+        connected, data = await run_db(lookup_financial_data, user_input, intent=intent)
+    if not connected:
+        return DB_CONNECTION_ERROR
+
+    respuesta = template_for(AGENT_NAME, user_input, data, modo, session, intent=intent)
+    if respuesta is not None:
+        return respuesta
+
+    with PROMPT_SECONDS.time(AGENT_NAME), span(STAGE_PROMPT):
+        prompt = session_prompt(session, build_financial_prompt(user_input, data), user_input, data, ANSWER_LABEL)
+
+    # Obtener respuesta del modelo
+    model = select_model(AGENT_NAME, MODEL_NAME, user_input, data, session, intent=intent)
+    return await get_llama_response_async(prompt, user_input, data, session, model)
+
+async def stream_financial(user_input, session=None, modo=None):
+    start = time.perf_counter()
+    intent = match_intent(AGENT_NAME, user_input)
+    try:
+        with DB_SECONDS.time(AGENT_NAME) as timer:
+            connected, data = await run_db(lookup_financial_data, user_input, intent=intent)
+        db_ms = timer.ms
+    except DeadlineExceeded as e:
+        ERRORS.inc(AGENT_NAME, "plazo")
+        yield {"tipo": "error", "detalle": str(e)}
+        return
     except Exception as e:
-        print(f"[ERROR] Ocurrió una excepción en financial_agent: {e}")
+        logger.exception("Ocurrió una excepción en financial_agent_stream", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "inesperado")
+        yield {"tipo": "error", "detalle": f"Error inesperado: {e}"}
+        return
+
+    if not connected:
+        yield {"tipo": "error", "detalle": DB_CONNECTION_ERROR}
+        return
+
+    respuesta = template_for(AGENT_NAME, user_input, data, modo, session, intent=intent)
+    if respuesta is not None:
+        for event in template_events(respuesta, start, {"db_ms": db_ms}):
+            yield event
+        return
+
+    with PROMPT_SECONDS.time(AGENT_NAME), span(STAGE_PROMPT):
+        prompt = session_prompt(session, build_financial_prompt(user_input, data), user_input, data, ANSWER_LABEL)
+    model = select_model(AGENT_NAME, MODEL_NAME, user_input, data, session, intent=intent)
+    async for event in stream_response_async(prompt, model, AGENT_NAME, tiempos={"db_ms": db_ms},
+                                             question=user_input, context=data, session=session):
+        yield event
+
+# Función para manejar la lógica del agente financiero
+def financial_agent(conversation, modo=None):
+    REQUESTS.inc(AGENT_NAME, "sync")
+    try:
+        user_input = get_user_input(conversation)
+        # Si la misma pregunta ya está en curso, esperar su respuesta en lugar de repetirla
+        return coalesce_sync(flight_key(AGENT_NAME, user_input, modo), lambda: answer_financial(user_input, modo))
+    except Exception as e:
+        logger.exception("Ocurrió una excepción en financial_agent", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "inesperado")
+        return f"Error inesperado: {e}"
+
+# Versión asíncrona: la consulta corre en el executor de BD y la generación no bloquea
+async def financial_agent_async(conversation, session=None, modo=None):
+    REQUESTS.inc(AGENT_NAME, "async")
+    try:
+        user_input = get_user_input(conversation)
+        key = flight_key(AGENT_NAME, user_input, session.id if session else None, modo)
+        return await coalesce(key, lambda: answer_financial_async(user_input, session, modo))
+    except (AdmissionError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.exception("Ocurrió una excepción en financial_agent_async", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "inesperado")
         return f"Error inesperado: {e}"
 
-def query_financial_data(question, cursor):
+# Versión en streaming: la consulta se hace antes y luego se reenvían los tokens del modelo
+# Quien llega con la misma pregunta en curso recibe los tokens ya emitidos y sigue el stream en vivo
+async def financial_agent_stream(conversation, session=None, modo=None):
+    REQUESTS.inc(AGENT_NAME, "stream")
+    try:
+        user_input = get_user_input(conversation)
+    except Exception as e:
+        logger.exception("Ocurrió una excepción en financial_agent_stream", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "inesperado")
+        yield {"tipo": "error", "detalle": f"Error inesperado: {e}"}
+        return
+
+    key = flight_key(AGENT_NAME, user_input, session.id if session else None, modo)
+    async for event in coalesce_stream(key, lambda: stream_financial(user_input, session, modo)):
+        yield event
+
+# Textos de datos para el prompt, comunes a la consulta a la BD y a la instantánea de hechos
+def describe_opciones_pequeno(opciones):
+    if opciones:
+        return fit_items(AGENT_NAME, "Opciones de financiamiento para negocios pequeños: ", opciones)
+    return None
+
+def describe_endeudamiento(total, bajo_pct, promedio_ingresos):
+    if total:
+        return f"El nivel de endeudamiento promedio es {bajo_pct:.2f}% bajo. Los ingresos mensuales promedio son ${promedio_ingresos:.2f}."
+    return None
+
+def describe_documentos(documentos):
+    if documentos:
+        return fit_items(AGENT_NAME, "Documentos necesarios para pedir un préstamo: ", documentos)
+    return None
+
+def db_opciones_pequeno(cursor):
+    execute_prepared(cursor, SQL_OPCIONES_PEQUENO)
+    return describe_opciones_pequeno([row[0] for row in cursor.fetchall()])
+
+def db_califico_prestamo(cursor):
+    # El conteo y los promedios los calcula PostgreSQL en una sola fila
+    execute_prepared(cursor, SQL_ENDEUDAMIENTO_INGRESOS)
+    total, bajos, promedio_ingresos = cursor.fetchone()
+    return describe_endeudamiento(total, bajos / total * 100 if total else None, promedio_ingresos or 0)
+
+def db_documentos(cursor):
+    execute_prepared(cursor, SQL_DOCUMENTOS)
+    return describe_documentos([row[0] for row in cursor.fetchall()])
+
+def facts_califico_prestamo(facts):
+    endeudamiento = facts["endeudamiento"]
+    return describe_endeudamiento(endeudamiento["filas"], endeudamiento["bajo_pct"], endeudamiento["ingresos_promedio"])
+
+# Consulta que atiende cada intención (ver backend_intents)
+DB_HANDLERS = {
+    INTENT_OPCIONES_PEQUENO: db_opciones_pequeno,
+    INTENT_CALIFICO_PRESTAMO: db_califico_prestamo,
+    INTENT_DOCUMENTOS: db_documentos,
+}
+FACT_HANDLERS = {
+    INTENT_OPCIONES_PEQUENO: lambda facts: describe_opciones_pequeno(facts["opciones_pequeno"]),
+    INTENT_CALIFICO_PRESTAMO: facts_califico_prestamo,
+    INTENT_DOCUMENTOS: lambda facts: describe_documentos(facts["documentos"]),
+}
+
+# Respuesta sin modelo: la lista de documentos ya es la respuesta
+def template_documentos(data):
+    return (f"{data}.\n\nTenlos listos y actualizados antes de presentar la solicitud; "
+            "la entidad puede pedir documentación adicional según el monto y el tipo de préstamo.")
+
+register_template(AGENT_NAME, INTENT_DOCUMENTOS, template_documentos)
+
+def query_financial_data(question, cursor, intent=UNROUTED):
     try:
-        if "financiamiento" in question.lower() and "negocio pequeño" in question.lower():
-            cursor.execute("""
-                SELECT opciones_financiamiento FROM agente_financiero
-                WHERE tipo_negocio = 'Pequeño';
-            """)
-            rows = cursor.fetchall()
-            if rows:
-                opciones = set()
-                for row in rows:
-                    opciones.update(map(str.strip, row[0].split(",")))
-                return f"Opciones de financiamiento para negocios pequeños: {', '.join(opciones)}"
-            else:
-                return None
-        elif "califico para un préstamo" in question.lower():
-            cursor.execute("""
-                SELECT nivel_endeudamiento, ingresos_mensuales FROM agente_financiero;
-            """)
-            rows = cursor.fetchall()
-            if rows:
-                niveles = [row[0] for row in rows]
-                ingresos = [row[1] for row in rows]
-                if len(ingresos) == 0:
-                    promedio_ingresos = 0
-                else:
-                    promedio_ingresos = sum(ingresos) / len(ingresos)
-                return f"El nivel de endeudamiento promedio es {niveles.count('Bajo') / len(niveles) * 100:.2f}% bajo. Los ingresos mensuales promedio son ${promedio_ingresos:.2f}."
-            else:
-                return None
-        elif "documentos necesito" in question.lower() and "préstamo" in question.lower():
-            cursor.execute("""
-                SELECT DISTINCT documentos_necesarios FROM agente_financiero;
-            """)
-            rows = cursor.fetchall()
-            if rows:
-                documentos = set()
-                for row in rows:
-                    documentos.update(map(str.strip, row[0].split(",")))
-                return f"Documentos necesarios para pedir un préstamo: {', '.join(documentos)}"
-            else:
-                return None
-        else:
-            return None
+        intent = resolve_intent(AGENT_NAME, question, intent)
+        INTENTS.inc(AGENT_NAME, intent or "ninguna", "bd")
+        handler = DB_HANDLERS.get(intent)
+        return handler(cursor) if handler else None
     except Exception as e:
-        print(f"[ERROR] Ocurrió una excepción en query_financial_data: {e}")
+        logger.exception("Ocurrió una excepción en query_financial_data", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "bd")
         return None
 
+# Mismas respuestas que query_financial_data, leídas de la instantánea de hechos
+def financial_data_from_facts(question, facts, intent=UNROUTED):
+    intent = resolve_intent(AGENT_NAME, question, intent)
+    INTENTS.inc(AGENT_NAME, intent or "ninguna", "hechos")
+    handler = FACT_HANDLERS.get(intent)
+    return handler(facts) if handler else None
+
 if __name__ == "__main__":
     # Interacción en la terminal para depuración
+    configure_logging()
     conversation = []
     print("Agente Financiero 💰")
     print("Escribe 'salir' para terminar la conversación.")
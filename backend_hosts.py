@@ -0,0 +1,311 @@
+# backend_hosts.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+import httpx
+import ollama
+from dotenv import load_dotenv
+from backend_metrics import counter
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Servidores de Ollama separados por comas; si no se indican, el OLLAMA_HOST habitual de Ollama,
+# OLLAMA_API_URL del .env o el servidor local
+def parse_hosts(value):
+    return [url.strip().rstrip("/") for url in value.split(",") if url.strip()]
+
+OLLAMA_HOST_URLS = parse_hosts(
+    os.getenv("OLLAMA_HOSTS") or os.getenv("OLLAMA_HOST") or os.getenv("OLLAMA_API_URL") or "http://localhost:11434"
+)
+# Generaciones simultáneas que atiende cada servidor sin degradarse (su OLLAMA_NUM_PARALLEL)
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+# Tamaño del pool de conexiones HTTP hacia cada servidor
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+# Reparto: "pendientes" (menos peticiones en curso) o "ewma" (en curso × latencia media hasta el primer fragmento)
+OLLAMA_ROUTING = os.getenv("OLLAMA_ROUTING", "pendientes")
+# Fallos seguidos que sacan a un servidor del reparto hasta que la comprobación de salud lo recupere
+OLLAMA_EJECT_FAILURES = int(os.getenv("OLLAMA_EJECT_FAILURES", "3"))
+# Segundos entre comprobaciones de salud (GET /api/tags) y tiempo máximo de cada una; 0 = desactivadas
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "2"))
+# Peso de la última muestra en la media móvil de latencia
+EWMA_ALPHA = 0.3
+
+HOST_FAILURES = counter("ollama_host_fallos_total", "Fallos de conexión o 5xx por servidor de Ollama.", ("host",))
+HOST_RETRIES = counter("ollama_reintentos_total", "Generaciones reintentadas en otro servidor antes del primer token.", ("host",))
+
+class NoHostAvailable(Exception):
+    pass
+
+# Un 4xx es un error de la petición (modelo inexistente, opciones inválidas): otro servidor respondería igual
+def is_host_failure(error):
+    return not (isinstance(error, ollama.ResponseError) and 400 <= error.status_code < 500)
+
+# Un servidor de Ollama con sus propios clientes (conexiones keep-alive) y su estado de carga y salud
+class OllamaHost:
+    def __init__(self, url, max_connections=OLLAMA_MAX_CONNECTIONS):
+        self.url = url
+        self.max_connections = max_connections
+        self.outstanding = 0
+        self.ewma_s = None
+        self.failures = 0
+        self.healthy = True
+        self.counters = {"peticiones": 0, "fallos": 0, "expulsiones": 0}
+        self._client = None
+        self._async_client = None
+        self._async_client_loop = None
+
+    def limits(self):
+        return httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+
+    def client(self):
+        if self._client is None:
+            self._client = ollama.Client(host=self.url, limits=self.limits())
+        return self._client
+
+    # Las conexiones de httpx pertenecen a un event loop; recrear el cliente si cambia
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            self._async_client_loop = loop
+            self._async_client = ollama.AsyncClient(host=self.url, limits=self.limits())
+        return self._async_client
+
+    async def close(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+            self._async_client_loop = None
+
+    # Latencia estimada de una petición nueva; sin muestras, la de los demás no penaliza
+    def score(self, routing):
+        if routing == "ewma":
+            return (self.outstanding + 1) * (self.ewma_s or 0.0), self.outstanding
+        return self.outstanding, self.ewma_s or 0.0
+
+    def stats(self):
+        return {
+            "host": self.url,
+            "sano": self.healthy,
+            "en_curso": self.outstanding,
+            "ewma_primer_fragmento_ms": round(self.ewma_s * 1000, 1) if self.ewma_s is not None else None,
+            "fallos_seguidos": self.failures,
+            **self.counters,
+        }
+
+# Reparte las generaciones entre los servidores y reintenta en otro los fallos anteriores al primer fragmento
+class HostPool:
+    def __init__(self, urls=None, routing=OLLAMA_ROUTING, eject_failures=OLLAMA_EJECT_FAILURES):
+        self.hosts = [OllamaHost(url) for url in (urls or OLLAMA_HOST_URLS)]
+        self.routing = routing
+        self.eject_failures = eject_failures
+        self.retries = 0
+        # Los contadores se tocan desde el event loop y desde los hilos del modo síncrono
+        self._lock = threading.Lock()
+
+    # Servidor menos cargado entre los sanos; si todos están expulsados, se prueba con todos
+    def pick(self, exclude=()):
+        with self._lock:
+            candidates = [host for host in self.hosts if host not in exclude]
+            healthy = [host for host in candidates if host.healthy]
+            candidates = healthy or candidates
+            if not candidates:
+                raise NoHostAvailable("Ningún servidor de Ollama disponible")
+            return min(candidates, key=lambda host: host.score(self.routing))
+
+    def _acquire(self, host):
+        with self._lock:
+            host.outstanding += 1
+            host.counters["peticiones"] += 1
+
+    def _release(self, host):
+        with self._lock:
+            host.outstanding -= 1
+
+    def _record_success(self, host, first_chunk_s):
+        with self._lock:
+            host.failures = 0
+            host.healthy = True
+            host.ewma_s = first_chunk_s if host.ewma_s is None else EWMA_ALPHA * first_chunk_s + (1 - EWMA_ALPHA) * host.ewma_s
+
+    def _record_failure(self, host, error):
+        HOST_FAILURES.inc(host.url)
+        with self._lock:
+            host.counters["fallos"] += 1
+            host.failures += 1
+            if host.healthy and host.failures >= self.eject_failures:
+                host.healthy = False
+                host.counters["expulsiones"] += 1
+                logger.warning("Servidor de Ollama %s fuera del reparto tras %s fallos: %s", host.url, host.failures, error)
+
+    def _record_retry(self, host):
+        HOST_RETRIES.inc(host.url)
+        with self._lock:
+            self.retries += 1
+
+    # Generación en streaming con failover: el primer fragmento se lee aquí, así un fallo de conexión
+    # o un 5xx se reintenta en otro servidor; a partir del primer token los errores se propagan
+    @asynccontextmanager
+    async def stream(self, **kwargs):
+        tried = []
+        while True:
+            host = self.pick(exclude=tried)
+            self._acquire(host)
+            start = time.perf_counter()
+            stream = None
+            try:
+                stream = await host.async_client().generate(stream=True, **kwargs)
+                first = await stream.__anext__()
+                break
+            except StopAsyncIteration:
+                first = None
+                break
+            except BaseException as e:
+                # También al cancelarse la petición: el servidor no debe quedar contado como ocupado
+                self._release(host)
+                if stream is not None:
+                    await stream.aclose()
+                if not isinstance(e, Exception) or not is_host_failure(e):
+                    raise
+                self._record_failure(host, e)
+                tried.append(host)
+                if len(tried) == len(self.hosts):
+                    raise
+                self._record_retry(host)
+                logger.warning("Reintentando la generación en otro servidor tras fallar %s: %s", host.url, e)
+
+        self._record_success(host, time.perf_counter() - start)
+        try:
+            yield chain_first(first, stream)
+        except Exception as e:
+            # Corte a mitad de la generación: ya no se reintenta, pero cuenta para la salud del servidor
+            if is_host_failure(e):
+                self._record_failure(host, e)
+            raise
+        finally:
+            self._release(host)
+            await stream.aclose()
+
+    # Versión bloqueante para el modo síncrono
+    @contextmanager
+    def stream_sync(self, **kwargs):
+        tried = []
+        while True:
+            host = self.pick(exclude=tried)
+            self._acquire(host)
+            start = time.perf_counter()
+            stream = None
+            try:
+                stream = host.client().generate(stream=True, **kwargs)
+                first = next(stream)
+                break
+            except StopIteration:
+                first = None
+                break
+            except BaseException as e:
+                self._release(host)
+                if stream is not None:
+                    stream.close()
+                if not isinstance(e, Exception) or not is_host_failure(e):
+                    raise
+                self._record_failure(host, e)
+                tried.append(host)
+                if len(tried) == len(self.hosts):
+                    raise
+                self._record_retry(host)
+                logger.warning("Reintentando la generación en otro servidor tras fallar %s: %s", host.url, e)
+
+        self._record_success(host, time.perf_counter() - start)
+        try:
+            yield chain_first_sync(first, stream)
+        except Exception as e:
+            # Corte a mitad de la generación: ya no se reintenta, pero cuenta para la salud del servidor
+            if is_host_failure(e):
+                self._record_failure(host, e)
+            raise
+        finally:
+            self._release(host)
+            stream.close()
+
+    # Comprobación activa: un servidor expulsado vuelve al reparto cuando responde
+    async def check_health(self, timeout=OLLAMA_HEALTH_TIMEOUT):
+        async def check(host):
+            try:
+                await asyncio.wait_for(host.async_client().list(), timeout)
+            except Exception as e:
+                if host.healthy:
+                    logger.warning("Servidor de Ollama %s no responde: %s", host.url, e)
+                with self._lock:
+                    if host.healthy:
+                        host.counters["expulsiones"] += 1
+                    host.healthy = False
+                return
+            with self._lock:
+                if not host.healthy:
+                    logger.info("Servidor de Ollama %s de nuevo en el reparto", host.url)
+                host.healthy = True
+                host.failures = 0
+        await asyncio.gather(*(check(host) for host in self.hosts))
+
+    async def run_health_checks(self, interval=OLLAMA_HEALTH_INTERVAL):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(interval)
+
+    def healthy_hosts(self):
+        return [host for host in self.hosts if host.healthy]
+
+    async def close(self):
+        for host in self.hosts:
+            await host.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "reparto": self.routing,
+                "servidores": len(self.hosts),
+                "sanos": sum(host.healthy for host in self.hosts),
+                "reintentos": self.retries,
+                "hosts": [host.stats() for host in self.hosts],
+            }
+
+async def chain_first(first, stream):
+    if first is None:
+        return
+    yield first
+    async for chunk in stream:
+        yield chunk
+
+def chain_first_sync(first, stream):
+    if first is None:
+        return
+    yield first
+    yield from stream
+
+_pool = HostPool()
+_health_task = None
+
+def get_host_pool():
+    return _pool
+
+def get_host_stats():
+    return _pool.stats()
+
+def start_health_checks():
+    global _health_task
+    if OLLAMA_HEALTH_INTERVAL > 0 and len(_pool.hosts) > 1:
+        _health_task = asyncio.create_task(_pool.run_health_checks())
+
+async def stop_health_checks():
+    global _health_task
+    if _health_task is not None:
+        _health_task.cancel()
+        await asyncio.gather(_health_task, return_exceptions=True)
+        _health_task = None
@@ -0,0 +1,139 @@
+# backend_intents.py
+
+import threading
+import unicodedata
+
+# Valor por defecto de los parámetros intent: la intención aún no se calculó (None ya significa "ninguna")
+UNROUTED = object()
+
+# Plegado general: minúsculas y NFKD, que separa la tilde de la letra; al codificar a ASCII se
+# descartan las tildes (y signos como ¿)
+def _fold_unicode(text):
+    return unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+
+# El mismo plegado, precalculado para los 256 caracteres latin-1 (los del español): una tabla de
+# bytes.translate en lugar de NFKD, unas tres veces más rápida. Los espacios ASCII (tabuladores,
+# saltos de línea) pasan a ser espacios; ¼ ½ ¾ se pliegan a varios caracteres y quedan fuera
+_FOLD_TABLE = bytearray(range(256))
+_FOLD_DELETE = bytearray()
+for _byte in range(256):
+    _folded = " " if chr(_byte).isascii() and chr(_byte).isspace() else _fold_unicode(chr(_byte))
+    if len(_folded) == 1:
+        _FOLD_TABLE[_byte] = ord(_folded)
+    elif not _folded:
+        _FOLD_DELETE.append(_byte)
+_FOLD_TABLE, _FOLD_DELETE = bytes(_FOLD_TABLE), bytes(_FOLD_DELETE)
+
+# Minúsculas, sin tildes y con espacios normalizados: "Préstamo" y "prestamo" coinciden
+def fold_text(text):
+    try:
+        text = text.encode("latin-1").translate(_FOLD_TABLE, _FOLD_DELETE).decode("ascii")
+    except UnicodeError:
+        # Fuera de latin-1 (o ¼ ½ ¾, que siguen sin ser ASCII): plegado general
+        return " ".join(_fold_unicode(text).split())
+    # Partir y unir sólo si hay espacios repetidos
+    if "  " in text:
+        return " ".join(text.split())
+    return text.strip()
+
+# Regla de enrutado: la pregunta debe contener todas las frases (en cualquier orden)
+class IntentRule:
+    def __init__(self, agent, name, phrases, params=()):
+        self.agent = agent
+        self.name = name
+        self.phrases = tuple(fold_text(phrase) for phrase in phrases)
+        # Datos adicionales que la consulta necesita (los frontends piden estos campos)
+        self.params = tuple(params)
+
+    def matches(self, folded):
+        for phrase in self.phrases:
+            if phrase not in folded:
+                return False
+        return True
+
+# Registro compartido de intenciones. La pregunta se pliega una vez y cada regla se comprueba con
+# búsquedas de subcadena (en C): más barato que una expresión regular combinada, que en Python
+# cuesta más que la cadena if/elif entera; con el plegado por tabla, el registro no es más lento
+# que las cadenas if/elif anteriores (ver benchmarks/enrutado_intenciones.py)
+class IntentRegistry:
+    def __init__(self):
+        self._rules = []
+        self._by_agent = {}
+        # (intención, frases) por agente: lo que recorre match, sin una llamada por regla
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def register(self, agent, name, *phrases, params=()):
+        with self._lock:
+            rule = IntentRule(agent, name, phrases, params)
+            self._rules.append(rule)
+            self._by_agent[agent] = self._by_agent.get(agent, ()) + (rule,)
+            self._routes[agent] = self._routes.get(agent, ()) + ((rule.name, rule.phrases),)
+        return name
+
+    def rules(self, agent=None):
+        if agent is not None:
+            return list(self._by_agent.get(agent, ()))
+        return list(self._rules)
+
+    # Reglas del agente cuyas frases están todas en la pregunta, en orden de registro
+    def matches(self, agent, text):
+        rules = self._by_agent.get(agent, ())
+        if not rules:
+            return []
+        folded = fold_text(text)
+        return [rule for rule in rules if rule.matches(folded)]
+
+    # Primera regla que coincide: la intención que atiende el agente
+    def match(self, agent, text):
+        if agent not in self._routes:
+            return None
+        return self.match_folded(agent, fold_text(text))
+
+    # Igual que match, con la pregunta ya plegada (fold_text)
+    def match_folded(self, agent, folded):
+        for name, phrases in self._routes.get(agent, ()):
+            for phrase in phrases:
+                if phrase not in folded:
+                    break
+            else:
+                return name
+        return None
+
+_registry = IntentRegistry()
+
+def register_intent(agent, name, *phrases, params=()):
+    return _registry.register(agent, name, *phrases, params=params)
+
+# Intención de la pregunta; se calcula una vez por petición y se pasa a la consulta, la plantilla
+# y la elección de modelo (parámetro intent)
+def match_intent(agent, text):
+    return _registry.match(agent, text)
+
+# La intención recibida o, si no se calculó (UNROUTED), la de la pregunta
+def resolve_intent(agent, text, intent=UNROUTED):
+    return match_intent(agent, text) if intent is UNROUTED else intent
+
+# Campos adicionales que piden las intenciones presentes en la pregunta (para los frontends)
+def required_params(agent, text):
+    params = []
+    for rule in _registry.matches(agent, text):
+        params.extend(param for param in rule.params if param not in params)
+    return params
+
+def get_intent_registry():
+    return _registry
+
+# Intenciones de los tres agentes, en el mismo orden de prioridad que las antiguas cadenas if/elif
+INTENT_OPCIONES_PEQUENO = register_intent("financiero", "opciones_pequeno", "financiamiento", "negocio pequeño")
+INTENT_CALIFICO_PRESTAMO = register_intent("financiero", "califico_prestamo", "califico para un préstamo")
+INTENT_DOCUMENTOS = register_intent("financiero", "documentos", "documentos necesito", "préstamo")
+
+INTENT_CREAR_CAMPANA = register_intent(
+    "marketing", "crear_campana", "crear", "campaña de marketing",
+    params=("producto", "objetivo", "presupuesto"),
+)
+
+INTENT_PRECIO_PROMEDIO = register_intent("mercado", "precio_promedio", "precio promedio", "producto similar", params=("categoria",))
+INTENT_COMPETIDORES = register_intent("mercado", "competidores", "competitivo", "mi zona", params=("ubicacion",))
+INTENT_MERCADOS_INTERNACIONALES = register_intent("mercado", "mercados_internacionales", "mercados internacionales", "interesados")
@@ -0,0 +1,59 @@
+# backend_logging.py
+
+import json
+import logging
+import os
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+# DEBUG muestra prompts y fragmentos; por defecto sólo INFO y superiores (los debug no se formatean)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "texto" para la consola, "json" para recolectores de logs (una línea JSON por evento)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "texto")
+
+# Atributos propios de LogRecord; el resto son los campos pasados en extra={...}
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+def record_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+            **record_fields(record),
+        }
+        if record.exc_info:
+            entry["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# Texto legible con los campos extra al final (clave=valor)
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value!r}" for key, value in fields.items())
+        return text
+
+_configured = False
+
+# Configurar el logging del proceso una sola vez (main.py y los modos de terminal)
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    global _configured
+    if _configured:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    _configured = True
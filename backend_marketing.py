@@ -1,90 +1,120 @@
-import ollama
+import logging
 import os
-import psycopg2
+import time
 from dotenv import load_dotenv
 from typing import Optional  # Asegúrate de importar Optional
+from backend_context import fit_items
+from backend_coalesce import coalesce, coalesce_stream, coalesce_sync, flight_key
+from backend_db import DB_CONNECTION_ERROR, db_connection, execute_prepared, register_statement, run_db
+from backend_metrics import DB_SECONDS, ERRORS, INTENTS, PROMPT_SECONDS, REQUESTS
+from backend_intents import INTENT_CREAR_CAMPANA, UNROUTED, match_intent, resolve_intent
+from backend_deadline import DeadlineExceeded
+from backend_scheduler import AdmissionError
+from backend_sessions import get_user_input, session_prompt
+from backend_tiers import select_model
+from backend_tracing import STAGE_DB_QUERY, STAGE_PROMPT, span
+from backend_templates import template_events, template_for
+from backend_ollama import OLLAMA_MODEL, generate_response, generate_response_async, stream_response_async
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuración de Ollama y el modelo
-MODEL_NAME = "llama3.2:3b"
+MODEL_NAME = os.getenv("MODEL_MARKETING", OLLAMA_MODEL)
+AGENT_NAME = "marketing"
+# Cierre del prompt; en sesiones se repite al final de cada turno
+ANSWER_LABEL = "Respuesta del experto:"
 
-# Conexión a la base de datos PostgreSQL
-def get_db_connection():
-    try:
-        return psycopg2.connect(
-            host=os.getenv("HOST"),
-            user="postgres",
-            password=os.getenv("PASSWORD"),
-            dbname=os.getenv("DATABASE"),
-            port=os.getenv("PORT")
-        )
-    except Exception as e:
-        print(f"[ERROR] Error al conectar a la base de datos: {e}")
-        return None
+# Campañas de referencia que se incluyen en el prompt (la más cercana al presupuesto y las siguientes)
+MKT_TOP_K = int(os.getenv("MKT_TOP_K", "1"))
+# Buscar primero campañas del mismo producto/objetivo (si la tabla tiene esas columnas); por defecto
+# la recomendación sólo depende del presupuesto, como antes
+MKT_FILTER_BY_PRODUCT = os.getenv("MKT_FILTRAR_PRODUCTO", "0") == "1"
 
-# Función para obtener respuesta del modelo Llama 3.2 utilizando Ollama
-def get_llama_response(prompt):
-    try:
-        # Imprimir el prompt para depuración
-        print("\n[DEBUG] Prompt enviado al modelo:")
-        print(prompt)
-        print("\n[DEBUG] Generando respuesta...\n")
-
-        response = ''
-        for chunk in ollama.generate(model=MODEL_NAME, prompt=prompt):
-            # Agregar declaración de depuración
-            print(f"[DEBUG] Chunk recibido: {repr(chunk)}")
-            # Manejar diferentes tipos de 'chunk'
-            if isinstance(chunk, tuple):
-                if chunk[0] == 'response':
-                    response += str(chunk[1])
-            elif isinstance(chunk, dict):
-                if 'response' in chunk:
-                    response += str(chunk['response'])
-            elif isinstance(chunk, str):
-                # Ignorar strings que no están bajo 'response'
-                pass
-
-        # Limpiar la respuesta
-        response = response.strip()
-
-        # Si la respuesta está vacía, informar
-        if not response:
-            print("[DEBUG] La respuesta del modelo está vacía.")
-            return "Lo siento, no pude generar una respuesta adecuada. Por favor, intenta con otra pregunta."
-
-        # Limitar la respuesta a los primeros 3 párrafos
-        paragraphs = response.split('\n\n')
-        limited_response = '\n\n'.join(paragraphs[:3])
-
-        return limited_response
-    except Exception as e:
-        print(f"[ERROR] Ocurrió una excepción en get_llama_response: {e}")
-        return f"Error inesperado: {e}"
+# Consultas fijas del agente, preparadas en el servidor una vez por conexión
+# Vecinos más cercanos al presupuesto con dos sondas, cada una con su índice: las k filas más
+# cercanas por debajo (migrations/004) y las k por encima (migrations/003), y se ordena
+# sólo ese puñado con el mismo desempate que antes (presupuesto DESC, rendimiento DESC)
+SQL_CAMPANAS_CERCANAS = register_statement("mkt_campanas_cercanas", """
+    SELECT plataformas_utilizadas, tipo_anuncio, estrategias_utilizadas, presupuesto
+    FROM (
+        (SELECT plataformas_utilizadas, tipo_anuncio, estrategias_utilizadas, presupuesto, rendimiento
+         FROM agente_marketing
+         WHERE presupuesto <= $1
+         ORDER BY presupuesto DESC, rendimiento DESC
+         LIMIT $2)
+        UNION ALL
+        (SELECT plataformas_utilizadas, tipo_anuncio, estrategias_utilizadas, presupuesto, rendimiento
+         FROM agente_marketing
+         WHERE presupuesto > $1
+         ORDER BY presupuesto ASC, rendimiento DESC
+         LIMIT $2)
+    ) AS candidatas
+    ORDER BY ABS(presupuesto - $1) ASC, presupuesto DESC, rendimiento DESC
+    LIMIT $2
+""")
+# Igual, restringida a campañas del mismo producto/objetivo (NULL = sin filtro)
+SQL_CAMPANAS_CERCANAS_FILTRADAS = register_statement("mkt_campanas_cercanas_filtradas", """
+    SELECT plataformas_utilizadas, tipo_anuncio, estrategias_utilizadas, presupuesto
+    FROM (
+        (SELECT plataformas_utilizadas, tipo_anuncio, estrategias_utilizadas, presupuesto, rendimiento
+         FROM agente_marketing
+         WHERE presupuesto <= $1
+           AND ($3::text IS NULL OR producto = $3) AND ($4::text IS NULL OR objetivo = $4)
+         ORDER BY presupuesto DESC, rendimiento DESC
+         LIMIT $2)
+        UNION ALL
+        (SELECT plataformas_utilizadas, tipo_anuncio, estrategias_utilizadas, presupuesto, rendimiento
+         FROM agente_marketing
+         WHERE presupuesto > $1
+           AND ($3::text IS NULL OR producto = $3) AND ($4::text IS NULL OR objetivo = $4)
+         ORDER BY presupuesto ASC, rendimiento DESC
+         LIMIT $2)
+    ) AS candidatas
+    ORDER BY ABS(presupuesto - $1) ASC, presupuesto DESC, rendimiento DESC
+    LIMIT $2
+""")
+SQL_COLUMNAS_MARKETING = register_statement("mkt_columnas", """
+    SELECT column_name FROM information_schema.columns
+    WHERE table_name = 'agente_marketing'
+""")
 
-# Función para manejar la lógica del agente de marketing
-def marketing_agent(user_input: str, producto: Optional[str] = None, objetivo: Optional[str] = None, presupuesto: Optional[float] = None) -> str:
-    try:
-        # Establecer conexión con la base de datos
-        conn = get_db_connection()
-        if not conn:
-            return "Error al conectar con la base de datos."
+# None hasta consultar el esquema: el filtro sólo se usa si la tabla tiene producto y objetivo
+_has_filter_columns = None
 
-        cursor = conn.cursor()
+# Función para obtener respuesta del modelo Llama 3.2 utilizando Ollama
+# question/context/params permiten reutilizar respuestas de preguntas equivalentes (caché semántica)
+# model: el que elige backend_tiers (por defecto, MODEL_NAME)
+def get_llama_response(prompt, question=None, context=None, model=None, params=None):
+    return generate_response(prompt, model or MODEL_NAME, AGENT_NAME, question, context, params)
 
-        # Obtener datos relevantes de la base de datos
-        data = query_marketing_data(user_input, cursor, producto, objetivo, presupuesto)
+# Variante asíncrona para los endpoints de FastAPI
+async def get_llama_response_async(prompt, question=None, context=None, session=None, model=None, params=None):
+    return await generate_response_async(prompt, model or MODEL_NAME, AGENT_NAME, question, context, session, params)
 
-        # Cerrar la conexión a la base de datos
-        cursor.close()
-        conn.close()
+# Consultar la base de datos para la pregunta; devuelve (conectado, datos)
+def lookup_marketing_data(user_input: str, producto: Optional[str] = None, objetivo: Optional[str] = None, presupuesto: Optional[float] = None, intent=UNROUTED):
+    try:
+        # Tomar una conexión del pool compartido; se devuelve al salir del bloque
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                # Obtener datos relevantes de la base de datos
+                with span(STAGE_DB_QUERY):
+                    data = query_marketing_data(user_input, cursor, producto, objetivo, presupuesto, intent=intent)
+    except Exception as e:
+        logger.error("Error al conectar a la base de datos: %s", e, extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "bd")
+        return False, None
+    return True, data
 
-        # Determinar si se encontró información en la base de datos
-        if data:
-            # Construir el prompt con datos
-            prompt = f"""Eres un experto en marketing que proporciona consejos y estrategias basadas en datos.
+# Construir el prompt del experto a partir de los datos encontrados
+def build_marketing_prompt(user_input: str, data: Optional[str]) -> str:
+    # Determinar si se encontró información en la base de datos
+    if data:
+        # Construir el prompt con datos
+        return f"""Eres un experto en marketing que proporciona consejos y estrategias basadas en datos.
 
 Datos relevantes:
 {data}
@@ -96,9 +126,8 @@ Proporciona una respuesta concisa y práctica, limitada a un máximo de 3 párra
 
 Respuesta del experto:
 """
-        else:
-            # Construir el prompt sin datos, indicando que uses tu conocimiento
-            prompt = f"""Eres un experto en marketing. Proporciona una respuesta concisa y práctica a la siguiente pregunta, basada en tu conocimiento. No incluyas ninguna metadata ni información adicional.
+    # Construir el prompt sin datos, indicando que uses tu conocimiento
+    return f"""Eres un experto en marketing. Proporciona una respuesta concisa y práctica a la siguiente pregunta, basada en tu conocimiento. No incluyas ninguna metadata ni información adicional.
 
 Pregunta del usuario:
 {user_input}
@@ -108,29 +137,156 @@ Proporciona una respuesta concisa y práctica, limitada a un máximo de 3 párra
 Respuesta del experto:
 """
 
-        # Obtener respuesta del modelo
-        assistant_reply = get_llama_response(prompt)
-        return assistant_reply
+# Consulta y generación de una pregunta (compartidas entre peticiones idénticas en curso)
+def answer_marketing(user_input: str, producto: Optional[str] = None, objetivo: Optional[str] = None, presupuesto: Optional[float] = None, modo: Optional[str] = None) -> str:
+    # Intención de la pregunta, resuelta una sola vez para la consulta, la plantilla y el nivel de modelo
+    intent = match_intent(AGENT_NAME, user_input)
+    with DB_SECONDS.time(AGENT_NAME):
+        connected, data = lookup_marketing_data(user_input, producto, objetivo, presupuesto, intent=intent)
+    if not connected:
+        return DB_CONNECTION_ERROR
+
+    # Si los datos ya responden la pregunta, plantilla en lugar del modelo (ver backend_templates)
+    respuesta = template_for(AGENT_NAME, user_input, data, modo, intent=intent)
+    if respuesta is not None:
+        return respuesta
+
+    with PROMPT_SECONDS.time(AGENT_NAME), span(STAGE_PROMPT):
+        prompt = build_marketing_prompt(user_input, data)
+
+    # Obtener respuesta del modelo: el pequeño o el grande según la pregunta y la carga (ver backend_tiers)
+    model = select_model(AGENT_NAME, MODEL_NAME, user_input, data, intent=intent)
+    return get_llama_response(prompt, user_input, data, model, {"producto": producto, "objetivo": objetivo, "presupuesto": presupuesto})
+
+async def answer_marketing_async(user_input: str, producto: Optional[str] = None, objetivo: Optional[str] = None, presupuesto: Optional[float] = None, session=None, modo: Optional[str] = None) -> str:
+    intent = match_intent(AGENT_NAME, user_input)
+    with DB_SECONDS.time(AGENT_NAME):
+        connected, data = await run_db(lookup_marketing_data, user_input, producto, objetivo, presupuesto, intent=intent)
+    if not connected:
+        return DB_CONNECTION_ERROR
+
+    respuesta = template_for(AGENT_NAME, user_input, data, modo, session, intent=intent)
+    if respuesta is not None:
+        return respuesta
+
+    with PROMPT_SECONDS.time(AGENT_NAME), span(STAGE_PROMPT):
+        prompt = session_prompt(session, build_marketing_prompt(user_input, data), user_input, data, ANSWER_LABEL)
+
+    # Obtener respuesta del modelo
+    model = select_model(AGENT_NAME, MODEL_NAME, user_input, data, session, intent=intent)
+    return await get_llama_response_async(prompt, user_input, data, session, model, {"producto": producto, "objetivo": objetivo, "presupuesto": presupuesto})
+
+async def stream_marketing(user_input: str, producto: Optional[str] = None, objetivo: Optional[str] = None, presupuesto: Optional[float] = None, session=None, modo: Optional[str] = None):
+    start = time.perf_counter()
+    intent = match_intent(AGENT_NAME, user_input)
+    try:
+        with DB_SECONDS.time(AGENT_NAME) as timer:
+            connected, data = await run_db(lookup_marketing_data, user_input, producto, objetivo, presupuesto, intent=intent)
+        db_ms = timer.ms
+    except DeadlineExceeded as e:
+        ERRORS.inc(AGENT_NAME, "plazo")
+        yield {"tipo": "error", "detalle": str(e)}
+        return
+    except Exception as e:
+        logger.exception("Ocurrió una excepción en marketing_agent_stream", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "inesperado")
+        yield {"tipo": "error", "detalle": f"Error inesperado: {e}"}
+        return
+
+    if not connected:
+        yield {"tipo": "error", "detalle": DB_CONNECTION_ERROR}
+        return
+
+    respuesta = template_for(AGENT_NAME, user_input, data, modo, session, intent=intent)
+    if respuesta is not None:
+        for event in template_events(respuesta, start, {"db_ms": db_ms}):
+            yield event
+        return
+
+    with PROMPT_SECONDS.time(AGENT_NAME), span(STAGE_PROMPT):
+        prompt = session_prompt(session, build_marketing_prompt(user_input, data), user_input, data, ANSWER_LABEL)
+    model = select_model(AGENT_NAME, MODEL_NAME, user_input, data, session, intent=intent)
+    async for event in stream_response_async(prompt, model, AGENT_NAME, tiempos={"db_ms": db_ms},
+                                             question=user_input, context=data, session=session,
+                                             params={"producto": producto, "objetivo": objetivo, "presupuesto": presupuesto}):
+        yield event
+
+# Función para manejar la lógica del agente de marketing
+def marketing_agent(user_input: str, producto: Optional[str] = None, objetivo: Optional[str] = None, presupuesto: Optional[float] = None, modo: Optional[str] = None) -> str:
+    REQUESTS.inc(AGENT_NAME, "sync")
+    try:
+        # Los frontends pasan la conversación completa: responder al último mensaje
+        user_input = get_user_input(user_input)
+        # Si la misma pregunta ya está en curso, esperar su respuesta en lugar de repetirla
+        key = flight_key(AGENT_NAME, user_input, producto, objetivo, presupuesto, modo)
+        return coalesce_sync(key, lambda: answer_marketing(user_input, producto, objetivo, presupuesto, modo))
     except Exception as e:
-        print(f"[ERROR] Ocurrió una excepción en marketing_agent: {e}")
+        logger.exception("Ocurrió una excepción en marketing_agent", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "inesperado")
         return f"Error inesperado: {e}"
 
-def query_marketing_data(question: str, cursor, producto: Optional[str] = None, objetivo: Optional[str] = None, presupuesto: Optional[float] = None) -> Optional[str]:
+# Versión asíncrona: la consulta corre en el executor de BD y la generación no bloquea
+async def marketing_agent_async(user_input: str, producto: Optional[str] = None, objetivo: Optional[str] = None, presupuesto: Optional[float] = None, session=None, modo: Optional[str] = None) -> str:
+    REQUESTS.inc(AGENT_NAME, "async")
+    try:
+        key = flight_key(AGENT_NAME, user_input, producto, objetivo, presupuesto, session.id if session else None, modo)
+        return await coalesce(key, lambda: answer_marketing_async(user_input, producto, objetivo, presupuesto, session, modo))
+    except (AdmissionError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.exception("Ocurrió una excepción en marketing_agent_async", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "inesperado")
+        return f"Error inesperado: {e}"
+
+# Versión en streaming: la consulta se hace antes y luego se reenvían los tokens del modelo
+# Quien llega con la misma pregunta en curso recibe los tokens ya emitidos y sigue el stream en vivo
+async def marketing_agent_stream(user_input: str, producto: Optional[str] = None, objetivo: Optional[str] = None, presupuesto: Optional[float] = None, session=None, modo: Optional[str] = None):
+    REQUESTS.inc(AGENT_NAME, "stream")
+    key = flight_key(AGENT_NAME, user_input, producto, objetivo, presupuesto, session.id if session else None, modo)
+    async for event in coalesce_stream(key, lambda: stream_marketing(user_input, producto, objetivo, presupuesto, session, modo)):
+        yield event
+
+def has_filter_columns(cursor):
+    global _has_filter_columns
+    if _has_filter_columns is None:
+        execute_prepared(cursor, SQL_COLUMNAS_MARKETING)
+        columns = {row[0] for row in cursor.fetchall()}
+        _has_filter_columns = {"producto", "objetivo"} <= columns
+    return _has_filter_columns
+
+# Las k campañas con presupuesto más cercano; con filter_by_product, primero las del mismo
+# producto/objetivo (sólo si la tabla tiene esas columnas)
+def nearest_campaigns(cursor, presupuesto: float, k: int = MKT_TOP_K, producto: Optional[str] = None, objetivo: Optional[str] = None,
+                      filter_by_product: bool = MKT_FILTER_BY_PRODUCT):
+    if filter_by_product and (producto or objetivo) and has_filter_columns(cursor):
+        execute_prepared(cursor, SQL_CAMPANAS_CERCANAS_FILTRADAS, (presupuesto, k, producto, objetivo))
+        rows = cursor.fetchall()
+        if rows:
+            return rows
+        # Sin campañas del mismo producto/objetivo: recomendar por presupuesto
+    execute_prepared(cursor, SQL_CAMPANAS_CERCANAS, (presupuesto, k))
+    return cursor.fetchall()
+
+def query_marketing_data(question: str, cursor, producto: Optional[str] = None, objetivo: Optional[str] = None, presupuesto: Optional[float] = None, intent=UNROUTED) -> Optional[str]:
     try:
-        if "crear" in question.lower() and "campaña de marketing" in question.lower():
+        intent = resolve_intent(AGENT_NAME, question, intent)
+        INTENTS.inc(AGENT_NAME, intent or "ninguna", "bd")
+        if intent == INTENT_CREAR_CAMPANA:
             if producto and objetivo and presupuesto is not None:
-                cursor.execute("""
-                    SELECT plataformas_utilizadas, tipo_anuncio, estrategias_utilizadas, presupuesto
-                    FROM agente_marketing
-                    ORDER BY ABS(presupuesto - %s) ASC, presupuesto DESC, rendimiento DESC
-                    LIMIT 1;
-                """, (presupuesto,))
-                row = cursor.fetchone()
-                if row:
+                rows = nearest_campaigns(cursor, presupuesto, MKT_TOP_K, producto, objetivo)
+                if rows:
+                    row = rows[0]
                     data = (
                         f"Para tu producto '{producto}' con el objetivo '{objetivo}' y presupuesto ${presupuesto:.2f}, "
                         f"se recomienda usar plataformas '{row[0]}', tipo de anuncio '{row[1]}' y estrategias '{row[2]}'."
                     )
+                    if len(rows) > 1:
+                        # Ordenadas por cercanía al presupuesto: el presupuesto de contexto recorta las más lejanas
+                        otras = [
+                            f"presupuesto ${campana[3]:.2f}: plataformas '{campana[0]}', tipo de anuncio '{campana[1]}', estrategias '{campana[2]}'"
+                            for campana in rows[1:]
+                        ]
+                        data = fit_items(AGENT_NAME, f"{data} Otras campañas con presupuesto cercano: ", otras, "; ", ".")
                 else:
                     data = None
                 return data
@@ -139,5 +295,6 @@ def query_marketing_data(question: str, cursor, producto: Optional[str] = None,
         else:
             return None
     except Exception as e:
-        print(f"[ERROR] Ocurrió una excepción en query_marketing_data: {e}")
+        logger.exception("Ocurrió una excepción en query_marketing_data", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "bd")
         return None
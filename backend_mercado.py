@@ -1,93 +1,91 @@
-import ollama
+import logging
 import os
-import psycopg2
+import time
 from dotenv import load_dotenv
 from typing import Optional  # Asegúrate de importar Optional
+from backend_context import fit_items
+from backend_coalesce import coalesce, coalesce_stream, coalesce_sync, flight_key
+from backend_db import DB_CONNECTION_ERROR, db_connection, execute_prepared, register_statement, run_db
+from backend_facts import current_facts
+from backend_metrics import DB_SECONDS, ERRORS, INTENTS, PROMPT_SECONDS, REQUESTS
+from backend_intents import INTENT_COMPETIDORES, INTENT_MERCADOS_INTERNACIONALES, INTENT_PRECIO_PROMEDIO, UNROUTED, match_intent, resolve_intent
+from backend_deadline import DeadlineExceeded
+from backend_scheduler import AdmissionError
+from backend_sessions import get_user_input, session_prompt
+from backend_tiers import select_model
+from backend_tracing import STAGE_DB_QUERY, STAGE_PROMPT, span
+from backend_templates import register_template, template_events, template_for
+from backend_ollama import OLLAMA_MODEL, generate_response, generate_response_async, stream_response_async
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuración de Ollama y el modelo
-MODEL_NAME = "llama3.2:3b"
+MODEL_NAME = os.getenv("MODEL_MERCADO", OLLAMA_MODEL)
+AGENT_NAME = "mercado"
+# Cierre del prompt; en sesiones se repite al final de cada turno
+ANSWER_LABEL = "Respuesta del analista:"
 
-# Conexión a la base de datos PostgreSQL
-def get_db_connection():
-    try:
-        return psycopg2.connect(
-            host=os.getenv("HOST"),
-            user="postgres",
-            password=os.getenv("PASSWORD"),
-            dbname=os.getenv("DATABASE"),
-            port=os.getenv("PORT")
-        )
-    except Exception as e:
-        print(f"[ERROR] Error al conectar a la base de datos: {e}")
-        return None
+# Consultas fijas del agente, preparadas en el servidor una vez por conexión
+SQL_PRECIO_PROMEDIO = register_statement("mer_precio_promedio", """
+    SELECT AVG(precio) FROM agente_mercado
+    WHERE categoria = $1
+""")
+SQL_COMPETIDORES = register_statement("mer_competidores", """
+    SELECT COUNT(*) FROM agente_mercado
+    WHERE ubicacion_geografica = $1
+""")
+# De más a menos frecuente: si el presupuesto de contexto recorta, quedan los mercados más comunes
+SQL_MERCADOS_INTERNACIONALES = register_statement("mer_mercados_internacionales", """
+    SELECT btrim(mercado)
+    FROM agente_mercado, unnest(string_to_array(mercados_internacionales, ',')) AS mercado
+    GROUP BY 1
+    ORDER BY COUNT(*) DESC, 1
+""")
 
 # Función para obtener respuesta del modelo Llama 3.2 utilizando Ollama
-def get_llama_response(prompt):
-    try:
-        # Imprimir el prompt para depuración
-        print("\n[DEBUG] Prompt enviado al modelo:")
-        print(prompt)
-        print("\n[DEBUG] Generando respuesta...\n")
-
-        response = ''
-        for chunk in ollama.generate(model=MODEL_NAME, prompt=prompt):
-            # Agregar declaración de depuración
-            print(f"[DEBUG] Chunk recibido: {repr(chunk)}")
-            # Manejar diferentes tipos de 'chunk'
-            if isinstance(chunk, tuple):
-                if chunk[0] == 'response':
-                    response += str(chunk[1])
-            elif isinstance(chunk, dict):
-                if 'response' in chunk:
-                    response += str(chunk['response'])
-            elif isinstance(chunk, str):
-                # Ignorar strings que no están bajo 'response'
-                pass
-
-        # Limpiar la respuesta
-        response = response.strip()
-
-        # Si la respuesta está vacía, informar
-        if not response:
-            print("[DEBUG] La respuesta del modelo está vacía.")
-            return "Lo siento, no pude generar una respuesta adecuada. Por favor, intenta con otra pregunta."
-
-        # Limitar la respuesta a los primeros 3 párrafos
-        paragraphs = response.split('\n\n')
-        limited_response = '\n\n'.join(paragraphs[:3])
-
-        return limited_response
-    except Exception as e:
-        print(f"[ERROR] Ocurrió una excepción en get_llama_response: {e}")
-        return f"Error inesperado: {e}"
+# question/context/params permiten reutilizar respuestas de preguntas equivalentes (caché semántica)
+# model: el que elige backend_tiers (por defecto, MODEL_NAME)
+def get_llama_response(prompt, question=None, context=None, model=None, params=None):
+    return generate_response(prompt, model or MODEL_NAME, AGENT_NAME, question, context, params)
 
-# Función para manejar la lógica del agente de mercado
-def market_agent(user_input: str, categoria: Optional[str] = None, ubicacion: Optional[str] = None) -> str:
-    try:
-        # Establecer conexión con la base de datos
-        conn = get_db_connection()
-        if not conn:
-            return "Error al conectar con la base de datos."
-
-        cursor = conn.cursor()
-
-        # Obtener datos relevantes de la base de datos
-        data = query_market_data(user_input, cursor, categoria, ubicacion)
+# Variante asíncrona para los endpoints de FastAPI
+async def get_llama_response_async(prompt, question=None, context=None, session=None, model=None, params=None):
+    return await generate_response_async(prompt, model or MODEL_NAME, AGENT_NAME, question, context, session, params)
 
-        # Imprimir los datos obtenidos para depuración
-        print(f"[DEBUG] Datos obtenidos de la base de datos: {data}")
+# Consultar la base de datos para la pregunta; devuelve (conectado, datos)
+def lookup_market_data(user_input: str, categoria: Optional[str] = None, ubicacion: Optional[str] = None, intent=UNROUTED):
+    # Los hechos precalculados evitan la consulta; sin ellos se va a la BD
+    facts = current_facts()
+    if facts is not None:
+        with span(STAGE_DB_QUERY):
+            data = market_data_from_facts(user_input, facts, categoria, ubicacion, intent=intent)
+        logger.debug("Datos obtenidos de la instantánea de hechos: %s", data)
+        return True, data
+    try:
+        # Tomar una conexión del pool compartido; se devuelve al salir del bloque
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                # Obtener datos relevantes de la base de datos
+                with span(STAGE_DB_QUERY):
+                    data = query_market_data(user_input, cursor, categoria, ubicacion, intent=intent)
+    except Exception as e:
+        logger.error("Error al conectar a la base de datos: %s", e, extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "bd")
+        return False, None
 
-        # Cerrar la conexión a la base de datos
-        cursor.close()
-        conn.close()
+    # Registrar los datos obtenidos (nivel DEBUG)
+    logger.debug("Datos obtenidos de la base de datos: %s", data)
+    return True, data
 
-        # Determinar si se encontró información en la base de datos
-        if data:
-            # Construir el prompt con datos
-            prompt = f"""Eres un analista de mercado experto que proporciona insights basados en datos.
+# Construir el prompt del analista a partir de los datos encontrados
+def build_market_prompt(user_input: str, data: Optional[str]) -> str:
+    # Determinar si se encontró información en la base de datos
+    if data:
+        # Construir el prompt con datos
+        prompt = f"""Eres un analista de mercado experto que proporciona insights basados en datos.
 
 Datos relevantes:
 {data}
@@ -99,9 +97,9 @@ Proporciona una respuesta concisa y práctica, limitada a un máximo de 3 párra
 
 Respuesta del analista:
 """
-        else:
-            # Construir el prompt sin datos, indicando que uses tu conocimiento
-            prompt = f"""Eres un analista de mercado experto. Proporciona una respuesta concisa y práctica a la siguiente pregunta, basada en tu conocimiento. No incluyas ninguna metadata ni información adicional.
+    else:
+        # Construir el prompt sin datos, indicando que uses tu conocimiento
+        prompt = f"""Eres un analista de mercado experto. Proporciona una respuesta concisa y práctica a la siguiente pregunta, basada en tu conocimiento. No incluyas ninguna metadata ni información adicional.
 
 Pregunta del usuario:
 {user_input}
@@ -111,63 +109,213 @@ Proporciona una respuesta concisa y práctica, limitada a un máximo de 3 párra
 Respuesta del analista:
 """
 
-        # Imprimir el prompt construido para depuración
-        print(f"[DEBUG] Prompt construido:\n{prompt}")
+    # Registrar el prompt construido (nivel DEBUG)
+    logger.debug("Prompt construido:\n%s", prompt)
+    return prompt
+
+# Consulta y generación de una pregunta (compartidas entre peticiones idénticas en curso)
+def answer_market(user_input: str, categoria: Optional[str] = None, ubicacion: Optional[str] = None, modo: Optional[str] = None) -> str:
+    # Intención de la pregunta, resuelta una sola vez para la consulta, la plantilla y el nivel de modelo
+    intent = match_intent(AGENT_NAME, user_input)
+    with DB_SECONDS.time(AGENT_NAME):
+        connected, data = lookup_market_data(user_input, categoria, ubicacion, intent=intent)
+    if not connected:
+        return DB_CONNECTION_ERROR
 
-        # Obtener respuesta del modelo
-        assistant_reply = get_llama_response(prompt)
-        return assistant_reply
+    # Si los datos ya responden la pregunta, plantilla en lugar del modelo (ver backend_templates)
+    respuesta = template_for(AGENT_NAME, user_input, data, modo, intent=intent)
+    if respuesta is not None:
+        return respuesta
+
+    with PROMPT_SECONDS.time(AGENT_NAME), span(STAGE_PROMPT):
+        prompt = build_market_prompt(user_input, data)
+
+    # Obtener respuesta del modelo: el pequeño o el grande según la pregunta y la carga (ver backend_tiers)
+    model = select_model(AGENT_NAME, MODEL_NAME, user_input, data, intent=intent)
+    return get_llama_response(prompt, user_input, data, model, {"categoria": categoria, "ubicacion": ubicacion})
+
+async def answer_market_async(user_input: str, categoria: Optional[str] = None, ubicacion: Optional[str] = None, session=None, modo: Optional[str] = None) -> str:
+    intent = match_intent(AGENT_NAME, user_input)
+    with DB_SECONDS.time(AGENT_NAME):
+        connected, data = await run_db(lookup_market_data, user_input, categoria, ubicacion, intent=intent)
+    if not connected:
+        return DB_CONNECTION_ERROR
+
+    respuesta = template_for(AGENT_NAME, user_input, data, modo, session, intent=intent)
+    if respuesta is not None:
+        return respuesta
+
+    with PROMPT_SECONDS.time(AGENT_NAME), span(STAGE_PROMPT):
+        prompt = session_prompt(session, build_market_prompt(user_input, data), user_input, data, ANSWER_LABEL)
+
+    # Obtener respuesta del modelo
+    model = select_model(AGENT_NAME, MODEL_NAME, user_input, data, session, intent=intent)
+    return await get_llama_response_async(prompt, user_input, data, session, model, {"categoria": categoria, "ubicacion": ubicacion})
+
+async def stream_market(user_input: str, categoria: Optional[str] = None, ubicacion: Optional[str] = None, session=None, modo: Optional[str] = None):
+    start = time.perf_counter()
+    intent = match_intent(AGENT_NAME, user_input)
+    try:
+        with DB_SECONDS.time(AGENT_NAME) as timer:
+            connected, data = await run_db(lookup_market_data, user_input, categoria, ubicacion, intent=intent)
+        db_ms = timer.ms
+    except DeadlineExceeded as e:
+        ERRORS.inc(AGENT_NAME, "plazo")
+        yield {"tipo": "error", "detalle": str(e)}
+        return
     except Exception as e:
-        print(f"[ERROR] Ocurrió una excepción en market_agent: {e}")
+        logger.exception("Ocurrió una excepción en market_agent_stream", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "inesperado")
+        yield {"tipo": "error", "detalle": f"Error inesperado: {e}"}
+        return
+
+    if not connected:
+        yield {"tipo": "error", "detalle": DB_CONNECTION_ERROR}
+        return
+
+    respuesta = template_for(AGENT_NAME, user_input, data, modo, session, intent=intent)
+    if respuesta is not None:
+        for event in template_events(respuesta, start, {"db_ms": db_ms}):
+            yield event
+        return
+
+    with PROMPT_SECONDS.time(AGENT_NAME), span(STAGE_PROMPT):
+        prompt = session_prompt(session, build_market_prompt(user_input, data), user_input, data, ANSWER_LABEL)
+    model = select_model(AGENT_NAME, MODEL_NAME, user_input, data, session, intent=intent)
+    async for event in stream_response_async(prompt, model, AGENT_NAME, tiempos={"db_ms": db_ms},
+                                             question=user_input, context=data, session=session,
+                                             params={"categoria": categoria, "ubicacion": ubicacion}):
+        yield event
+
+# Función para manejar la lógica del agente de mercado
+def market_agent(user_input: str, categoria: Optional[str] = None, ubicacion: Optional[str] = None, modo: Optional[str] = None) -> str:
+    REQUESTS.inc(AGENT_NAME, "sync")
+    try:
+        # Los frontends pasan la conversación completa: responder al último mensaje
+        user_input = get_user_input(user_input)
+        # Si la misma pregunta ya está en curso, esperar su respuesta en lugar de repetirla
+        key = flight_key(AGENT_NAME, user_input, categoria, ubicacion, modo)
+        return coalesce_sync(key, lambda: answer_market(user_input, categoria, ubicacion, modo))
+    except Exception as e:
+        logger.exception("Ocurrió una excepción en market_agent", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "inesperado")
         return f"Error inesperado: {e}"
 
-def query_market_data(question: str, cursor, categoria: Optional[str] = None, ubicacion: Optional[str] = None) -> Optional[str]:
+# Versión asíncrona: la consulta corre en el executor de BD y la generación no bloquea
+async def market_agent_async(user_input: str, categoria: Optional[str] = None, ubicacion: Optional[str] = None, session=None, modo: Optional[str] = None) -> str:
+    REQUESTS.inc(AGENT_NAME, "async")
+    try:
+        key = flight_key(AGENT_NAME, user_input, categoria, ubicacion, session.id if session else None, modo)
+        return await coalesce(key, lambda: answer_market_async(user_input, categoria, ubicacion, session, modo))
+    except (AdmissionError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.exception("Ocurrió una excepción en market_agent_async", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "inesperado")
+        return f"Error inesperado: {e}"
+
+# Versión en streaming: la consulta se hace antes y luego se reenvían los tokens del modelo
+# Quien llega con la misma pregunta en curso recibe los tokens ya emitidos y sigue el stream en vivo
+async def market_agent_stream(user_input: str, categoria: Optional[str] = None, ubicacion: Optional[str] = None, session=None, modo: Optional[str] = None):
+    REQUESTS.inc(AGENT_NAME, "stream")
+    key = flight_key(AGENT_NAME, user_input, categoria, ubicacion, session.id if session else None, modo)
+    async for event in coalesce_stream(key, lambda: stream_market(user_input, categoria, ubicacion, session, modo)):
+        yield event
+
+# Textos de datos para el prompt, comunes a la consulta a la BD y a la instantánea de hechos
+def describe_precio_promedio(categoria: str, avg_price) -> Optional[str]:
+    if avg_price:
+        return f"El precio promedio de productos similares en la categoría '{categoria}' es ${avg_price:.2f}."
+    logger.debug("No se encontraron precios promedio para la categoría proporcionada.")
+    return None
+
+def describe_competidores(ubicacion: str, competitors: int) -> str:
+    return f"En tu zona ({ubicacion}), hay {competitors} competidores en tu categoría de producto."
+
+def describe_mercados(mercados) -> Optional[str]:
+    if mercados:
+        return fit_items(AGENT_NAME, "Mercados internacionales potenciales: ", mercados, suffix=".")
+    logger.debug("No se encontraron mercados internacionales en la base de datos.")
+    return None
+
+# Consultas por intención; reciben (origen, categoria, ubicacion), origen = cursor o hechos
+def db_precio_promedio(cursor, categoria, ubicacion):
+    if not categoria:
+        logger.debug("'categoria' no proporcionada en la solicitud.")
+        return None
+    execute_prepared(cursor, SQL_PRECIO_PROMEDIO, (categoria,))
+    return describe_precio_promedio(categoria, cursor.fetchone()[0])
+
+def db_competidores(cursor, categoria, ubicacion):
+    if not ubicacion:
+        logger.debug("'ubicacion' no proporcionada en la solicitud.")
+        return None
+    execute_prepared(cursor, SQL_COMPETIDORES, (ubicacion,))
+    return describe_competidores(ubicacion, cursor.fetchone()[0])
+
+def db_mercados_internacionales(cursor, categoria, ubicacion):
+    execute_prepared(cursor, SQL_MERCADOS_INTERNACIONALES)
+    return describe_mercados([row[0] for row in cursor.fetchall()])
+
+def facts_precio_promedio(facts, categoria, ubicacion):
+    if not categoria:
+        logger.debug("'categoria' no proporcionada en la solicitud.")
+        return None
+    return describe_precio_promedio(categoria, facts["precio_promedio"].get(categoria))
+
+def facts_competidores(facts, categoria, ubicacion):
+    if not ubicacion:
+        logger.debug("'ubicacion' no proporcionada en la solicitud.")
+        return None
+    return describe_competidores(ubicacion, facts["competidores"].get(ubicacion, 0))
+
+def facts_mercados_internacionales(facts, categoria, ubicacion):
+    return describe_mercados(facts["mercados_internacionales"])
+
+# Consulta que atiende cada intención (ver backend_intents)
+DB_HANDLERS = {
+    INTENT_PRECIO_PROMEDIO: db_precio_promedio,
+    INTENT_COMPETIDORES: db_competidores,
+    INTENT_MERCADOS_INTERNACIONALES: db_mercados_internacionales,
+}
+FACT_HANDLERS = {
+    INTENT_PRECIO_PROMEDIO: facts_precio_promedio,
+    INTENT_COMPETIDORES: facts_competidores,
+    INTENT_MERCADOS_INTERNACIONALES: facts_mercados_internacionales,
+}
+
+# Respuestas sin modelo: el dato de la consulta ya es la respuesta, con una recomendación fija
+def template_precio_promedio(data):
+    return (f"{data}\n\nUsa este valor como referencia: un precio por debajo atrae a clientes sensibles al precio; "
+            "por encima, necesitas diferenciarte por calidad, servicio o marca.")
+
+def template_competidores(data):
+    return (f"{data}\n\nRevisa precios, surtido y reseñas de esos competidores para encontrar lo que tu negocio "
+            "puede ofrecer de forma distinta.")
+
+register_template(AGENT_NAME, INTENT_PRECIO_PROMEDIO, template_precio_promedio)
+register_template(AGENT_NAME, INTENT_COMPETIDORES, template_competidores)
+
+def query_market_data(question: str, cursor, categoria: Optional[str] = None, ubicacion: Optional[str] = None, intent=UNROUTED) -> Optional[str]:
     try:
-        # Verificar si la pregunta contiene "precio promedio" y "producto similar"
-        if "precio promedio" in question.lower() and "producto similar" in question.lower():
-            if categoria:
-                cursor.execute("""
-                    SELECT AVG(precio) FROM agente_mercado
-                    WHERE categoria = %s;
-                """, (categoria,))
-                avg_price = cursor.fetchone()[0]
-                if avg_price:
-                    return f"El precio promedio de productos similares en la categoría '{categoria}' es ${avg_price:.2f}."
-                else:
-                    print("[DEBUG] No se encontraron precios promedio para la categoría proporcionada.")
-                    return None
-            else:
-                print("[DEBUG] 'categoria' no proporcionada en la solicitud.")
-                return None
-        # Verificar si la pregunta contiene "competitivo" y "mi zona"
-        elif "competitivo" in question.lower() and "mi zona" in question.lower():
-            if ubicacion:
-                cursor.execute("""
-                    SELECT COUNT(*) FROM agente_mercado
-                    WHERE ubicacion_geografica = %s;
-                """, (ubicacion,))
-                competitors = cursor.fetchone()[0]
-                return f"En tu zona ({ubicacion}), hay {competitors} competidores en tu categoría de producto."
-            else:
-                print("[DEBUG] 'ubicacion' no proporcionada en la solicitud.")
-                return None
-        # Verificar si la pregunta contiene "mercados internacionales" e "interesados"
-        elif "mercados internacionales" in question.lower() and "interesados" in question.lower():
-            cursor.execute("""
-                SELECT mercados_internacionales FROM agente_mercado;
-            """)
-            rows = cursor.fetchall()
-            if rows:
-                mercados = set()
-                for row in rows:
-                    mercados.update(map(str.strip, row[0].split(",")))
-                return f"Mercados internacionales potenciales: {', '.join(mercados)}."
-            else:
-                print("[DEBUG] No se encontraron mercados internacionales en la base de datos.")
-                return None
-        else:
-            print("[DEBUG] La pregunta no coincide con ninguna consulta predefinida.")
+        intent = resolve_intent(AGENT_NAME, question, intent)
+        INTENTS.inc(AGENT_NAME, intent or "ninguna", "bd")
+        handler = DB_HANDLERS.get(intent)
+        if handler is None:
+            logger.debug("La pregunta no coincide con ninguna consulta predefinida.")
             return None
+        return handler(cursor, categoria, ubicacion)
     except Exception as e:
-        print(f"[ERROR] Ocurrió una excepción en query_market_data: {e}")
+        logger.exception("Ocurrió una excepción en query_market_data", extra={"agente": AGENT_NAME})
+        ERRORS.inc(AGENT_NAME, "bd")
+        return None
+
+# Mismas respuestas que query_market_data, leídas de la instantánea de hechos
+def market_data_from_facts(question: str, facts: dict, categoria: Optional[str] = None, ubicacion: Optional[str] = None, intent=UNROUTED) -> Optional[str]:
+    intent = resolve_intent(AGENT_NAME, question, intent)
+    INTENTS.inc(AGENT_NAME, intent or "ninguna", "hechos")
+    handler = FACT_HANDLERS.get(intent)
+    if handler is None:
+        logger.debug("La pregunta no coincide con ninguna consulta predefinida.")
         return None
+    return handler(facts, categoria, ubicacion)
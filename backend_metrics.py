@@ -0,0 +1,215 @@
+# backend_metrics.py
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Límites de los histogramas (segundos, tokens por segundo y tokens)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+THROUGHPUT_BUCKETS = (1, 2.5, 5, 10, 20, 40, 80, 160)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Métrica con etiquetas; los valores se guardan por tupla de etiquetas
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"{self.name} espera las etiquetas {self.labels}")
+        return tuple(str(value) for value in label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        key = self._key(label_values)
+        # Sólo se incrementa el primer cubo que contiene el valor; los acumulados se calculan al exportar
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    # (suma, observaciones) por combinación de etiquetas, para los endpoints JSON
+    def totals(self):
+        with self._lock:
+            return {key: (total, count) for key, (_, total, count) in self._values.items()}
+
+    # Medir la duración del bloque en segundos; timer.seconds queda disponible al salir
+    @contextmanager
+    def time(self, *label_values):
+        timer = Timer()
+        try:
+            yield timer
+        finally:
+            timer.stop()
+            self.observe(timer.seconds, *label_values)
+
+    def _render_samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labels, key, (("le", format_value(float(bound))),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}"
+            yield f"{self.name}_count{format_labels(self.labels, key)} {count}"
+
+# Valor leído al exportar: func() devuelve un número o un dict {tupla de etiquetas: número}
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, func, labels=()):
+        super().__init__(name, help_text, labels)
+        self.func = func
+
+    def _render_samples(self):
+        try:
+            values = self.func()
+        except Exception:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            if value is not None:
+                yield f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+
+class Timer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = None
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self.start
+        return self.seconds
+
+    @property
+    def ms(self):
+        return round(self.seconds * 1000, 1)
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    # Formato de texto de Prometheus (versión 0.0.4)
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+_registry = Registry()
+
+def counter(name, help_text, labels=()):
+    return _registry.register(Counter(name, help_text, labels))
+
+def histogram(name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+    return _registry.register(Histogram(name, help_text, labels, buckets))
+
+def gauge(name, help_text, func, labels=()):
+    return _registry.register(Gauge(name, help_text, func, labels))
+
+def render_metrics():
+    return _registry.render()
+
+# Métricas de los agentes
+REQUESTS = counter("agente_peticiones_total", "Peticiones recibidas por agente y modo (sync, async, stream).", ("agente", "modo"))
+ERRORS = counter("agente_errores_total", "Errores por agente y tipo (bd, generacion, admision, plazo, inesperado).", ("agente", "tipo"))
+INTENTS = counter("agente_intenciones_total", "Intención que atendió la consulta de datos, por origen (bd o hechos).", ("agente", "intencion", "origen"))
+CACHE_HITS = counter("agente_cache_aciertos_total", "Respuestas servidas desde caché, por tipo (exacta o semantica).", ("agente", "tipo"))
+
+DB_SECONDS = histogram("agente_bd_segundos", "Tiempo de la consulta de datos (BD o instantánea de hechos).", ("agente",))
+PROMPT_SECONDS = histogram("agente_prompt_segundos", "Tiempo de construcción del prompt.", ("agente",))
+TTFT_SECONDS = histogram("agente_ttft_segundos", "Tiempo hasta el primer token generado.", ("agente",))
+GENERATION_SECONDS = histogram("agente_generacion_segundos", "Tiempo total de generación (incluye la espera en cola).", ("agente",))
+GENERATION_MODEL_SECONDS = histogram("agente_generacion_modelo_segundos", "Tiempo total de generación por modelo (niveles de backend_tiers).", ("modelo",))
+TOKENS_PER_SECOND = histogram("agente_tokens_por_segundo", "Velocidad de generación del modelo.", ("agente",), THROUGHPUT_BUCKETS)
+PROMPT_TOKENS = histogram("agente_tokens_prompt", "Tokens de prompt evaluados por Ollama.", ("agente",), TOKEN_BUCKETS)
+RESPONSE_TOKENS = histogram("agente_tokens_respuesta", "Tokens generados por respuesta.", ("agente",), TOKEN_BUCKETS)
+
+CANCELLED_GENERATIONS = counter("agente_generaciones_canceladas_total", "Generaciones abortadas en curso, por motivo (desconexion o plazo).", ("agente", "motivo"))
+TOKENS_AVOIDED = counter("agente_tokens_evitados_total", "Tokens de num_predict que no se generaron por cancelar la generación.", ("agente",))
+
+def label(agent):
+    return agent or "desconocido"
+
+# Métricas de una generación terminada; ttft y total en segundos
+def observe_generation(agent, total, ttft, budget, model=None):
+    agent = label(agent)
+    GENERATION_SECONDS.observe(total, agent)
+    if model:
+        GENERATION_MODEL_SECONDS.observe(total, model)
+    if ttft is not None:
+        TTFT_SECONDS.observe(ttft, agent)
+    final = budget.final_chunk
+    prompt_tokens = getattr(final, 'prompt_eval_count', None)
+    if prompt_tokens:
+        PROMPT_TOKENS.observe(prompt_tokens, agent)
+    generated = budget.generated_tokens
+    RESPONSE_TOKENS.observe(generated, agent)
+    # Con el fragmento final, la velocidad que mide Ollama; si cortamos antes, la estimada desde el primer token
+    eval_ns = getattr(final, 'eval_duration', None)
+    if eval_ns and getattr(final, 'eval_count', None):
+        TOKENS_PER_SECOND.observe(final.eval_count / (eval_ns / 1e9), agent)
+    elif ttft is not None and total > ttft and generated:
+        TOKENS_PER_SECOND.observe(generated / (total - ttft), agent)
+
+# Generación cancelada a medias: el resto de su num_predict ya no ocupa al servidor de Ollama
+def observe_cancellation(agent, reason, budget):
+    agent = label(agent)
+    CANCELLED_GENERATIONS.inc(agent, reason)
+    if budget is not None:
+        TOKENS_AVOIDED.inc(agent, amount=budget.remaining_tokens)
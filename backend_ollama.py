@@ -0,0 +1,325 @@
+# backend_ollama.py
+
+import asyncio
+import logging
+import os
+import time
+import ollama
+from dotenv import load_dotenv
+from backend_budget import GenerationBudget, generation_options, record_cancellation
+from backend_cache import cached_response, store_response
+from backend_deadline import DeadlineExceeded, cancel_reason
+from backend_hosts import get_host_pool
+from backend_metrics import CACHE_HITS, ERRORS, label, observe_cancellation, observe_generation
+from backend_semantic_cache import SEMANTIC_CACHE_ENABLED, get_semantic_cache
+from backend_scheduler import AdmissionError, get_scheduler
+from backend_sessions import SESSION_CONTEXT_REUSE
+from backend_tracing import trace_generation
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Modelo por defecto de los agentes (cada uno puede cambiarlo con su MODEL_<AGENTE>)
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
+
+# Tiempo que Ollama mantiene el modelo en memoria tras cada petición ("30m", segundos, o -1 = siempre)
+def parse_keep_alive(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+OLLAMA_KEEP_ALIVE = parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE", "30m"))
+
+EMPTY_RESPONSE_MESSAGE = "Lo siento, no pude generar una respuesta adecuada. Por favor, intenta con otra pregunta."
+
+# Cliente asíncrono del servidor de Ollama menos cargado (peticiones sueltas: embeddings, pings)
+# Las generaciones pasan por get_host_pool().stream(), que además reintenta en otro servidor
+def get_async_client():
+    return get_host_pool().pick().async_client()
+
+async def close_async_client():
+    await get_host_pool().close()
+
+# Extraer el texto de un fragmento devuelto por Ollama
+def chunk_text(chunk):
+    # Manejar diferentes tipos de 'chunk'
+    if isinstance(chunk, tuple):
+        if chunk[0] == 'response':
+            return str(chunk[1] or '')
+    elif isinstance(chunk, dict):
+        if 'response' in chunk:
+            return str(chunk['response'] or '')
+    elif isinstance(chunk, ollama.GenerateResponse):
+        return chunk.response or ''
+    # Ignorar strings y otros campos que no están bajo 'response'
+    return ''
+
+# Limpiar la respuesta y limitarla a los primeros 3 párrafos
+def limit_paragraphs(response):
+    response = response.strip()
+
+    # Si la respuesta está vacía, informar
+    if not response:
+        logger.debug("La respuesta del modelo está vacía.")
+        return EMPTY_RESPONSE_MESSAGE
+
+    paragraphs = response.split('\n\n')
+    return '\n\n'.join(paragraphs[:3])
+
+# Tiempo medido desde el inicio de la petición, contado desde offset segundos después (None se mantiene)
+def since(elapsed, offset):
+    return elapsed - offset if elapsed is not None else None
+
+# Generación abortada a medias porque el cliente se fue o venció su plazo: la petición a Ollama
+# ya se cerró al salir del bloque del pool y el hueco del planificador quedó libre
+def record_cancelled(agent, budget):
+    reason = cancel_reason()
+    record_cancellation(budget)
+    observe_cancellation(agent, reason, budget)
+    logger.info("Generación cancelada (%s) tras %s tokens", reason, budget.generated_tokens, extra={"agente": agent})
+
+# Generación bloqueante (usada por los frontends y el modo terminal)
+# question/context activan la caché semántica: pregunta original y datos de la BD usados en el prompt;
+# params, los parámetros de la petición que también distinguen la respuesta (producto, categoría...)
+def generate_response(prompt, model, agent=None, question=None, context=None, params=None):
+    start = time.perf_counter()
+    ttft = None
+    try:
+        logger.debug("Prompt enviado al modelo", extra={"agente": agent, "prompt": prompt})
+
+        # Reutilizar la respuesta si ya se generó para el mismo prompt y opciones
+        cache_key, cached = cached_response(model, prompt, generation_options(agent))
+        if cached is not None:
+            logger.debug("Respuesta obtenida de la caché.", extra={"agente": agent})
+            CACHE_HITS.inc(label(agent), "exacta")
+            return cached
+
+        # Si no, buscar una pregunta equivalente con los mismos datos
+        vector = None
+        if question is not None and SEMANTIC_CACHE_ENABLED:
+            vector, cached = get_semantic_cache().lookup(agent, question, context, model, params)
+            if cached is not None:
+                logger.debug("Respuesta obtenida de la caché semántica.", extra={"agente": agent})
+                CACHE_HITS.inc(label(agent), "semantica")
+                return cached
+
+        budget = GenerationBudget(agent)
+        # Sin planificador en el camino síncrono: la generación empieza al abrir el stream
+        gen_start = time.perf_counter()
+        # Al salir del bloque se cierra el stream: se aborta la petición HTTP y Ollama deja de generar
+        with get_host_pool().stream_sync(
+            model=model, prompt=prompt, options=budget.options, keep_alive=OLLAMA_KEEP_ALIVE
+        ) as stream:
+            debug = logger.isEnabledFor(logging.DEBUG)
+            for chunk in stream:
+                if debug:
+                    logger.debug("Chunk recibido: %r", chunk)
+                if chunk.done:
+                    budget.final_chunk = chunk
+                if budget.feed(chunk_text(chunk)) and ttft is None:
+                    ttft = time.perf_counter() - start
+                if budget.exhausted:
+                    break
+
+        budget.finish()
+        total = time.perf_counter() - start
+        observe_generation(agent, total, ttft, budget, model)
+        trace_generation(time.perf_counter() - gen_start, since(ttft, gen_start - start), budget.final_chunk)
+        if budget.text:
+            store_response(cache_key, budget.text, agent)
+            if vector is not None:
+                get_semantic_cache().store(agent, vector, context, budget.text, model, params)
+        return limit_paragraphs(budget.text)
+    except Exception as e:
+        logger.exception("Ocurrió una excepción en get_llama_response", extra={"agente": agent})
+        ERRORS.inc(label(agent), "generacion")
+        return f"Error inesperado: {e}"
+
+# Generación asíncrona: no bloquea el event loop mientras el modelo produce tokens
+# session: sesión de conversación; se reenvía a Ollama su 'context' y se registra el turno
+async def generate_response_async(prompt, model, agent=None, question=None, context=None, session=None, params=None):
+    start = time.perf_counter()
+    ttft = None
+    generating = False
+    try:
+        logger.debug("Prompt enviado al modelo (async)", extra={"agente": agent, "prompt": prompt})
+
+        # Con historial la respuesta depende de la conversación: no se usan las cachés
+        use_cache = session is None or not session.history
+
+        cache_key, vector = None, None
+        if use_cache:
+            cache_key, cached = cached_response(model, prompt, generation_options(agent))
+            if cached is None and question is not None and SEMANTIC_CACHE_ENABLED:
+                vector, cached = await get_semantic_cache().lookup_async(agent, question, context, model, params)
+            if cached is not None:
+                CACHE_HITS.inc(label(agent), "semantica" if vector is not None else "exacta")
+                if session is not None:
+                    session.record_turn(question, cached)
+                return cached
+
+        # En sesión se lee hasta el final: Ollama sólo devuelve 'context' en el último fragmento
+        budget = GenerationBudget(agent, stop_early=session is None or not SESSION_CONTEXT_REUSE)
+        ollama_context = session.generation_context() if session is not None else None
+        # Esperar turno: el planificador limita las generaciones simultáneas en Ollama
+        async with get_scheduler().slot(agent):
+            generating = True
+            gen_start = time.perf_counter()
+            async with get_host_pool().stream(
+                model=model, prompt=prompt, context=ollama_context, options=budget.options,
+                keep_alive=OLLAMA_KEEP_ALIVE
+            ) as stream:
+                async for chunk in stream:
+                    if chunk.done:
+                        budget.final_chunk = chunk
+                    if budget.feed(chunk_text(chunk)) and ttft is None:
+                        ttft = time.perf_counter() - start
+                    if budget.exhausted:
+                        break
+
+        budget.finish()
+        total = time.perf_counter() - start
+        observe_generation(agent, total, ttft, budget, model)
+        trace_generation(time.perf_counter() - gen_start, since(ttft, gen_start - start), budget.final_chunk)
+        if budget.text and use_cache:
+            store_response(cache_key, budget.text, agent)
+            if vector is not None:
+                get_semantic_cache().store(agent, vector, context, budget.text, model, params)
+        respuesta = limit_paragraphs(budget.text)
+        if session is not None:
+            session.record_turn(question, respuesta, getattr(budget.final_chunk, 'context', None))
+        return respuesta
+    except AdmissionError:
+        # Sin turno: main.py responde 429/503 con Retry-After
+        ERRORS.inc(label(agent), "admision")
+        raise
+    except DeadlineExceeded:
+        # main.py responde 504
+        ERRORS.inc(label(agent), "plazo")
+        raise
+    except asyncio.CancelledError:
+        if generating:
+            record_cancelled(agent, budget)
+        raise
+    except Exception as e:
+        logger.exception("Ocurrió una excepción en get_llama_response_async", extra={"agente": agent})
+        ERRORS.inc(label(agent), "generacion")
+        return f"Error inesperado: {e}"
+
+# Respuesta servida desde caché: un único evento de texto y el evento final
+def cached_events(respuesta, tipo_cache, start, tiempos=None):
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+    yield {"tipo": "token", "texto": respuesta}
+    yield {
+        "tipo": "fin",
+        "respuesta": respuesta,
+        "cache": tipo_cache,
+        "tiempos": {**(tiempos or {}), "ttft_ms": elapsed_ms, "generacion_ms": elapsed_ms},
+    }
+
+# Generación en streaming: produce eventos {"tipo": "token"} y un evento final {"tipo": "fin"}
+# El campo "cache" del evento final vale False, "exacta" o "semantica"
+async def stream_response_async(prompt, model, agent=None, tiempos=None, question=None, context=None, session=None, params=None):
+    start = time.perf_counter()
+    ttft = None
+    budget = GenerationBudget(agent, stop_early=session is None or not SESSION_CONTEXT_REUSE)
+    emitted_chunks = 0
+    generating = False
+    use_cache = session is None or not session.history
+    cache_key, vector = None, None
+
+    try:
+        if use_cache:
+            cache_key, cached = cached_response(model, prompt, budget.options)
+            tipo_cache = "exacta"
+            if cached is None and question is not None and SEMANTIC_CACHE_ENABLED:
+                vector, cached = await get_semantic_cache().lookup_async(agent, question, context, model, params)
+                tipo_cache = "semantica"
+            if cached is not None:
+                CACHE_HITS.inc(label(agent), tipo_cache)
+                if session is not None:
+                    session.record_turn(question, cached)
+                for event in cached_events(cached, tipo_cache, start, tiempos):
+                    yield event
+                return
+
+        ollama_context = session.generation_context() if session is not None else None
+        async with get_scheduler().slot(agent):
+            generating = True
+            gen_start = time.perf_counter()
+            tiempos = {**(tiempos or {}), "cola_ms": round((time.perf_counter() - start) * 1000, 1)}
+            async with get_host_pool().stream(
+                model=model, prompt=prompt, context=ollama_context, options=budget.options,
+                keep_alive=OLLAMA_KEEP_ALIVE
+            ) as stream:
+                async for chunk in stream:
+                    if chunk.done:
+                        budget.final_chunk = chunk
+                    text = budget.feed(chunk_text(chunk))
+                    if text:
+                        if ttft is None:
+                            ttft = time.perf_counter() - start
+                        emitted_chunks += 1
+                        yield {"tipo": "token", "texto": text}
+                    if budget.exhausted:
+                        break
+
+        text = budget.finish()
+        if text:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            emitted_chunks += 1
+            yield {"tipo": "token", "texto": text}
+    except AdmissionError as e:
+        ERRORS.inc(label(agent), "admision")
+        yield {"tipo": "error", "detalle": str(e), "reintentar_en": e.retry_after}
+        return
+    except DeadlineExceeded as e:
+        ERRORS.inc(label(agent), "plazo")
+        yield {"tipo": "error", "detalle": str(e)}
+        return
+    except (asyncio.CancelledError, GeneratorExit):
+        # El consumidor se fue (desconexión, plazo o fin de /agentes): no seguir generando para nadie
+        if generating:
+            record_cancelled(agent, budget)
+        raise
+    except Exception as e:
+        logger.exception("Ocurrió una excepción en stream_response_async", extra={"agente": agent})
+        ERRORS.inc(label(agent), "generacion")
+        yield {"tipo": "error", "detalle": f"Error inesperado: {e}"}
+        return
+
+    total = time.perf_counter() - start
+    observe_generation(agent, total, ttft, budget, model)
+    trace_generation(time.perf_counter() - gen_start, since(ttft, gen_start - start), budget.final_chunk)
+    respuesta = budget.text
+    if respuesta and use_cache:
+        store_response(cache_key, respuesta, agent)
+        if vector is not None:
+            get_semantic_cache().store(agent, vector, context, respuesta, model, params)
+    if not respuesta:
+        respuesta = EMPTY_RESPONSE_MESSAGE
+        yield {"tipo": "token", "texto": respuesta}
+    if session is not None:
+        session.record_turn(question, respuesta, getattr(budget.final_chunk, 'context', None))
+
+    yield {
+        "tipo": "fin",
+        "respuesta": respuesta,
+        "cache": False,
+        "modelo": model,
+        "tiempos": {
+            **(tiempos or {}),
+            "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+            "generacion_ms": round((time.perf_counter() - start) * 1000, 1),
+        },
+        "tokens": {
+            "prompt": getattr(budget.final_chunk, 'prompt_eval_count', None),
+            "prompt_eval_ms": round(budget.final_chunk.prompt_eval_duration / 1e6, 1) if getattr(budget.final_chunk, 'prompt_eval_duration', None) else None,
+            "emitidos": emitted_chunks,
+            **budget.summary(),
+        },
+    }
@@ -0,0 +1,285 @@
+# backend_scheduler.py
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from dotenv import load_dotenv
+from backend_deadline import REASON_DEADLINE, DeadlineExceeded, check_deadline, current_scope, remaining
+from backend_hosts import OLLAMA_HOST_URLS, OLLAMA_NUM_PARALLEL
+from backend_tracing import STAGE_QUEUE, add_span
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+# Generaciones simultáneas que los servidores de Ollama atienden sin degradarse (OLLAMA_NUM_PARALLEL de cada uno)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", str(OLLAMA_NUM_PARALLEL * len(OLLAMA_HOST_URLS))))
+# Peticiones esperando turno; por encima se rechaza con 503 en lugar de encolar
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "32"))
+# Segundos máximos esperando turno en la cola
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+# Prioridad por agente: menor número sale antes de la cola (a igualdad, por orden de llegada)
+AGENT_PRIORITIES = {
+    "financiero": int(os.getenv("LLM_PRIORITY_FINANCIERO", "0")),
+    "mercado": int(os.getenv("LLM_PRIORITY_MERCADO", "1")),
+    "marketing": int(os.getenv("LLM_PRIORITY_MARKETING", "2")),
+    # El resumen de /agentes llega al final de una petición que ya esperó a los tres agentes
+    "resumen": int(os.getenv("LLM_PRIORITY_RESUMEN", "0")),
+}
+DEFAULT_PRIORITY = 3
+# Generaciones de lotes (/agentes/batch): detrás de cualquier petición interactiva
+BATCH_PRIORITY = int(os.getenv("LLM_PRIORITY_LOTE", "10"))
+
+# Prioridad impuesta a las generaciones del contexto actual (ver llm_priority); None = la del agente
+_priority = contextvars.ContextVar("llm_priority", default=None)
+
+# Encolar con otra prioridad las generaciones lanzadas dentro del bloque (y las tareas que cree)
+@contextmanager
+def llm_priority(priority):
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+# Límite por cliente (token bucket): peticiones por segundo sostenidas y ráfaga máxima; 0 = sin límite.
+# Desactivado por defecto: hay que configurarlo (ver .env) junto con los frontends de confianza
+RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "0"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+# IPs de frontends/proxies de confianza (separadas por comas): sólo a ellos se les acepta la cabecera
+# X-Client-Id para separar a sus usuarios; el resto de clientes se identifica por su IP.
+# Por defecto, loopback: los frontends de Streamlit corren en la misma máquina y comparten su IP
+RATE_LIMIT_TRUSTED_PROXIES = {ip.strip() for ip in os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if ip.strip()}
+
+# Rechazo de admisión: main.py lo convierte en 429/503 con Retry-After
+class AdmissionError(Exception):
+    status_code = 503
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class QueueFull(AdmissionError):
+    pass
+
+class QueueTimeout(AdmissionError):
+    pass
+
+class RateLimited(AdmissionError):
+    status_code = 429
+
+# Limita las generaciones simultáneas y ordena la espera por prioridad de agente
+class LLMScheduler:
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_QUEUE_MAX, queue_timeout=LLM_QUEUE_TIMEOUT, priorities=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.priorities = dict(AGENT_PRIORITIES if priorities is None else priorities)
+        self._running = 0
+        self._queued = 0
+        # (prioridad, orden de llegada, futuro); las entradas canceladas se descartan al sacarlas
+        self._waiters = []
+        self._seq = itertools.count()
+        self._counters = {"admitidas": 0, "rechazadas_cola_llena": 0, "rechazadas_timeout": 0, "plazo_agotado": 0}
+        self._waits = {}
+        # Duración media de una generación (media móvil) para estimar Retry-After
+        self._avg_service_s = 5.0
+
+    @property
+    def queued(self):
+        return self._queued
+
+    @property
+    def running(self):
+        return self._running
+
+    def retry_after(self):
+        return self._avg_service_s * (self._queued + 1) / self.max_concurrency
+
+    # Rechazar en la puerta si la cola ya está llena (para respuestas en streaming)
+    def check_capacity(self):
+        if self._running >= self.max_concurrency and self._queued >= self.max_queue:
+            self._counters["rechazadas_cola_llena"] += 1
+            raise QueueFull("El servicio está saturado, intenta de nuevo más tarde.", self.retry_after())
+
+    def _record_wait(self, agent, waited):
+        stats = self._waits.setdefault(agent or "desconocido", {"peticiones": 0, "espera_total_ms": 0.0, "espera_max_ms": 0.0})
+        stats["peticiones"] += 1
+        stats["espera_total_ms"] += waited * 1000
+        stats["espera_max_ms"] = max(stats["espera_max_ms"], waited * 1000)
+
+    async def acquire(self, agent=None):
+        start = time.monotonic()
+        check_deadline("la generación")
+        if self._running < self.max_concurrency and not self._queued:
+            self._running += 1
+            self._counters["admitidas"] += 1
+            self._record_wait(agent, 0.0)
+            add_span(STAGE_QUEUE, 0.0)
+            return
+        if self._queued >= self.max_queue:
+            self._counters["rechazadas_cola_llena"] += 1
+            raise QueueFull("El servicio está saturado, intenta de nuevo más tarde.", self.retry_after())
+
+        # No esperar turno más allá del plazo de la petición
+        timeout = self.queue_timeout
+        request_remaining = remaining()
+        by_deadline = request_remaining is not None and request_remaining < timeout
+        if by_deadline:
+            timeout = max(request_remaining, 0)
+
+        priority = _priority.get()
+        if priority is None:
+            priority = self.priorities.get(agent, DEFAULT_PRIORITY)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._queued += 1
+        try:
+            # release() transfiere el hueco directamente al futuro (self._running no cambia)
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # El turno llegó justo al cancelar: devolverlo
+                self.release()
+            else:
+                future.cancel()
+                self._queued -= 1
+            if isinstance(e, asyncio.TimeoutError) and by_deadline:
+                self._counters["plazo_agotado"] += 1
+                current_scope().reason = REASON_DEADLINE
+                raise DeadlineExceeded("Plazo agotado esperando turno para generar.") from None
+            if isinstance(e, asyncio.TimeoutError):
+                self._counters["rechazadas_timeout"] += 1
+                raise QueueTimeout(f"Sin turno tras {self.queue_timeout:.0f}s en la cola.", self.retry_after()) from None
+            raise
+        self._counters["admitidas"] += 1
+        waited = time.monotonic() - start
+        self._record_wait(agent, waited)
+        add_span(STAGE_QUEUE, waited)
+
+    def release(self, service_s=None):
+        if service_s is not None:
+            self._avg_service_s = 0.9 * self._avg_service_s + 0.1 * service_s
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+            self._queued -= 1
+            future.set_result(None)
+            return
+        self._running -= 1
+
+    # Ocupar un hueco de generación durante el bloque
+    @asynccontextmanager
+    async def slot(self, agent=None):
+        await self.acquire(agent)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self):
+        waits = {}
+        for agent, stats in self._waits.items():
+            waits[agent] = {
+                "peticiones": stats["peticiones"],
+                "espera_media_ms": round(stats["espera_total_ms"] / stats["peticiones"], 2),
+                "espera_max_ms": round(stats["espera_max_ms"], 2),
+            }
+        return {
+            **self._counters,
+            "en_ejecucion": self._running,
+            "en_cola": self._queued,
+            "concurrencia_max": self.max_concurrency,
+            "cola_max": self.max_queue,
+            "prioridades": dict(self.priorities),
+            "prioridad_lotes": BATCH_PRIORITY,
+            "servicio_medio_s": round(self._avg_service_s, 2),
+            "esperas": waits,
+        }
+
+# Cubeta de fichas de un cliente
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    # Consumir una ficha; devuelve los segundos hasta la siguiente si no hay (0 si se admitió)
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+# Límite de peticiones por cliente; recuerda como mucho max_clients cubetas (LRU)
+class RateLimiter:
+    def __init__(self, rate=RATE_LIMIT_RPS, burst=RATE_LIMIT_BURST, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def check(self, client):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(client)
+            wait = bucket.take()
+            if wait:
+                self.rejected += 1
+        if wait:
+            raise RateLimited("Demasiadas peticiones, espera antes de reintentar.", wait)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "peticiones_por_segundo": self.rate,
+                "rafaga": self.burst,
+                "clientes": len(self._buckets),
+                "rechazadas": self.rejected,
+            }
+
+# El planificador usa futuros del event loop: se recrea si cambia el loop (como el cliente de Ollama)
+_scheduler = None
+_scheduler_loop = None
+_rate_limiter = RateLimiter()
+
+def get_scheduler():
+    global _scheduler, _scheduler_loop
+    loop = asyncio.get_running_loop()
+    if _scheduler is None or _scheduler_loop is not loop:
+        _scheduler_loop = loop
+        _scheduler = LLMScheduler()
+    return _scheduler
+
+# Generaciones esperando turno ahora mismo (0 sin planificador; se puede leer desde cualquier hilo)
+def queue_depth():
+    return _scheduler.queued if _scheduler is not None else 0
+
+def get_rate_limiter():
+    return _rate_limiter
+
+def get_scheduler_stats():
+    stats = _scheduler.stats() if _scheduler is not None else {"en_ejecucion": 0, "en_cola": 0}
+    return {**stats, "limite_por_cliente": _rate_limiter.stats()}
@@ -0,0 +1,232 @@
+# backend_semantic_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import numpy as np
+from dotenv import load_dotenv
+from backend_hosts import get_host_pool
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Opcional: cada fallo cuesta una llamada extra a /api/embed y necesita el modelo EMBEDDING_MODEL
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+# Modelo de Ollama usado para los embeddings de las preguntas
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+# Preguntas recordadas por agente; al llenarse se reemplaza la menos usada
+SEMANTIC_CACHE_CAPACITY = int(os.getenv("SEMANTIC_CACHE_CAPACITY", "10000"))
+
+# Similitud coseno mínima para dar por equivalente una pregunta, por agente
+SEMANTIC_THRESHOLDS = {
+    "financiero": float(os.getenv("SEMANTIC_THRESHOLD_FINANCIERO", "0.92")),
+    "marketing": float(os.getenv("SEMANTIC_THRESHOLD_MARKETING", "0.94")),
+    "mercado": float(os.getenv("SEMANTIC_THRESHOLD_MERCADO", "0.93")),
+}
+SEMANTIC_DEFAULT_THRESHOLD = float(os.getenv("SEMANTIC_THRESHOLD_DEFAULT", "0.93"))
+
+# La respuesta depende de los datos de la BD, del modelo que la generó (backend_tiers) y de los
+# parámetros de la petición (producto, objetivo, categoría...): sólo se reutiliza si coinciden todos
+def context_hash(context, model=None, params=None):
+    payload = json.dumps([str(context or ""), model, params or {}], sort_keys=True, ensure_ascii=False, default=str)
+    digest = hashlib.blake2b(payload.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+# Embedder por defecto: Ollama /api/embed
+class OllamaEmbedder:
+    def __init__(self, model=EMBEDDING_MODEL):
+        self.model = model
+
+    def embed(self, text):
+        from backend_ollama import OLLAMA_KEEP_ALIVE
+        client = get_host_pool().pick().client()
+        return client.embed(model=self.model, input=text, keep_alive=OLLAMA_KEEP_ALIVE).embeddings[0]
+
+    async def embed_async(self, text):
+        # Import diferido: backend_ollama importa este módulo
+        from backend_ollama import OLLAMA_KEEP_ALIVE, get_async_client
+        response = await get_async_client().embed(model=self.model, input=text, keep_alive=OLLAMA_KEEP_ALIVE)
+        return response.embeddings[0]
+
+# Embedder local sin modelo (bolsa de palabras con hashing); para pruebas y benchmarks
+class HashingEmbedder:
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            vector[int.from_bytes(digest, "little") % self.dim] += 1.0
+        return vector
+
+    async def embed_async(self, text):
+        return self.embed(text)
+
+# Índice vectorial de un agente: matriz contigua de embeddings normalizados
+class SemanticIndex:
+    def __init__(self, capacity=SEMANTIC_CACHE_CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._contexts = np.zeros(capacity, dtype=np.int64)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._answers = [None] * capacity
+        self._size = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    # Mejor respuesta con el mismo contexto y similitud >= threshold; devuelve (respuesta, similitud)
+    def search(self, vector, context, threshold):
+        query = self._normalize(vector)
+        with self._lock:
+            if not self._size or self._matrix.shape[1] != query.shape[0]:
+                return None, 0.0
+            similarities = self._matrix[:self._size] @ query
+            similarities[self._contexts[:self._size] != context] = -1.0
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < threshold:
+                return None, similarity
+            self._last_used[best] = time.monotonic()
+            return self._answers[best], similarity
+
+    def add(self, vector, context, answer):
+        vector = self._normalize(vector)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                # La dimensión se fija con el primer embedding (cambiar de modelo vacía el índice)
+                self._matrix = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+                self._size = 0
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+            self._matrix[slot] = vector
+            self._contexts[slot] = context
+            self._last_used[slot] = time.monotonic()
+            self._answers[slot] = answer
+
+    def clear(self):
+        with self._lock:
+            removed = self._size
+            self._size = 0
+            self._answers = [None] * self.capacity
+            self._last_used[:] = 0.0
+        return removed
+
+# Caché semántica de los tres agentes: un índice por agente
+class SemanticCache:
+    def __init__(self, embedder=None, capacity=SEMANTIC_CACHE_CAPACITY, thresholds=None):
+        self.embedder = embedder or OllamaEmbedder()
+        self.capacity = capacity
+        self.thresholds = dict(SEMANTIC_THRESHOLDS if thresholds is None else thresholds)
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._counters = {"aciertos": 0, "fallos": 0, "errores_embedding": 0, "guardadas": 0}
+
+    def index(self, agent):
+        with self._lock:
+            if agent not in self._indexes:
+                self._indexes[agent] = SemanticIndex(self.capacity)
+            return self._indexes[agent]
+
+    def threshold(self, agent):
+        return self.thresholds.get(agent, SEMANTIC_DEFAULT_THRESHOLD)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _search(self, agent, vector, context, model, params):
+        answer, _ = self.index(agent).search(vector, context_hash(context, model, params), self.threshold(agent))
+        self._count("fallos" if answer is None else "aciertos")
+        return answer
+
+    # Devuelve (embedding, respuesta); el embedding se reutiliza al guardar la respuesta nueva
+    def lookup(self, agent, question, context, model=None, params=None):
+        try:
+            vector = self.embedder.embed(question)
+        except Exception as e:
+            logger.error("No se pudo calcular el embedding: %s", e)
+            self._count("errores_embedding")
+            return None, None
+        return vector, self._search(agent, vector, context, model, params)
+
+    async def lookup_async(self, agent, question, context, model=None, params=None):
+        try:
+            vector = await self.embedder.embed_async(question)
+        except Exception as e:
+            logger.error("No se pudo calcular el embedding: %s", e)
+            self._count("errores_embedding")
+            return None, None
+        return vector, self._search(agent, vector, context, model, params)
+
+    def store(self, agent, vector, context, answer, model=None, params=None):
+        if vector is None:
+            return
+        self.index(agent).add(vector, context_hash(context, model, params), answer)
+        self._count("guardadas")
+
+    def invalidate(self, agent=None):
+        with self._lock:
+            indexes = list(self._indexes.items())
+        return sum(index.clear() for name, index in indexes if agent is None or name == agent)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            indexes = dict(self._indexes)
+        stats.update({
+            "entradas": {agent: len(index) for agent, index in indexes.items()},
+            "expulsadas": sum(index.evictions for index in indexes.values()),
+            "capacidad_por_agente": self.capacity,
+            "umbrales": dict(self.thresholds),
+        })
+        consultas = stats["aciertos"] + stats["fallos"]
+        stats["tasa_aciertos"] = round(stats["aciertos"] / consultas, 3) if consultas else 0.0
+        return stats
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+# Caché semántica única del proceso, creada en el primer uso
+def get_semantic_cache():
+    global _semantic_cache
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticCache()
+    return _semantic_cache
+
+# Sustituir el embedder (p. ej. HashingEmbedder en pruebas); vacía los índices
+def set_embedder(embedder):
+    global _semantic_cache
+    with _semantic_cache_lock:
+        _semantic_cache = SemanticCache(embedder)
+
+def invalidate_semantic(agent=None):
+    if _semantic_cache is None:
+        return 0
+    return _semantic_cache.invalidate(agent)
+
+def get_semantic_cache_stats():
+    if not SEMANTIC_CACHE_ENABLED:
+        return {"habilitada": False}
+    return {"habilitada": True, **get_semantic_cache().stats()}
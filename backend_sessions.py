@@ -0,0 +1,144 @@
+# backend_sessions.py
+
+import os
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+# Sesiones vivas como máximo; al superarlo se descarta la menos usada
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+# Segundos sin actividad tras los que una sesión caduca
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+# Turnos (pregunta + respuesta) que se recuerdan por sesión
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "10"))
+# Reenviar a Ollama el 'context' devuelto en el turno anterior (desactivable para comparar)
+SESSION_CONTEXT_REUSE = os.getenv("SESSION_CONTEXT_REUSE", "1") == "1"
+
+class SessionNotFound(Exception):
+    pass
+
+# Obtener el último mensaje del usuario de una conversación o cadena
+def get_user_input(conversation):
+    # Verificar si 'conversation' es una cadena de texto
+    if isinstance(conversation, str):
+        # Convertir la cadena en una lista de diccionarios
+        conversation = [{"role": "user", "content": conversation}]
+
+    # Ahora, 'conversation' es una lista de diccionarios
+    return conversation[-1]['content']
+
+# Conversación de un cliente con un agente
+class Session:
+    def __init__(self, session_id, agent=None, max_turns=SESSION_MAX_TURNS):
+        self.id = session_id
+        self.agent = agent
+        self.history = deque(maxlen=max_turns)
+        # Tokens de contexto que devolvió Ollama en el último turno (array compacto de enteros)
+        self.context = None
+        # Modelo de la conversación (backend_tiers): el 'context' sólo sirve para el mismo modelo
+        self.model = None
+        self.turns = 0
+        self.updated = time.time()
+
+    # Contexto para la siguiente generación (None si no se reutiliza o no hay)
+    def generation_context(self):
+        if not SESSION_CONTEXT_REUSE or self.context is None:
+            return None
+        return list(self.context)
+
+    def record_turn(self, question, answer, context=None):
+        self.history.append({"role": "user", "content": question})
+        self.history.append({"role": "assistant", "content": answer})
+        self.context = array("i", context) if context else None
+        self.turns += 1
+        self.updated = time.time()
+
+    def transcript(self):
+        lines = []
+        for message in self.history:
+            speaker = "Usuario" if message["role"] == "user" else "Asistente"
+            lines.append(f"{speaker}: {message['content']}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            "session_id": self.id,
+            "agente": self.agent,
+            "turnos": self.turns,
+            "historial": list(self.history),
+            "contexto_tokens": len(self.context) if self.context is not None else 0,
+            "modelo": self.model,
+        }
+
+# Prompt de un turno dentro de una sesión.
+# Con contexto de Ollama el historial ya está codificado: sólo se envían los datos y la pregunta nueva.
+# Sin él (primer turno servido desde caché, error previo) se antepone la transcripción.
+def session_prompt(session, prompt, user_input, data, answer_label):
+    if session is None or not session.history:
+        return prompt
+    if session.generation_context() is not None:
+        data_block = f"Datos relevantes:\n{data}\n\n" if data else ""
+        return f"""{data_block}Pregunta del usuario:
+{user_input}
+
+Proporciona una respuesta concisa y práctica, limitada a un máximo de 3 párrafos.
+
+{answer_label}
+"""
+    return f"Conversación previa:\n{session.transcript()}\n\n{prompt}"
+
+# Sesiones en memoria con expulsión LRU y caducidad por inactividad
+class SessionStore:
+    def __init__(self, max_sessions=SESSION_MAX, ttl=SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"creadas": 0, "expiradas": 0, "expulsadas": 0}
+
+    def create(self, agent=None):
+        session = Session(secrets.token_urlsafe(16), agent)
+        with self._lock:
+            self._sessions[session.id] = session
+            self._counters["creadas"] += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._counters["expulsadas"] += 1
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and time.time() - session.updated > self.ttl:
+                del self._sessions[session_id]
+                self._counters["expiradas"] += 1
+                session = None
+            if session is None:
+                raise SessionNotFound(f"Sesión no encontrada o caducada: {session_id}")
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                "activas": len(self._sessions),
+                "maximo": self.max_sessions,
+                "ttl_segundos": self.ttl,
+                "reutiliza_contexto": SESSION_CONTEXT_REUSE,
+            }
+
+_store = SessionStore()
+
+def get_session_store():
+    return _store
@@ -0,0 +1,68 @@
+# backend_templates.py
+
+import os
+import time
+from dotenv import load_dotenv
+from backend_context import untrimmed
+from backend_intents import UNROUTED, resolve_intent
+from backend_metrics import counter
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+# Modo de respuesta que puede pedir cada petición (campo "modo")
+MODE_TEMPLATE = "plantilla"  # plantilla si la intención tiene una y hay datos; si no, el modelo
+MODE_MODEL = "modelo"        # siempre el modelo
+
+# Intenciones que responden con plantilla sin que la petición lo pida: "agente.intencion"
+# separadas por comas o "*" para todas. Vacío (por defecto): sólo cuando la petición pide "plantilla"
+TEMPLATE_INTENTS = {item.strip() for item in os.getenv("TEMPLATE_INTENTS", "").split(",") if item.strip()}
+
+TEMPLATE_ANSWERS = counter("agente_respuestas_plantilla_total", "Respuestas generadas con plantilla a partir de los datos, sin el modelo.", ("agente", "intencion"))
+
+# Plantillas por (agente, intención): reciben el texto de datos de la consulta y devuelven la respuesta
+_templates = {}
+
+def register_template(agent, intent, render):
+    _templates[(agent, intent)] = render
+    return render
+
+def template_intents():
+    return sorted(f"{agent}.{intent}" for agent, intent in _templates)
+
+def use_template(agent, intent, mode=None):
+    if mode == MODE_MODEL or (agent, intent) not in _templates:
+        return False
+    if mode == MODE_TEMPLATE:
+        return True
+    return "*" in TEMPLATE_INTENTS or f"{agent}.{intent}" in TEMPLATE_INTENTS
+
+# Respuesta con plantilla, o None si hay que preguntar al modelo (sin plantilla, sin datos o modo "modelo")
+# La plantilla recibe los datos completos: el recorte del presupuesto de contexto sólo vale para el prompt
+def templated_answer(agent, intent, data, mode=None):
+    if not data or not use_template(agent, intent, mode):
+        return None
+    respuesta = _templates[(agent, intent)](untrimmed(data))
+    if respuesta:
+        TEMPLATE_ANSWERS.inc(agent, intent)
+    return respuesta
+
+# Plantilla para la pregunta, o None; en sesión el turno se registra como cualquier otra respuesta
+# intent: la intención si el agente ya la resolvió (ver backend_intents.resolve_intent)
+def template_for(agent, question, data, mode=None, session=None, intent=UNROUTED):
+    respuesta = templated_answer(agent, resolve_intent(agent, question, intent), data, mode)
+    if respuesta is not None and session is not None:
+        session.record_turn(question, respuesta)
+    return respuesta
+
+# Mismos eventos que una generación en streaming: un único texto y el evento final
+def template_events(respuesta, start, tiempos=None):
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+    yield {"tipo": "token", "texto": respuesta}
+    yield {
+        "tipo": "fin",
+        "respuesta": respuesta,
+        "cache": False,
+        "plantilla": True,
+        "tiempos": {**(tiempos or {}), "ttft_ms": elapsed_ms, "generacion_ms": elapsed_ms},
+    }
@@ -0,0 +1,124 @@
+# backend_tiers.py
+
+import os
+import threading
+from dotenv import load_dotenv
+from backend_intents import UNROUTED, resolve_intent
+from backend_metrics import GENERATION_MODEL_SECONDS, counter
+from backend_scheduler import queue_depth
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+# Elegir entre un modelo pequeño y rápido y el modelo del agente según la pregunta y la carga
+MODEL_TIERING_ENABLED = os.getenv("MODEL_TIERING", "0") == "1"
+
+TIER_SMALL = "pequeno"
+TIER_LARGE = "grande"
+# Con "auto" decide la pregunta (intención con datos o pregunta corta: pequeño; abierta: grande)
+TIER_AUTO = "auto"
+
+# El nivel grande es el modelo de cada agente (MODEL_<AGENTE>); el pequeño es común
+MODEL_SMALL = os.getenv("MODEL_PEQUENO", "llama3.2:1b")
+# Preguntas de hasta este número de palabras van al modelo pequeño (con política "auto")
+TIER_SHORT_WORDS = int(os.getenv("TIER_PALABRAS_CORTA", "12"))
+# Con esta cola de generaciones (o más) todo baja al modelo pequeño; 0 = nunca
+TIER_DOWNGRADE_QUEUE = int(os.getenv("TIER_COLA_DEGRADAR", "8"))
+
+# Políticas por agente o por intención: "financiero=grande,mercado.precio_promedio=pequeno"
+# (la de la intención manda sobre la del agente; sin política, "auto")
+def parse_policies(value):
+    policies = {}
+    for item in value.split(","):
+        if "=" in item:
+            target, tier = item.split("=", 1)
+            policies[target.strip()] = tier.strip()
+    return policies
+
+TIER_POLICIES = parse_policies(os.getenv("TIER_POLITICAS", ""))
+
+TIER_CHOICES = counter("agente_modelo_nivel_total", "Nivel de modelo elegido por agente y motivo (datos, corta, abierta, politica, carga, sesion).", ("agente", "nivel", "motivo"))
+
+class TierRouter:
+    def __init__(self, small_model=MODEL_SMALL, policies=None, short_words=TIER_SHORT_WORDS,
+                 downgrade_queue=TIER_DOWNGRADE_QUEUE, enabled=MODEL_TIERING_ENABLED):
+        self.small_model = small_model
+        self.policies = dict(TIER_POLICIES if policies is None else policies)
+        self.short_words = short_words
+        self.downgrade_queue = downgrade_queue
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._choices = {}
+
+    def policy(self, agent, intent):
+        return self.policies.get(f"{agent}.{intent}") or self.policies.get(agent) or TIER_AUTO
+
+    # Nivel y motivo para una pregunta; data son los datos encontrados en la BD (None si no hay)
+    def choose(self, agent, question, data, intent=UNROUTED):
+        intent = resolve_intent(agent, question, intent)
+        policy = self.policy(agent, intent)
+        if policy in (TIER_SMALL, TIER_LARGE):
+            tier, reason = policy, "politica"
+        elif intent is not None and data:
+            tier, reason = TIER_SMALL, "datos"
+        elif len(question.split()) <= self.short_words:
+            tier, reason = TIER_SMALL, "corta"
+        else:
+            tier, reason = TIER_LARGE, "abierta"
+        # Con la cola llena, responder antes con el modelo pequeño que hacer esperar a todos
+        if tier == TIER_LARGE and self.downgrade_queue and queue_depth() >= self.downgrade_queue:
+            tier, reason = TIER_SMALL, "carga"
+        return tier, reason
+
+    # Modelo para la generación; large_model es el del agente
+    # En una sesión el modelo no cambia: el 'context' de Ollama sólo vale para el modelo que lo generó
+    def select(self, agent, large_model, question, data=None, session=None, intent=UNROUTED):
+        if not self.enabled:
+            return large_model
+        if session is not None and session.model is not None:
+            model = session.model
+            tier, reason = (TIER_SMALL if model == self.small_model else TIER_LARGE), "sesion"
+        else:
+            tier, reason = self.choose(agent, question, data, intent)
+            model = self.small_model if tier == TIER_SMALL else large_model
+            if session is not None:
+                session.model = model
+        TIER_CHOICES.inc(agent, tier, reason)
+        with self._lock:
+            stats = self._choices.setdefault(agent, {})
+            stats[tier] = stats.get(tier, 0) + 1
+            stats[f"{tier}_{reason}"] = stats.get(f"{tier}_{reason}", 0) + 1
+        return model
+
+    def stats(self):
+        with self._lock:
+            choices = {agent: dict(stats) for agent, stats in self._choices.items()}
+        # Latencia de generación por modelo (agente_generacion_modelo_segundos)
+        latencies = {
+            model: {"generaciones": count, "media_ms": round(total / count * 1000, 1)}
+            for (model,), (total, count) in GENERATION_MODEL_SECONDS.totals().items() if count
+        }
+        return {
+            "activado": self.enabled,
+            "modelo_pequeno": self.small_model,
+            "palabras_pregunta_corta": self.short_words,
+            "cola_para_degradar": self.downgrade_queue,
+            "politicas": dict(self.policies),
+            "elecciones": choices,
+            "latencia_por_modelo": latencies,
+        }
+
+_router = TierRouter()
+
+def get_tier_router():
+    return _router
+
+def select_model(agent, large_model, question, data=None, session=None, intent=UNROUTED):
+    return _router.select(agent, large_model, question, data, session, intent)
+
+# Modelos que hay que precargar además de los de los agentes
+def tier_models():
+    return [MODEL_SMALL] if MODEL_TIERING_ENABLED else []
+
+def get_tier_stats():
+    return _router.stats()
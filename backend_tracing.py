@@ -0,0 +1,244 @@
+# backend_tracing.py
+
+import contextvars
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from backend_metrics import counter
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+# Tiempo por etapa de cada petición, en la cabecera Server-Timing
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") == "1"
+# Peticiones más lentas que esto (ms) se guardan en el registro de lentas
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+# Fracción de las peticiones lentas que se guardan
+TRACE_SLOW_SAMPLE = float(os.getenv("TRACE_SLOW_SAMPLE", "1"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+# Fracción de peticiones que se perfilan con cProfile (0 = nunca); de las lentas se guardan las TRACE_PROFILE_KEEP peores
+TRACE_PROFILE_RATE = float(os.getenv("TRACE_PROFILE_RATE", "0"))
+TRACE_PROFILE_KEEP = int(os.getenv("TRACE_PROFILE_KEEP", "5"))
+# Funciones por perfil guardado, ordenadas por tiempo acumulado
+TRACE_PROFILE_LINES = int(os.getenv("TRACE_PROFILE_LINES", "40"))
+
+# Etapas que se miden (nombres de la cabecera Server-Timing)
+STAGE_DB_CONNECT = "db_connect"
+STAGE_DB_QUERY = "db_query"
+STAGE_PROMPT = "prompt"
+STAGE_QUEUE = "queue"
+STAGE_MODEL_LOAD = "model_load"
+STAGE_TTFT = "ttft"
+STAGE_GENERATE = "generate"
+
+SLOW_REQUESTS = counter("api_peticiones_lentas_total", "Peticiones que superaron TRACE_SLOW_MS, por ruta.", ("ruta",))
+
+# Etapas de una petición; con varios agentes a la vez (/agentes) cada etapa suma las de todos
+class Trace:
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        # Plantilla de la ruta (/sesiones/{session_id}) para la etiqueta de la métrica
+        self.route = path
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = {}
+        # Las etapas de la BD se registran desde los hilos del executor
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    # Sumar las etapas de otra traza (una ejecución compartida, ver backend_coalesce)
+    def merge(self, other):
+        with other._lock:
+            spans = dict(other.spans)
+        with self._lock:
+            for name, seconds in spans.items():
+                self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def stages_ms(self):
+        with self._lock:
+            return {name: round(seconds * 1000, 1) for name, seconds in self.spans.items()}
+
+    def server_timing(self):
+        parts = [f"{name};dur={ms}" for name, ms in self.stages_ms().items()]
+        parts.append(f"total;dur={round(self.elapsed_ms(), 1)}")
+        return ", ".join(parts)
+
+_trace = contextvars.ContextVar("request_trace", default=None)
+
+def current_trace():
+    return _trace.get()
+
+def enter_trace(trace):
+    _trace.set(trace)
+    return trace
+
+# Sumar a la petición actual las etapas de una traza que corrió fuera de ella
+def merge_trace(trace):
+    current = _trace.get()
+    if current is not None and trace is not None and current is not trace:
+        current.merge(trace)
+
+def add_span(name, seconds):
+    trace = _trace.get()
+    if trace is not None and seconds is not None:
+        trace.add(name, seconds)
+
+# Medir un bloque como etapa de la petición actual (sin petición, no hace nada)
+@contextmanager
+def span(name):
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+# Etapas de una generación de Ollama: carga del modelo (load_duration), primer token y generación.
+# Se miden desde que la generación tiene hueco en el planificador: la búsqueda en las cachés y la
+# espera en cola ya cuentan en sus propias etapas (generate incluye model_load y ttft)
+def trace_generation(generation, ttft, final_chunk=None):
+    load_ns = getattr(final_chunk, 'load_duration', None)
+    if load_ns:
+        add_span(STAGE_MODEL_LOAD, load_ns / 1e9)
+    add_span(STAGE_TTFT, ttft)
+    add_span(STAGE_GENERATE, generation)
+
+# Registro circular de peticiones lentas y perfiles de las más lentas
+class SlowRequestLog:
+    def __init__(self, size=TRACE_BUFFER_SIZE, keep_profiles=TRACE_PROFILE_KEEP):
+        self._entries = deque(maxlen=size)
+        self._profiles = []
+        self.keep_profiles = keep_profiles
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def record(self, trace, status, profile=None):
+        entry = {
+            "id": next(self._ids),
+            "metodo": trace.method,
+            "ruta": trace.path,
+            "estado": status,
+            "inicio": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(trace.started_at)),
+            "total_ms": round(trace.elapsed_ms(), 1),
+            "etapas": trace.stages_ms(),
+            "perfil": False,
+        }
+        with self._lock:
+            if profile is not None and self._keeps(entry["total_ms"]):
+                entry["perfil"] = True
+                self._profiles.append({"id": entry["id"], "ruta": entry["ruta"], "total_ms": entry["total_ms"], "estadisticas": profile})
+                self._profiles.sort(key=lambda item: item["total_ms"], reverse=True)
+                del self._profiles[self.keep_profiles:]
+            self._entries.append(entry)
+        return entry
+
+    def _keeps(self, total_ms):
+        return len(self._profiles) < self.keep_profiles or total_ms > self._profiles[-1]["total_ms"]
+
+    # Las más recientes primero
+    def entries(self, limit=None):
+        with self._lock:
+            entries = list(reversed(self._entries))
+        return entries[:limit] if limit else entries
+
+    def profiles(self):
+        with self._lock:
+            return list(self._profiles)
+
+_slow_log = SlowRequestLog()
+# cProfile perfila el hilo entero: sólo una petición a la vez
+_profiling = threading.Lock()
+
+# Perfil de la petición que empieza, o None. Incluye lo que hagan otras peticiones en el event loop
+# mientras tanto y no incluye las consultas a la BD (corren en otros hilos)
+def start_profile():
+    if TRACE_PROFILE_RATE <= 0 or random.random() >= TRACE_PROFILE_RATE:
+        return None
+    if not _profiling.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Hay otro perfilador activo en el proceso (un depurador u otro cProfile)
+        _profiling.release()
+        return None
+    return profiler
+
+def stop_profile(profiler):
+    profiler.disable()
+    _profiling.release()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(TRACE_PROFILE_LINES)
+    return out.getvalue()
+
+def finish_trace(trace, status, profiler=None):
+    profile = stop_profile(profiler) if profiler is not None else None
+    if trace.elapsed_ms() < TRACE_SLOW_MS:
+        return None
+    SLOW_REQUESTS.inc(trace.route)
+    if random.random() >= TRACE_SLOW_SAMPLE:
+        return None
+    return _slow_log.record(trace, status, profile)
+
+# Middleware ASGI: abre la traza de cada petición HTTP y añade Server-Timing a la respuesta.
+# En las respuestas en streaming las cabeceras salen antes de generar: la cabecera sólo lleva lo
+# previo y las etapas completas quedan en el registro de lentas (y en "tiempos" del evento final)
+class TracingMiddleware:
+    def __init__(self, app, enabled=TRACING_ENABLED):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+        trace = Trace(scope["method"], scope["path"])
+        token = _trace.set(trace)
+        profiler = start_profile()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace.reset(token)
+            # El router de Starlette deja la ruta resuelta en el scope
+            trace.route = getattr(scope.get("route"), "path", trace.path)
+            finish_trace(trace, status, profiler)
+
+def get_slow_requests(limit=None):
+    return {
+        "umbral_ms": TRACE_SLOW_MS,
+        "muestreo": TRACE_SLOW_SAMPLE,
+        "peticiones": _slow_log.entries(limit),
+    }
+
+def get_profiles():
+    return {"frecuencia": TRACE_PROFILE_RATE, "perfiles": _slow_log.profiles()}
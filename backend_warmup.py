@@ -0,0 +1,185 @@
+# backend_warmup.py
+
+import asyncio
+import logging
+import os
+import time
+from dotenv import load_dotenv
+from backend_db import get_pool, run_db
+from backend_facts import start_facts
+from backend_hosts import get_host_pool
+from backend_ollama import OLLAMA_KEEP_ALIVE
+from backend_scheduler import get_scheduler
+from backend_semantic_cache import EMBEDDING_MODEL, SEMANTIC_CACHE_ENABLED
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Cargar el modelo y abrir las conexiones antes de declarar el servicio listo
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+# Segundos entre reintentos si Ollama o PostgreSQL no responden al arrancar
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "10"))
+# Segundos entre pings que mantienen el modelo cargado en periodos sin tráfico; 0 = desactivado
+KEEP_WARM_INTERVAL = float(os.getenv("KEEP_WARM_INTERVAL", "0"))
+
+WARMUP_PROMPT = "Hola"
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+# Estado de las comprobaciones de arranque; /ready responde 200 cuando pasaron todas las obligatorias.
+# Las opcionales (embeddings de la caché semántica) que fallan dejan el servicio listo pero "degradado"
+class Readiness:
+    def __init__(self):
+        self.checks = {}
+        self.finished = False
+        self.warmup_ms = None
+        self.keep_warm = {"pings": 0, "fallidos": 0, "ultimo_ms": None}
+
+    def mark(self, name, ok, ms, optional=False, **details):
+        self.checks[name] = {"listo": ok, "ms": ms, **details}
+        if optional:
+            self.checks[name]["opcional"] = True
+
+    def passed(self, name):
+        return self.checks.get(name, {}).get("listo", False)
+
+    @property
+    def ready(self):
+        return self.finished and all(check["listo"] or check.get("opcional") for check in self.checks.values())
+
+    # Comprobaciones opcionales que no pasaron
+    def degraded(self):
+        return sorted(name for name, check in self.checks.items() if check.get("opcional") and not check["listo"])
+
+    def stats(self):
+        return {
+            "listo": self.ready,
+            "degradado": self.degraded(),
+            "calentamiento_ms": self.warmup_ms,
+            "comprobaciones": self.checks,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "mantener_caliente": {"intervalo_s": KEEP_WARM_INTERVAL, **self.keep_warm},
+        }
+
+# Ejecutar call(cliente) en cada servidor de Ollama; devuelve {host: respuesta o excepción}
+async def on_every_host(call):
+    hosts = get_host_pool().hosts
+    results = await asyncio.gather(*(call(host.async_client()) for host in hosts), return_exceptions=True)
+    return {host.url: result for host, result in zip(hosts, results)}
+
+# Listo si al menos un servidor respondió: el reparto evita a los demás hasta que se recuperen
+def mark_hosts(readiness, name, results, start, describe, optional=False):
+    failed = {url: str(result) for url, result in results.items() if isinstance(result, Exception)}
+    for url, error in failed.items():
+        logger.error("No se pudo cargar %s en %s: %s", name, url, error)
+    details = {url: (describe(result) if not isinstance(result, Exception) else {"error": str(result)})
+               for url, result in results.items()}
+    readiness.mark(name, len(failed) < len(results), elapsed_ms(start), optional, hosts=details)
+
+# Generación mínima: cada servidor carga el modelo (load_duration) y lo deja residente keep_alive
+async def warm_model(readiness, model):
+    start = time.perf_counter()
+    results = await on_every_host(lambda client: client.generate(
+        model=model, prompt=WARMUP_PROMPT, options={"num_predict": 1}, keep_alive=OLLAMA_KEEP_ALIVE
+    ))
+
+    def describe(response):
+        load_ns = getattr(response, 'load_duration', None)
+        return {"carga_ms": round(load_ns / 1e6, 1) if load_ns else None}
+    mark_hosts(readiness, f"modelo:{model}", results, start, describe)
+
+# Opcional: sin el modelo de embeddings el servicio responde igual, sólo sin caché semántica
+async def warm_embeddings(readiness, model):
+    start = time.perf_counter()
+    results = await on_every_host(lambda client: client.embed(
+        model=model, input=WARMUP_PROMPT, keep_alive=OLLAMA_KEEP_ALIVE
+    ))
+    mark_hosts(readiness, f"embeddings:{model}", results, start, lambda response: {}, optional=True)
+
+# Abrir las conexiones mínimas del pool y comprobar que PostgreSQL responde
+def open_db_connections():
+    pool = get_pool()
+    pool.prefill()
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    return pool.stats()["tamano"]
+
+async def warm_db(readiness):
+    start = time.perf_counter()
+    try:
+        size = await run_db(open_db_connections)
+    except Exception as e:
+        logger.error("No se pudo conectar con la base de datos al arrancar: %s", e)
+        readiness.mark("base_de_datos", False, elapsed_ms(start), error=str(e))
+        return
+    readiness.mark("base_de_datos", True, elapsed_ms(start), conexiones=size)
+    # Con la BD disponible, cargar los hechos y escuchar sus cambios (si fallan, los agentes consultan la BD)
+    await run_db(start_facts)
+
+# Reintentar las comprobaciones pendientes hasta que pasen las obligatorias; las opcionales se
+# reintentan mientras tanto, pero no retrasan /ready
+async def run_warmup(readiness, models, retry_interval=WARMUP_RETRY_INTERVAL):
+    start = time.perf_counter()
+    while True:
+        steps = []
+        if not readiness.passed("base_de_datos"):
+            steps.append(warm_db(readiness))
+        for model in models:
+            if not readiness.passed(f"modelo:{model}"):
+                steps.append(warm_model(readiness, model))
+        if SEMANTIC_CACHE_ENABLED and not readiness.passed(f"embeddings:{EMBEDDING_MODEL}"):
+            steps.append(warm_embeddings(readiness, EMBEDDING_MODEL))
+        await asyncio.gather(*steps)
+        readiness.finished = True
+        if readiness.ready:
+            break
+        await asyncio.sleep(retry_interval)
+    readiness.warmup_ms = elapsed_ms(start)
+    logger.info("Servicio listo tras %s ms de calentamiento.", readiness.warmup_ms)
+    for name in readiness.degraded():
+        logger.warning("Servicio degradado: falló la comprobación opcional %s (la caché semántica no encontrará aciertos).", name)
+
+# Petición vacía: Ollama (re)carga el modelo y renueva su keep_alive sin generar
+async def keep_warm(readiness, models, interval=KEEP_WARM_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        scheduler = get_scheduler()
+        if scheduler.running or scheduler.queued:
+            # Hay tráfico: el modelo ya está cargado
+            continue
+        for model in models:
+            start = time.perf_counter()
+            results = await on_every_host(lambda client: client.generate(model=model, prompt="", keep_alive=OLLAMA_KEEP_ALIVE))
+            for url, result in results.items():
+                if isinstance(result, Exception):
+                    logger.error("Falló el ping para mantener cargado %s en %s: %s", model, url, result)
+                    readiness.keep_warm["fallidos"] += 1
+                else:
+                    readiness.keep_warm["pings"] += 1
+            readiness.keep_warm["ultimo_ms"] = elapsed_ms(start)
+
+_readiness = Readiness()
+_tasks = []
+
+# Lanzar el calentamiento en segundo plano: /live responde desde el primer momento y /ready al terminar
+def start_warmup(models):
+    if not WARMUP_ENABLED:
+        _readiness.finished = True
+        _tasks.append(asyncio.create_task(run_db(start_facts)))
+        return
+    _tasks.append(asyncio.create_task(run_warmup(_readiness, models)))
+    if KEEP_WARM_INTERVAL > 0:
+        _tasks.append(asyncio.create_task(keep_warm(_readiness, models)))
+
+async def stop_warmup():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+def get_readiness():
+    return _readiness
@@ -0,0 +1,153 @@
+# benchmarks/agregados_sql.py
+# Compara las consultas antiguas (traer todas las filas y agregar en Python) con los agregados
+# en SQL sobre un conjunto sintético de 1M de filas, antes y después de los índices de migrations/002.
+# Usa la base del .env pero trabaja en un esquema propio que se borra al terminar.
+# Uso: python -m benchmarks.agregados_sql [filas]
+
+import json
+import sys
+import time
+import psycopg2
+from backend_db import connection_params
+
+SCHEMA = "bench_agregados"
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REPEAT = 5
+
+SETUP = f"""
+DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;
+CREATE SCHEMA {SCHEMA};
+SET search_path TO {SCHEMA};
+
+CREATE TABLE agente_financiero AS
+SELECT
+    (ARRAY['Pequeño', 'Mediano', 'Grande'])[1 + i % 3] AS tipo_negocio,
+    (ARRAY['Préstamo bancario, Microcrédito', 'Leasing, Factoring', 'Capital semilla, Préstamo bancario'])[1 + i % 3] AS opciones_financiamiento,
+    (ARRAY['Bajo', 'Medio', 'Alto'])[1 + i % 3] AS nivel_endeudamiento,
+    (1000 + i % 9000)::numeric AS ingresos_mensuales,
+    (ARRAY['DNI, RUC', 'DNI, Estados financieros', 'RUC, Declaración de impuestos'])[1 + i % 3] AS documentos_necesarios
+FROM generate_series(1, {ROWS}) AS i;
+
+CREATE TABLE agente_mercado AS
+SELECT
+    'categoria_' || (i % 500) AS categoria,
+    (10 + i % 990)::numeric AS precio,
+    'zona_' || (i % 200) AS ubicacion_geografica,
+    (ARRAY['Chile, Colombia', 'México, España', 'Estados Unidos, Chile'])[1 + i % 3] AS mercados_internacionales
+FROM generate_series(1, {ROWS}) AS i;
+
+ANALYZE agente_financiero;
+ANALYZE agente_mercado;
+"""
+
+INDEXES = """
+CREATE INDEX ON agente_mercado (categoria) INCLUDE (precio);
+CREATE INDEX ON agente_mercado (ubicacion_geografica);
+CREATE INDEX ON agente_financiero (tipo_negocio);
+ANALYZE agente_financiero;
+ANALYZE agente_mercado;
+"""
+
+def split_distinct(rows):
+    values = set()
+    for row in rows:
+        values.update(map(str.strip, row[0].split(",")))
+    return values
+
+# Versión anterior: todas las filas viajan al proceso y se agregan en Python
+def old_endeudamiento(cursor):
+    cursor.execute("SELECT nivel_endeudamiento, ingresos_mensuales FROM agente_financiero")
+    rows = cursor.fetchall()
+    niveles = [row[0] for row in rows]
+    ingresos = [row[1] for row in rows]
+    return niveles.count('Bajo') / len(niveles) * 100, sum(ingresos) / len(ingresos)
+
+def old_documentos(cursor):
+    cursor.execute("SELECT DISTINCT documentos_necesarios FROM agente_financiero")
+    return split_distinct(cursor.fetchall())
+
+def old_mercados(cursor):
+    cursor.execute("SELECT mercados_internacionales FROM agente_mercado")
+    return split_distinct(cursor.fetchall())
+
+def new_endeudamiento(cursor):
+    cursor.execute("""
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE nivel_endeudamiento = 'Bajo'), AVG(ingresos_mensuales)
+        FROM agente_financiero
+    """)
+    return cursor.fetchone()
+
+def new_documentos(cursor):
+    cursor.execute("""
+        SELECT DISTINCT btrim(documento)
+        FROM agente_financiero, unnest(string_to_array(documentos_necesarios, ',')) AS documento
+    """)
+    return cursor.fetchall()
+
+def new_mercados(cursor):
+    cursor.execute("""
+        SELECT DISTINCT btrim(mercado)
+        FROM agente_mercado, unnest(string_to_array(mercados_internacionales, ',')) AS mercado
+    """)
+    return cursor.fetchall()
+
+def precio_promedio(cursor):
+    cursor.execute("SELECT AVG(precio) FROM agente_mercado WHERE categoria = %s", ("categoria_42",))
+    return cursor.fetchone()
+
+def competidores(cursor):
+    cursor.execute("SELECT COUNT(*) FROM agente_mercado WHERE ubicacion_geografica = %s", ("zona_7",))
+    return cursor.fetchone()
+
+def opciones_pequeno(cursor):
+    cursor.execute("""
+        SELECT DISTINCT btrim(opcion)
+        FROM agente_financiero, unnest(string_to_array(opciones_financiamiento, ',')) AS opcion
+        WHERE tipo_negocio = 'Pequeño'
+    """)
+    return cursor.fetchall()
+
+def measure(name, func, cursor):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(cursor)
+        times.append(time.perf_counter() - start)
+    return {"consulta": name, "filas": ROWS, "media_ms": round(sum(times) / len(times) * 1000, 1), "min_ms": round(min(times) * 1000, 1)}
+
+def main():
+    conn = psycopg2.connect(**connection_params())
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            print(f"[INFO] Generando {ROWS} filas sintéticas en el esquema {SCHEMA}...", file=sys.stderr)
+            cursor.execute(SETUP)
+            cursor.execute(f"SET search_path TO {SCHEMA}")
+
+            for name, func in [
+                ("endeudamiento_python", old_endeudamiento),
+                ("endeudamiento_sql", new_endeudamiento),
+                ("documentos_python", old_documentos),
+                ("documentos_sql", new_documentos),
+                ("mercados_python", old_mercados),
+                ("mercados_sql", new_mercados),
+            ]:
+                print(json.dumps(measure(name, func, cursor), ensure_ascii=False))
+
+            filtered = [
+                ("precio_promedio", precio_promedio),
+                ("competidores", competidores),
+                ("opciones_pequeno", opciones_pequeno),
+            ]
+            for name, func in filtered:
+                print(json.dumps(measure(f"{name}_sin_indice", func, cursor), ensure_ascii=False))
+            cursor.execute(INDEXES)
+            for name, func in filtered:
+                print(json.dumps(measure(f"{name}_con_indice", func, cursor), ensure_ascii=False))
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.close()
+
+if __name__ == "__main__":
+    main()
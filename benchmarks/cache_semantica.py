@@ -0,0 +1,59 @@
+# benchmarks/cache_semantica.py
+# Mide la latencia de búsqueda en la caché semántica con 10k y 100k preguntas guardadas.
+# Uso: python -m benchmarks.cache_semantica
+
+import json
+import time
+import numpy as np
+from backend_semantic_cache import SemanticIndex, context_hash
+
+# Dimensión de nomic-embed-text, el modelo de embeddings por defecto
+DIM = 768
+SIZES = [10_000, 100_000]
+LOOKUPS = 200
+CONTEXTS = [context_hash(None), context_hash("Documentos necesarios para pedir un préstamo: DNI, RUC")]
+
+def build_index(size, rng):
+    index = SemanticIndex(capacity=size)
+    vectors = rng.standard_normal((size, DIM), dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        index.add(vector, CONTEXTS[i % len(CONTEXTS)], f"respuesta {i}")
+    return index, vectors
+
+def run_size(size, rng):
+    start = time.perf_counter()
+    index, vectors = build_index(size, rng)
+    build_s = time.perf_counter() - start
+
+    # Mitad de consultas parafraseadas (vector guardado con ruido) y mitad sin equivalente
+    queries = []
+    for i in range(LOOKUPS):
+        if i % 2 == 0:
+            j = int(rng.integers(size))
+            queries.append((vectors[j] + rng.standard_normal(DIM, dtype=np.float32) * 0.05, CONTEXTS[j % len(CONTEXTS)]))
+        else:
+            queries.append((rng.standard_normal(DIM, dtype=np.float32), CONTEXTS[0]))
+
+    latencies = []
+    hits = 0
+    for vector, context in queries:
+        start = time.perf_counter()
+        answer, _ = index.search(vector, context, 0.92)
+        latencies.append(time.perf_counter() - start)
+        hits += answer is not None
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "entradas": size,
+        "dimension": DIM,
+        "construccion_s": round(build_s, 2),
+        "busqueda_media_ms": round(float(latencies_ms.mean()), 3),
+        "busqueda_p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "aciertos": hits,
+        "consultas": LOOKUPS,
+    }
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    for size in SIZES:
+        print(json.dumps(run_size(size, rng), ensure_ascii=False))
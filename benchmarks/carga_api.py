@@ -0,0 +1,190 @@
+# benchmarks/carga_api.py
+# Prueba de carga reproducible de los tres endpoints de FastAPI: levanta Ollama simulado, una base
+# sintética desechable (benchmarks/datos_sinteticos.py) y el servicio en local, y mide a concurrencia fija.
+# Informa p50/p95/p99, peticiones por segundo y tasa de error en JSON para comparar entre commits
+# (ver benchmarks/comparar_carga.py).
+# Uso: python -m benchmarks.carga_api --concurrencia 1,4,16 --peticiones 100 --salida carga.json
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from benchmarks.fake_ollama import FakeOllamaServer, ServerThread, free_port
+
+parser = argparse.ArgumentParser(description="Prueba de carga de los endpoints de agentes")
+parser.add_argument("--concurrencia", default="1,4,16,32", help="niveles de concurrencia separados por comas")
+parser.add_argument("--peticiones", type=int, default=100, help="peticiones por endpoint y nivel")
+parser.add_argument("--endpoints", default="financiero,marketing,mercado")
+parser.add_argument("--filas", type=int, default=10_000, help="filas sintéticas por tabla")
+parser.add_argument("--ttft", type=float, default=0.05, help="segundos hasta el primer token del Ollama simulado")
+parser.add_argument("--tokens-por-segundo", type=float, default=200.0)
+parser.add_argument("--fallos", type=float, default=0.0, help="fracción de generaciones que fallan")
+parser.add_argument("--semilla", type=int, default=42)
+parser.add_argument("--con-cache", action="store_true", help="no desactivar las cachés de respuestas")
+parser.add_argument("--salida", help="archivo JSON con los resultados")
+ARGS = parser.parse_args()
+
+OLLAMA_PORT = free_port()
+API_PORT = free_port()
+# El servicio lee su configuración del entorno al importarse: fijarla antes de importar main
+os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{OLLAMA_PORT}"
+os.environ.setdefault("BENCH_DATABASE", "agentes_bench")
+os.environ["DATABASE"] = os.environ["BENCH_DATABASE"]
+# Todas las peticiones salen del mismo cliente: sin límite por cliente
+os.environ["RATE_LIMIT_RPS"] = "0"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+if not ARGS.con_cache:
+    os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+    os.environ["SEMANTIC_CACHE_ENABLED"] = "0"
+
+import httpx  # noqa: E402
+from backend_db import DB_CONNECTION_ERROR  # noqa: E402
+from benchmarks.datos_sinteticos import CATEGORIAS, OBJETIVOS, PRODUCTOS, UBICACIONES, synthetic_database  # noqa: E402
+
+QUESTIONS = {
+    "financiero": [
+        "¿Qué opciones de financiamiento tengo para un negocio pequeño?",
+        "¿Califico para un préstamo?",
+        "¿Qué documentos necesito para un préstamo?",
+        "¿Cómo organizo el flujo de caja de mi empresa?",
+    ],
+    "mercado": [
+        ("¿Cuál es el precio promedio de un producto similar?", "categoria"),
+        ("¿Qué tan competitivo es el mercado en mi zona?", "ubicacion"),
+        ("¿Qué mercados internacionales podrían estar interesados en mi producto?", None),
+    ],
+}
+
+# Cuerpos de petición deterministas (misma semilla = misma secuencia en cada commit)
+def build_payloads(endpoint, count, rng):
+    payloads = []
+    for _ in range(count):
+        if endpoint == "financiero":
+            payloads.append({"user_input": rng.choice(QUESTIONS["financiero"])})
+        elif endpoint == "marketing":
+            payloads.append({
+                "user_input": "Quiero crear una campaña de marketing para mi producto",
+                "producto": rng.choice(PRODUCTOS),
+                "objetivo": rng.choice(OBJETIVOS),
+                "presupuesto": round(rng.uniform(100, 20_000), 2),
+            })
+        else:
+            question, param = rng.choice(QUESTIONS["mercado"])
+            payload = {"user_input": question}
+            if param == "categoria":
+                payload["categoria"] = rng.choice(CATEGORIAS)
+            elif param == "ubicacion":
+                payload["ubicacion"] = rng.choice(UBICACIONES)
+            payloads.append(payload)
+    return payloads
+
+# Los agentes responden 200 con el texto del error cuando falla la BD o el modelo
+def is_error_answer(response):
+    if response.status_code != 200:
+        return True
+    answer = response.json().get("respuesta", "")
+    return answer == DB_CONNECTION_ERROR or answer.startswith("Error inesperado")
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return round(sorted_values[index] * 1000, 1)
+
+async def run_level(client, endpoint, payloads, concurrency):
+    latencies = []
+    errors = 0
+    pending = iter(payloads)
+
+    async def worker():
+        nonlocal errors
+        for payload in pending:
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"/agente_{endpoint}/", json=payload)
+                failed = is_error_answer(response)
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "endpoint": endpoint,
+        "concurrencia": concurrency,
+        "peticiones": len(latencies),
+        "segundos": round(elapsed, 3),
+        "peticiones_por_segundo": round(len(latencies) / elapsed, 2),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "tasa_error": round(errors / len(latencies), 4) if latencies else 0.0,
+    }
+
+async def wait_ready(client, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("El servicio no quedó listo a tiempo (ver GET /ready)")
+
+async def run_all(base_url):
+    levels = [int(level) for level in ARGS.concurrencia.split(",")]
+    endpoints = ARGS.endpoints.split(",")
+    rng = random.Random(ARGS.semilla)
+    results = []
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        await wait_ready(client)
+        for endpoint, concurrency in itertools.product(endpoints, levels):
+            payloads = build_payloads(endpoint, ARGS.peticiones, rng)
+            result = await run_level(client, endpoint, payloads, concurrency)
+            print(json.dumps(result, ensure_ascii=False))
+            # Todo errores: las latencias medirían los rechazos, no el servicio
+            if result["peticiones"] and result["tasa_error"] == 1.0:
+                raise RuntimeError(f"Todas las peticiones a /agente_{endpoint}/ fallaron (concurrencia {concurrency}); "
+                                   "revisar la ruta, la BD sintética y el Ollama simulado")
+            results.append(result)
+    return results
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    config = {key: value for key, value in vars(ARGS).items() if key != "salida"}
+    print(f"[INFO] Creando la base sintética {os.environ['DATABASE']} ({ARGS.filas} filas por tabla)...", file=sys.stderr)
+    with synthetic_database(ARGS.filas, ARGS.semilla, os.environ["DATABASE"]):
+        with FakeOllamaServer(port=OLLAMA_PORT, ttft=ARGS.ttft, token_delay=1 / ARGS.tokens_por_segundo,
+                              failure_rate=ARGS.fallos, seed=ARGS.semilla):
+            import main as service
+            with ServerThread(service.app, API_PORT) as api:
+                results = asyncio.run(run_all(api.url))
+    report = {
+        "commit": current_commit(),
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "configuracion": config,
+        "resultados": results,
+    }
+    if ARGS.salida:
+        with open(ARGS.salida, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+if __name__ == "__main__":
+    main()
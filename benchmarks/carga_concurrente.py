@@ -0,0 +1,64 @@
+# benchmarks/carga_concurrente.py
+# Prueba de carga: compara la ruta bloqueante y la asíncrona contra un Ollama simulado.
+# Uso: python -m benchmarks.carga_concurrente
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import time
+from benchmarks.fake_ollama import FakeOllamaServer, free_port
+
+PORT = free_port()
+# El cliente por defecto de ollama lee OLLAMA_HOST al importarse
+os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{PORT}"
+# Medir siempre contra el modelo: sin cachés de respuestas
+os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "0"
+
+import backend_ollama  # noqa: E402
+
+MODEL_NAME = "llama3.2:3b"
+PROMPT = "¿Qué documentos necesito para un préstamo?"
+CONCURRENCY_LEVELS = [1, 2, 4, 8, 16, 32]
+REQUESTS_PER_WORKER = 4
+
+async def run_level(concurrency, blocking):
+    async def one_request():
+        if blocking:
+            # Comportamiento anterior: la llamada síncrona bloquea el event loop
+            return backend_ollama.generate_response(PROMPT, MODEL_NAME)
+        return await backend_ollama.generate_response_async(PROMPT, MODEL_NAME)
+
+    async def worker():
+        for _ in range(REQUESTS_PER_WORKER):
+            await one_request()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    total = concurrency * REQUESTS_PER_WORKER
+    return {
+        "modo": "bloqueante" if blocking else "async",
+        "concurrencia": concurrency,
+        "peticiones": total,
+        "segundos": round(elapsed, 3),
+        "peticiones_por_segundo": round(total / elapsed, 2),
+    }
+
+async def main():
+    results = []
+    for blocking in (True, False):
+        for concurrency in CONCURRENCY_LEVELS:
+            # Silenciar los prints de depuración durante la medición
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = await run_level(concurrency, blocking)
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False))
+    await backend_ollama.close_async_client()
+    return results
+
+if __name__ == "__main__":
+    with FakeOllamaServer(port=PORT, ttft=0.05, token_delay=0.005):
+        asyncio.run(main())
@@ -0,0 +1,58 @@
+# benchmarks/comparar_carga.py
+# Compara dos informes de benchmarks/carga_api.py (p. ej. el commit anterior y el actual).
+# Sale con código 1 si alguna latencia o el rendimiento empeoran más que el umbral, o si sube la tasa de error.
+# Uso: python -m benchmarks.comparar_carga base.json nuevo.json [--umbral 0.10]
+
+import argparse
+import json
+import sys
+
+# Métricas donde más es peor (latencias) y donde más es mejor (rendimiento)
+LOWER_IS_BETTER = ["p50_ms", "p95_ms", "p99_ms"]
+HIGHER_IS_BETTER = ["peticiones_por_segundo"]
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    return report, {(r["endpoint"], r["concurrencia"]): r for r in report["resultados"]}
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+def compare(base, new, threshold):
+    rows = []
+    regressions = []
+    for key in sorted(base.keys() & new.keys()):
+        old_result, new_result = base[key], new[key]
+        row = {"endpoint": key[0], "concurrencia": key[1]}
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            delta = change(old_result.get(metric), new_result.get(metric))
+            row[metric] = {"antes": old_result.get(metric), "despues": new_result.get(metric),
+                           "cambio": round(delta, 4) if delta is not None else None}
+            worse = delta is not None and (delta > threshold if metric in LOWER_IS_BETTER else delta < -threshold)
+            if worse:
+                regressions.append(f"{key[0]}@{key[1]} {metric} {delta:+.1%}")
+        row["tasa_error"] = {"antes": old_result["tasa_error"], "despues": new_result["tasa_error"]}
+        if new_result["tasa_error"] > old_result["tasa_error"]:
+            regressions.append(f"{key[0]}@{key[1]} tasa_error {old_result['tasa_error']} -> {new_result['tasa_error']}")
+        rows.append(row)
+    return rows, regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Comparar dos informes de carga")
+    parser.add_argument("base")
+    parser.add_argument("nuevo")
+    parser.add_argument("--umbral", type=float, default=0.10, help="empeoramiento relativo tolerado")
+    args = parser.parse_args()
+
+    base_report, base = load(args.base)
+    new_report, new = load(args.nuevo)
+    if base_report["configuracion"] != new_report["configuracion"]:
+        print("[AVISO] Los informes se generaron con configuraciones distintas.", file=sys.stderr)
+    rows, regressions = compare(base, new, args.umbral)
+    for row in rows:
+        print(json.dumps(row, ensure_ascii=False))
+    print(json.dumps({"base": base_report["commit"], "nuevo": new_report["commit"], "regresiones": regressions}, ensure_ascii=False))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,153 @@
+# benchmarks/datos_sinteticos.py
+# Base de datos desechable con datos sintéticos (semilla fija) para las tres tablas agente_*.
+# Se crea en el servidor PostgreSQL del .env y se borra al terminar; la base del .env no se toca.
+# Uso: python -m benchmarks.datos_sinteticos [filas]   (crea la base y la conserva; DATABASE=agentes_bench para usarla)
+
+import contextlib
+import json
+import os
+import random
+import sys
+from pathlib import Path
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from backend_db import connection_params
+
+BENCH_DATABASE = os.getenv("BENCH_DATABASE", "agentes_bench")
+DEFAULT_ROWS = 10_000
+DEFAULT_SEED = 42
+# Índices de las migraciones, para medir con el mismo esquema que producción
+MIGRATIONS = ["002_indices_agentes.sql", "003_indice_presupuesto_marketing.sql", "004_indice_presupuesto_desc_marketing.sql"]
+
+SCHEMA = """
+CREATE TABLE agente_financiero (
+    id serial PRIMARY KEY,
+    tipo_negocio text,
+    opciones_financiamiento text,
+    nivel_endeudamiento text,
+    ingresos_mensuales numeric,
+    documentos_necesarios text
+);
+CREATE TABLE agente_marketing (
+    id serial PRIMARY KEY,
+    producto text,
+    objetivo text,
+    presupuesto numeric,
+    rendimiento numeric,
+    plataformas_utilizadas text,
+    tipo_anuncio text,
+    estrategias_utilizadas text
+);
+CREATE TABLE agente_mercado (
+    id serial PRIMARY KEY,
+    categoria text,
+    precio numeric,
+    ubicacion_geografica text,
+    mercados_internacionales text
+);
+"""
+
+TIPOS_NEGOCIO = ["Pequeño", "Mediano", "Grande"]
+OPCIONES = ["Préstamo bancario", "Microcrédito", "Leasing", "Factoring", "Capital semilla", "Crowdfunding"]
+NIVELES = ["Bajo", "Medio", "Alto"]
+DOCUMENTOS = ["DNI", "RUC", "Estados financieros", "Declaración de impuestos", "Plan de negocio", "Extractos bancarios"]
+PRODUCTOS = ["Ropa", "Calzado", "Cosméticos", "Electrónica", "Alimentos", "Software"]
+OBJETIVOS = ["Aumentar ventas", "Reconocimiento de marca", "Captar clientes", "Fidelización"]
+PLATAFORMAS = ["Facebook", "Instagram", "TikTok", "Google Ads", "LinkedIn", "YouTube"]
+TIPOS_ANUNCIO = ["Video", "Imagen", "Carrusel", "Historia", "Búsqueda"]
+ESTRATEGIAS = ["Influencers", "Descuentos", "Remarketing", "Contenido orgánico", "Sorteos", "Email marketing"]
+CATEGORIAS = ["Ropa", "Calzado", "Cosméticos", "Electrónica", "Alimentos", "Hogar", "Juguetes", "Deportes"]
+UBICACIONES = ["Lima", "Arequipa", "Trujillo", "Cusco", "Piura", "Chiclayo"]
+MERCADOS = ["Chile", "Colombia", "México", "España", "Estados Unidos", "Ecuador", "Bolivia"]
+
+def pick(rng, values, k):
+    return ", ".join(rng.sample(values, k))
+
+def financial_rows(rng, rows):
+    for _ in range(rows):
+        yield (
+            rng.choice(TIPOS_NEGOCIO),
+            pick(rng, OPCIONES, rng.randint(1, 3)),
+            rng.choice(NIVELES),
+            round(rng.uniform(800, 50_000), 2),
+            pick(rng, DOCUMENTOS, rng.randint(2, 4)),
+        )
+
+def marketing_rows(rng, rows):
+    for _ in range(rows):
+        yield (
+            rng.choice(PRODUCTOS),
+            rng.choice(OBJETIVOS),
+            round(rng.uniform(100, 20_000), 2),
+            round(rng.uniform(0, 10), 2),
+            pick(rng, PLATAFORMAS, rng.randint(1, 3)),
+            rng.choice(TIPOS_ANUNCIO),
+            pick(rng, ESTRATEGIAS, rng.randint(1, 3)),
+        )
+
+def market_rows(rng, rows):
+    for _ in range(rows):
+        yield (
+            rng.choice(CATEGORIAS),
+            round(rng.uniform(5, 2_000), 2),
+            rng.choice(UBICACIONES),
+            pick(rng, MERCADOS, rng.randint(1, 3)),
+        )
+
+# Sentencias de un archivo de migración; CREATE INDEX CONCURRENTLY no admite ir en un bloque
+def migration_statements(name):
+    text = (Path(__file__).resolve().parent.parent / "migrations" / name).read_text(encoding="utf-8")
+    lines = [line for line in text.splitlines() if not line.lstrip().startswith("--")]
+    return [statement.strip() for statement in "\n".join(lines).split(";") if statement.strip()]
+
+def seed_database(conn, rows=DEFAULT_ROWS, seed=DEFAULT_SEED):
+    rng = random.Random(seed)
+    with conn.cursor() as cursor:
+        cursor.execute(SCHEMA)
+        execute_values(cursor, """
+            INSERT INTO agente_financiero (tipo_negocio, opciones_financiamiento, nivel_endeudamiento,
+                                           ingresos_mensuales, documentos_necesarios) VALUES %s
+        """, financial_rows(rng, rows), page_size=1000)
+        execute_values(cursor, """
+            INSERT INTO agente_marketing (producto, objetivo, presupuesto, rendimiento,
+                                          plataformas_utilizadas, tipo_anuncio, estrategias_utilizadas) VALUES %s
+        """, marketing_rows(rng, rows), page_size=1000)
+        execute_values(cursor, """
+            INSERT INTO agente_mercado (categoria, precio, ubicacion_geografica, mercados_internacionales) VALUES %s
+        """, market_rows(rng, rows), page_size=1000)
+        for name in MIGRATIONS:
+            for statement in migration_statements(name):
+                cursor.execute(statement)
+
+def admin_connection():
+    conn = psycopg2.connect(**connection_params())
+    conn.autocommit = True
+    return conn
+
+# Crear la base, sembrarla y borrarla al salir (salvo keep=True); devuelve su nombre
+@contextlib.contextmanager
+def synthetic_database(rows=DEFAULT_ROWS, seed=DEFAULT_SEED, name=BENCH_DATABASE, keep=False):
+    admin = admin_connection()
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(name)))
+            cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+        conn = psycopg2.connect(**{**connection_params(), "dbname": name})
+        conn.autocommit = True
+        try:
+            seed_database(conn, rows, seed)
+        finally:
+            conn.close()
+        yield name
+    finally:
+        if not keep:
+            with admin.cursor() as cursor:
+                # WITH (FORCE) cierra las conexiones que el servicio dejó abiertas en el pool (PostgreSQL 13+)
+                cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(name)))
+        admin.close()
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    with synthetic_database(rows, keep=True) as name:
+        print(json.dumps({"base": name, "filas_por_tabla": rows, "semilla": DEFAULT_SEED}, ensure_ascii=False))
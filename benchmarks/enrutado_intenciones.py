@@ -0,0 +1,74 @@
+# benchmarks/enrutado_intenciones.py
+# Coste por petición del enrutado de intenciones: cadenas if/elif anteriores frente al registro.
+# Cada petición se enruta una vez (consulta, plantilla y nivel de modelo reciben la intención);
+# solo_plegado y solo_reglas separan el coste de plegar tildes del de comprobar las reglas.
+# Uso: python -m benchmarks.enrutado_intenciones
+
+import json
+import time
+from backend_intents import fold_text, get_intent_registry, match_intent
+
+ITERATIONS = 20_000
+# Se informa la mejor de varias repeticiones: el ruido de la máquina sólo suma tiempo
+REPEATS = 5
+
+QUESTIONS = [
+    ("financiero", "¿Qué opciones de financiamiento hay para un negocio pequeño?"),
+    ("financiero", "¿Califico para un préstamo con mis ingresos actuales?"),
+    ("financiero", "¿Qué DOCUMENTOS necesito para pedir un prestamo?"),
+    ("financiero", "¿Cómo mejoro el flujo de caja de mi empresa durante la temporada baja?"),
+    ("marketing", "Quiero crear una campaña de marketing para mi nuevo producto"),
+    ("mercado", "¿Cuál es el precio promedio de un producto similar al mío?"),
+    ("mercado", "¿Qué tan competitivo es el mercado en mi zona?"),
+    ("mercado", "¿Qué mercados internacionales podrían estar interesados en mi producto?"),
+]
+
+# Cadenas if/elif como estaban en los agentes (sin plegar tildes)
+def legacy_route(agent, question):
+    if agent == "financiero":
+        if "financiamiento" in question.lower() and "negocio pequeño" in question.lower():
+            return "opciones_pequeno"
+        elif "califico para un préstamo" in question.lower():
+            return "califico_prestamo"
+        elif "documentos necesito" in question.lower() and "préstamo" in question.lower():
+            return "documentos"
+    elif agent == "marketing":
+        if "crear" in question.lower() and "campaña de marketing" in question.lower():
+            return "crear_campana"
+    elif agent == "mercado":
+        if "precio promedio" in question.lower() and "producto similar" in question.lower():
+            return "precio_promedio"
+        elif "competitivo" in question.lower() and "mi zona" in question.lower():
+            return "competidores"
+        elif "mercados internacionales" in question.lower() and "interesados" in question.lower():
+            return "mercados_internacionales"
+    return None
+
+def measure(name, route, questions=QUESTIONS):
+    elapsed = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            for agent, question in questions:
+                route(agent, question)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    calls = ITERATIONS * len(QUESTIONS)
+    return {"enrutador": name, "llamadas": calls, "us_por_peticion": round(elapsed / calls * 1e6, 2)}
+
+if __name__ == "__main__":
+    registry = get_intent_registry()
+    folded = [(agent, fold_text(question)) for agent, question in QUESTIONS]
+    print(json.dumps({"reglas": len(registry.rules())}))
+    for name, route in [
+        ("if_elif", legacy_route),
+        ("registro", match_intent),
+        ("solo_plegado", lambda agent, question: fold_text(question)),
+        ("solo_reglas", lambda agent, folded: registry.match_folded(agent, folded)),
+    ]:
+        questions = folded if name == "solo_reglas" else QUESTIONS
+        print(json.dumps(measure(name, route, questions), ensure_ascii=False))
+    # Diferencias de cobertura: variantes con mayúsculas o sin tildes que la versión anterior no reconocía
+    for agent, question in QUESTIONS:
+        legacy, routed = legacy_route(agent, question), match_intent(agent, question)
+        if legacy != routed:
+            print(json.dumps({"pregunta": question, "if_elif": legacy, "registro": routed}, ensure_ascii=False))
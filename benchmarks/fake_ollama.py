@@ -0,0 +1,196 @@
+# benchmarks/fake_ollama.py
+# Servidor HTTP que imita la API de Ollama (/api/generate, /api/embed) para medir el servicio sin un modelo real.
+# Uso independiente: python -m benchmarks.fake_ollama --puerto 11434 --ttft 0.2 --tokens-por-segundo 30 --fallos 0.01
+#                   --velocidades llama3.2:1b=0.3
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Texto que se devuelve token a token (4 párrafos para ejercitar el límite de 3)
+DEFAULT_TEXT = (
+    "Primer párrafo de la respuesta simulada con varios tokens de ejemplo.\n\n"
+    "Segundo párrafo con más detalle sobre la pregunta del usuario.\n\n"
+    "Tercer párrafo con recomendaciones prácticas para el negocio.\n\n"
+    "Cuarto párrafo que el servicio debería descartar."
+)
+
+def tokenize(text):
+    # Separar en "tokens" conservando espacios y saltos de línea
+    tokens = []
+    current = ''
+    for ch in text:
+        current += ch
+        if ch in (' ', '\n'):
+            tokens.append(current)
+            current = ''
+    if current:
+        tokens.append(current)
+    return tokens
+
+# Ids de token estables para construir el 'context' que Ollama devuelve al terminar
+def token_ids(tokens):
+    return [hash(token) & 0x7FFFFFFF for token in tokens]
+
+# Embedding determinista (bolsa de palabras con hashing) para la caché semántica
+def fake_embedding(text, dim=64):
+    vector = [0.0] * dim
+    for word in text.lower().split():
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest, "little") % dim] += 1.0
+    return vector
+
+# prompt_eval_delay: segundos por token de prompt evaluado; los tokens que llegan en 'context'
+# ya están evaluados (caché KV) y no cuentan, como en Ollama
+# failure_rate: fracción de generaciones que fallan (error_status) o, con stream, se cortan a mitad
+# parallel: generaciones simultáneas, como OLLAMA_NUM_PARALLEL (el resto espera); 0 = sin límite
+# model_speeds: {modelo: factor} que multiplica ttft y token_delay (0.3 = modelo más rápido, p. ej. uno de 1B)
+def create_app(ttft=0.05, token_delay=0.01, text=DEFAULT_TEXT, prompt_eval_delay=0.0,
+               failure_rate=0.0, error_status=500, seed=0, parallel=0, model_speeds=None):
+    app = FastAPI(title="Fake Ollama")
+    tokens = tokenize(text)
+    rng = random.Random(seed)
+    slots = asyncio.Semaphore(parallel) if parallel > 0 else None
+    speeds = dict(model_speeds or {})
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": []}
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        inputs = body.get("input", "")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        return {"model": body.get("model", ""), "embeddings": [fake_embedding(text) for text in inputs]}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        # Fallo inyectado: la mitad antes de responder y la otra mitad a mitad del stream
+        fail = failure_rate > 0 and rng.random() < failure_rate
+        fail_midway = fail and rng.random() < 0.5
+        model = body.get("model", "")
+        factor = speeds.get(model, 1.0)
+        model_ttft = ttft * factor
+        model_token_delay = token_delay * factor
+        if fail and not fail_midway:
+            await asyncio.sleep(model_ttft)
+            return JSONResponse(status_code=error_status, content={"error": "fallo simulado"})
+        stream = body.get("stream", True)
+        options = body.get("options") or {}
+        # Respetar num_predict como lo haría Ollama
+        reply = tokens[:options["num_predict"]] if options.get("num_predict") else tokens
+        previous = body.get("context") or []
+        prompt_tokens = tokenize(body.get("prompt", ""))
+        prompt_eval_s = prompt_eval_delay * factor * len(prompt_tokens)
+        context = previous + token_ids(prompt_tokens) + token_ids(reply)
+
+        async def produce():
+            if slots is not None:
+                await slots.acquire()
+            try:
+                async for line in generate_lines():
+                    yield line
+            finally:
+                if slots is not None:
+                    slots.release()
+
+        async def generate_lines():
+            await asyncio.sleep(model_ttft + prompt_eval_s)
+            for i, token in enumerate(reply):
+                if fail_midway and i == len(reply) // 2:
+                    yield json.dumps({"error": "fallo simulado a mitad de la generación"}) + "\n"
+                    return
+                yield json.dumps({"model": model, "response": token, "done": False}) + "\n"
+                await asyncio.sleep(model_token_delay)
+            yield json.dumps({
+                "model": model,
+                "response": "",
+                "done": True,
+                "done_reason": "stop",
+                "context": context,
+                "prompt_eval_count": len(prompt_tokens),
+                "prompt_eval_duration": int((model_ttft + prompt_eval_s) * 1e9),
+                "eval_count": len(reply),
+            }) + "\n"
+
+        if stream:
+            return StreamingResponse(produce(), media_type="application/x-ndjson")
+
+        if fail_midway:
+            await asyncio.sleep(model_ttft)
+            return JSONResponse(status_code=error_status, content={"error": "fallo simulado"})
+        await asyncio.sleep(model_ttft + prompt_eval_s + model_token_delay * len(reply))
+        return {
+            "model": model,
+            "response": "".join(reply),
+            "done": True,
+            "done_reason": "stop",
+            "context": context,
+            "prompt_eval_count": len(prompt_tokens),
+            "prompt_eval_duration": int((model_ttft + prompt_eval_s) * 1e9),
+            "eval_count": len(reply),
+        }
+
+    return app
+
+# "modelo=factor,modelo=factor" de la línea de comandos
+def parse_speeds(value):
+    speeds = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            model, factor = item.rsplit("=", 1)
+            speeds[model.strip()] = float(factor)
+    return speeds
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# Levanta una app ASGI con uvicorn en un hilo; usar como context manager
+class ServerThread:
+    def __init__(self, app, port=None):
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.should_exit = True
+        self._thread.join()
+
+# Servidor falso de Ollama en un hilo
+class FakeOllamaServer(ServerThread):
+    def __init__(self, port=None, **app_kwargs):
+        super().__init__(create_app(**app_kwargs), port)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ollama simulado para pruebas de carga")
+    parser.add_argument("--puerto", type=int, default=11434)
+    parser.add_argument("--ttft", type=float, default=0.2, help="segundos hasta el primer token")
+    parser.add_argument("--tokens-por-segundo", type=float, default=30.0)
+    parser.add_argument("--fallos", type=float, default=0.0, help="fracción de generaciones que fallan")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--paralelo", type=int, default=0, help="generaciones simultáneas (0 = sin límite)")
+    parser.add_argument("--velocidades", help="factor de tiempo por modelo: llama3.2:1b=0.3,llama3.2:3b=1")
+    args = parser.parse_args()
+    app = create_app(ttft=args.ttft, token_delay=1 / args.tokens_por_segundo, failure_rate=args.fallos, seed=args.semilla,
+                     parallel=args.paralelo, model_speeds=parse_speeds(args.velocidades))
+    uvicorn.run(app, host="127.0.0.1", port=args.puerto, log_level="warning")
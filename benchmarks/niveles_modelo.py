@@ -0,0 +1,179 @@
+# benchmarks/niveles_modelo.py
+# Niveles de modelo (backend_tiers): la misma mezcla de preguntas con todo en el modelo grande y con
+# niveles activados. El Ollama simulado atiende el modelo pequeño --factor-pequeno veces más rápido y
+# --paralelo generaciones a la vez, así que con --concurrencia alta se forma cola y entra la degradación por carga.
+# Informa rendimiento, p50/p95 por tipo de pregunta y las elecciones de nivel (GET /metricas/modelos).
+# Uso: python -m benchmarks.niveles_modelo --concurrencia 4,32 --peticiones 300 --factor-pequeno 0.3
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from benchmarks.fake_ollama import FakeOllamaServer, ServerThread, free_port
+
+parser = argparse.ArgumentParser(description="Rendimiento con niveles de modelo pequeño/grande")
+parser.add_argument("--concurrencia", default="4,32", help="niveles de concurrencia separados por comas")
+parser.add_argument("--peticiones", type=int, default=300, help="peticiones por prueba")
+parser.add_argument("--paralelo", type=int, default=4, help="generaciones simultáneas del Ollama simulado")
+parser.add_argument("--factor-pequeno", type=float, default=0.3, help="tiempo del modelo pequeño relativo al grande")
+parser.add_argument("--cola-degradar", type=int, default=8, help="TIER_COLA_DEGRADAR del servicio")
+parser.add_argument("--filas", type=int, default=10_000, help="filas sintéticas por tabla")
+parser.add_argument("--ttft", type=float, default=0.1, help="segundos hasta el primer token del modelo grande")
+parser.add_argument("--tokens-por-segundo", type=float, default=60.0, help="velocidad del modelo grande")
+parser.add_argument("--semilla", type=int, default=42)
+parser.add_argument("--salida", help="archivo JSON con los resultados")
+ARGS = parser.parse_args()
+
+LARGE_MODEL = "llama3.2:3b"
+SMALL_MODEL = "llama3.2:1b"
+OLLAMA_PORT = free_port()
+API_PORT = free_port()
+# El servicio lee su configuración del entorno al importarse: fijarla antes de importar main
+os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{OLLAMA_PORT}"
+os.environ.setdefault("BENCH_DATABASE", "agentes_bench")
+os.environ["DATABASE"] = os.environ["BENCH_DATABASE"]
+os.environ["RATE_LIMIT_RPS"] = "0"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "0"
+os.environ["OLLAMA_MODEL"] = LARGE_MODEL
+os.environ["MODEL_PEQUENO"] = SMALL_MODEL
+os.environ["MODEL_TIERING"] = "1"
+os.environ["TIER_COLA_DEGRADAR"] = str(ARGS.cola_degradar)
+os.environ["LLM_MAX_CONCURRENCY"] = str(ARGS.paralelo)
+# Cola amplia: medir la espera, no los rechazos
+os.environ["LLM_QUEUE_MAX"] = "10000"
+os.environ["LLM_QUEUE_TIMEOUT"] = "300"
+
+import httpx  # noqa: E402
+from benchmarks.datos_sinteticos import CATEGORIAS, UBICACIONES, synthetic_database  # noqa: E402
+
+# Preguntas con datos de la BD o cortas (nivel pequeño) y preguntas abiertas (nivel grande)
+SHORT_QUESTIONS = [
+    ("financiero", {"user_input": "¿Qué documentos necesito para un préstamo?"}),
+    ("mercado", {"user_input": "¿Cuál es el precio promedio de un producto similar?", "categoria": None}),
+    ("mercado", {"user_input": "¿Qué tan competitivo es el mercado en mi zona?", "ubicacion": None}),
+]
+OPEN_QUESTIONS = [
+    ("financiero", {"user_input": "Tengo una panadería familiar con ventas estables pero márgenes bajos y quiero "
+                                  "abrir un segundo local el próximo año, ¿cómo debería planificar la financiación y el flujo de caja?"}),
+    ("mercado", {"user_input": "Estoy pensando en lanzar una línea de productos ecológicos para el hogar y no sé cómo "
+                               "evaluar si hay demanda suficiente ni qué canales de venta priorizar al principio, ¿qué me recomiendas?"}),
+]
+
+def build_requests(count, rng):
+    requests = []
+    for _ in range(count):
+        kind = "corta" if rng.random() < 0.6 else "abierta"
+        agent, payload = rng.choice(SHORT_QUESTIONS if kind == "corta" else OPEN_QUESTIONS)
+        payload = dict(payload)
+        if "categoria" in payload:
+            payload["categoria"] = rng.choice(CATEGORIAS)
+        if "ubicacion" in payload:
+            payload["ubicacion"] = rng.choice(UBICACIONES)
+        requests.append((kind, agent, payload))
+    return requests
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return round(sorted_values[index] * 1000, 1)
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {"peticiones": len(latencies), "p50_ms": percentile(latencies, 0.50), "p95_ms": percentile(latencies, 0.95)}
+
+async def run_level(client, requests, concurrency):
+    latencies = {"corta": [], "abierta": []}
+    errors = 0
+    pending = iter(requests)
+
+    async def worker():
+        nonlocal errors
+        for kind, agent, payload in pending:
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"/agente_{agent}/", json=payload)
+                errors += response.status_code != 200
+            except httpx.HTTPError:
+                errors += 1
+            latencies[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "segundos": round(elapsed, 3),
+        "peticiones_por_segundo": round(len(requests) / elapsed, 2),
+        "tasa_error": round(errors / len(requests), 4),
+        "preguntas_cortas": summarize(latencies["corta"]),
+        "preguntas_abiertas": summarize(latencies["abierta"]),
+    }
+
+async def wait_ready(client, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("El servicio no quedó listo a tiempo (ver GET /ready)")
+
+# Elecciones por nivel y motivo hechas durante una prueba (diferencia de /metricas/modelos)
+def choices_delta(before, after):
+    delta = {}
+    for agent, counts in after["elecciones"].items():
+        previous = before["elecciones"].get(agent, {})
+        changed = {key: value - previous.get(key, 0) for key, value in counts.items() if value - previous.get(key, 0)}
+        if changed:
+            delta[agent] = changed
+    return delta
+
+async def run_all(base_url):
+    from backend_tiers import get_tier_router
+
+    levels = [int(level) for level in ARGS.concurrencia.split(",")]
+    requests = build_requests(ARGS.peticiones, random.Random(ARGS.semilla))
+    router = get_tier_router()
+    results = []
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=limits) as client:
+        await wait_ready(client)
+        for concurrency in levels:
+            for enabled in (False, True):
+                # Mismo proceso, mismo servicio: sólo cambia si el enrutador elige nivel
+                router.enabled = enabled
+                before = (await client.get("/metricas/modelos")).json()
+                result = await run_level(client, requests, concurrency)
+                after = (await client.get("/metricas/modelos")).json()
+                result = {"niveles": enabled, "concurrencia": concurrency, **result,
+                          "elecciones": choices_delta(before, after)}
+                results.append(result)
+                print(json.dumps(result, ensure_ascii=False))
+        results.append({"latencia_por_modelo": (await client.get("/metricas/modelos")).json()["latencia_por_modelo"]})
+    return results
+
+def main():
+    print(f"[INFO] Creando la base sintética {os.environ['DATABASE']} ({ARGS.filas} filas por tabla)...", file=sys.stderr)
+    with synthetic_database(ARGS.filas, ARGS.semilla, os.environ["DATABASE"]):
+        with FakeOllamaServer(port=OLLAMA_PORT, ttft=ARGS.ttft, token_delay=1 / ARGS.tokens_por_segundo,
+                              seed=ARGS.semilla, parallel=ARGS.paralelo, model_speeds={SMALL_MODEL: ARGS.factor_pequeno}):
+            import main as service
+            with ServerThread(service.app, API_PORT) as api:
+                results = asyncio.run(run_all(api.url))
+    print(json.dumps(results[-1], ensure_ascii=False))
+    if ARGS.salida:
+        report = {"configuracion": {key: value for key, value in vars(ARGS).items() if key != "salida"}, "resultados": results}
+        with open(ARGS.salida, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# benchmarks/plantillas.py
+# Respuestas con plantilla (backend_templates) frente al modelo para las intenciones que la BD ya responde
+# (documentos para un préstamo, precio promedio por categoría, competidores por zona).
+# Lanza la misma mezcla de preguntas con modo "modelo" y modo "plantilla" contra el servicio en local
+# (Ollama simulado y base sintética, como benchmarks/carga_api.py) y compara latencia y rendimiento;
+# las preguntas sin plantilla siguen pasando por el modelo en ambos modos.
+# Uso: python -m benchmarks.plantillas --concurrencia 16 --peticiones 500 --fraccion-plantilla 0.7
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from benchmarks.fake_ollama import FakeOllamaServer, ServerThread, free_port
+
+parser = argparse.ArgumentParser(description="Latencia y rendimiento de las respuestas con plantilla")
+parser.add_argument("--concurrencia", type=int, default=16)
+parser.add_argument("--peticiones", type=int, default=500, help="peticiones por modo")
+parser.add_argument("--fraccion-plantilla", type=float, default=0.7, help="fracción de preguntas con plantilla en la mezcla")
+parser.add_argument("--filas", type=int, default=10_000, help="filas sintéticas por tabla")
+parser.add_argument("--ttft", type=float, default=0.05, help="segundos hasta el primer token del Ollama simulado")
+parser.add_argument("--tokens-por-segundo", type=float, default=100.0)
+parser.add_argument("--semilla", type=int, default=42)
+parser.add_argument("--salida", help="archivo JSON con los resultados")
+ARGS = parser.parse_args()
+
+OLLAMA_PORT = free_port()
+API_PORT = free_port()
+# El servicio lee su configuración del entorno al importarse: fijarla antes de importar main
+os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{OLLAMA_PORT}"
+os.environ.setdefault("BENCH_DATABASE", "agentes_bench")
+os.environ["DATABASE"] = os.environ["BENCH_DATABASE"]
+os.environ["RATE_LIMIT_RPS"] = "0"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Sin cachés: cada respuesta del modo "modelo" es una generación real del Ollama simulado
+os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "0"
+# El modo lo decide cada petición
+os.environ["TEMPLATE_INTENTS"] = ""
+
+import httpx  # noqa: E402
+from benchmarks.datos_sinteticos import CATEGORIAS, UBICACIONES, synthetic_database  # noqa: E402
+
+# (agente, pregunta, parámetro) de las intenciones con plantilla y de las que necesitan al modelo
+TEMPLATE_QUESTIONS = [
+    ("financiero", "¿Qué documentos necesito para un préstamo?", None),
+    ("mercado", "¿Cuál es el precio promedio de un producto similar?", "categoria"),
+    ("mercado", "¿Qué tan competitivo es el mercado en mi zona?", "ubicacion"),
+]
+MODEL_QUESTIONS = [
+    ("financiero", "¿Cómo organizo el flujo de caja de mi empresa?", None),
+    ("mercado", "¿Qué mercados internacionales podrían estar interesados en mi producto?", None),
+]
+
+# Misma semilla = misma mezcla en los dos modos
+def build_requests(count, rng):
+    requests = []
+    for _ in range(count):
+        templated = rng.random() < ARGS.fraccion_plantilla
+        agent, question, param = rng.choice(TEMPLATE_QUESTIONS if templated else MODEL_QUESTIONS)
+        payload = {"user_input": question}
+        if param == "categoria":
+            payload["categoria"] = rng.choice(CATEGORIAS)
+        elif param == "ubicacion":
+            payload["ubicacion"] = rng.choice(UBICACIONES)
+        requests.append(("plantilla" if templated else "modelo", agent, payload))
+    return requests
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return round(sorted_values[index] * 1000, 1)
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        "peticiones": len(latencies),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+    }
+
+async def run_mode(client, mode, requests):
+    latencies = {"plantilla": [], "modelo": []}
+    errors = 0
+    pending = iter(requests)
+
+    async def worker():
+        nonlocal errors
+        for kind, agent, payload in pending:
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"/agente_{agent}/", json={**payload, "modo": mode})
+                errors += response.status_code != 200
+            except httpx.HTTPError:
+                errors += 1
+            latencies[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(ARGS.concurrencia)))
+    elapsed = time.perf_counter() - start
+    return {
+        "modo": mode,
+        "segundos": round(elapsed, 3),
+        "peticiones_por_segundo": round(len(requests) / elapsed, 2),
+        "tasa_error": round(errors / len(requests), 4),
+        "total": summarize(latencies["plantilla"] + latencies["modelo"]),
+        "preguntas_con_plantilla": summarize(latencies["plantilla"]),
+        "preguntas_sin_plantilla": summarize(latencies["modelo"]),
+    }
+
+async def wait_ready(client, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("El servicio no quedó listo a tiempo (ver GET /ready)")
+
+async def run_all(base_url):
+    requests = build_requests(ARGS.peticiones, random.Random(ARGS.semilla))
+    limits = httpx.Limits(max_connections=ARGS.concurrencia, max_keepalive_connections=ARGS.concurrencia)
+    results = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        await wait_ready(client)
+        for mode in ("modelo", "plantilla"):
+            result = await run_mode(client, mode, requests)
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False))
+    return results
+
+def main():
+    print(f"[INFO] Creando la base sintética {os.environ['DATABASE']} ({ARGS.filas} filas por tabla)...", file=sys.stderr)
+    with synthetic_database(ARGS.filas, ARGS.semilla, os.environ["DATABASE"]):
+        with FakeOllamaServer(port=OLLAMA_PORT, ttft=ARGS.ttft, token_delay=1 / ARGS.tokens_por_segundo, seed=ARGS.semilla):
+            import main as service
+            with ServerThread(service.app, API_PORT) as api:
+                results = asyncio.run(run_all(api.url))
+    modelo, plantilla = results
+    report = {
+        "configuracion": {key: value for key, value in vars(ARGS).items() if key != "salida"},
+        "resultados": results,
+        "aceleracion_rendimiento": round(plantilla["peticiones_por_segundo"] / modelo["peticiones_por_segundo"], 2),
+    }
+    print(json.dumps({"aceleracion_rendimiento": report["aceleracion_rendimiento"]}))
+    if ARGS.salida:
+        with open(ARGS.salida, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/pool_ollama.py
+# Reparto de generaciones entre varios Ollama simulados (backend_hosts.HostPool).
+# Cada servidor atiende --paralelo generaciones a la vez, como OLLAMA_NUM_PARALLEL: con carga fija,
+# el rendimiento debería crecer casi linealmente con el número de servidores.
+# Después repite la prueba con un servidor caído y otro que falla siempre para medir el failover.
+# Uso: python -m benchmarks.pool_ollama --hosts 1,2,4 --paralelo 4 --peticiones 200
+
+import argparse
+import asyncio
+import contextlib
+import json
+import time
+from benchmarks.fake_ollama import FakeOllamaServer, free_port
+from backend_hosts import HostPool
+
+MODEL_NAME = "llama3.2:3b"
+PROMPT = "¿Qué documentos necesito para un préstamo?"
+
+parser = argparse.ArgumentParser(description="Rendimiento del pool de servidores de Ollama")
+parser.add_argument("--hosts", default="1,2,4", help="número de servidores en cada prueba, separados por comas")
+parser.add_argument("--paralelo", type=int, default=4, help="generaciones simultáneas por servidor")
+parser.add_argument("--peticiones", type=int, default=200)
+parser.add_argument("--ttft", type=float, default=0.05)
+parser.add_argument("--tokens-por-segundo", type=float, default=100.0)
+parser.add_argument("--reparto", default="pendientes", choices=["pendientes", "ewma"])
+
+async def run_load(pool, requests, concurrency):
+    pending = iter(range(requests))
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for _ in pending:
+            try:
+                async with pool.stream(model=MODEL_NAME, prompt=PROMPT) as stream:
+                    async for _chunk in stream:
+                        pass
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await pool.close()
+    return {
+        "segundos": round(elapsed, 3),
+        "peticiones_por_segundo": round(requests / elapsed, 2),
+        "tasa_error": round(errors / requests, 4),
+        "reintentos": pool.retries,
+        "por_servidor": {host.url: host.counters["peticiones"] for host in pool.hosts},
+    }
+
+def main():
+    args = parser.parse_args()
+    levels = [int(level) for level in args.hosts.split(",")]
+    # Carga fija: la que satura el mayor número de servidores
+    concurrency = args.paralelo * max(levels)
+    server_options = {"ttft": args.ttft, "token_delay": 1 / args.tokens_por_segundo, "parallel": args.paralelo}
+    results = []
+
+    with contextlib.ExitStack() as stack:
+        servers = [stack.enter_context(FakeOllamaServer(**server_options)) for _ in range(max(levels))]
+        base = None
+        for hosts in levels:
+            pool = HostPool([server.url for server in servers[:hosts]], routing=args.reparto)
+            result = {"servidores": hosts, "concurrencia": concurrency,
+                      **asyncio.run(run_load(pool, args.peticiones, concurrency))}
+            base = base or result["peticiones_por_segundo"] / hosts
+            result["escalado"] = round(result["peticiones_por_segundo"] / (base * hosts), 2)
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False))
+
+        # Failover: un puerto sin servidor y un servidor que siempre responde 500 antes del primer token
+        failing = stack.enter_context(FakeOllamaServer(failure_rate=1.0, seed=1, **server_options))
+        dead_url = f"http://127.0.0.1:{free_port()}"
+        urls = [server.url for server in servers[:2]] + [failing.url, dead_url]
+        pool = HostPool(urls, routing=args.reparto)
+        result = {"prueba": "failover", "servidores": len(urls), "concurrencia": concurrency,
+                  **asyncio.run(run_load(pool, args.peticiones, concurrency)),
+                  "sanos_al_final": [host.url for host in pool.healthy_hosts()]}
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# benchmarks/presupuesto_contexto.py
+# Tamaño del prompt del agente de mercado cuando la lista de mercados internacionales crece,
+# con y sin el presupuesto de contexto (backend_context). No necesita base de datos ni Ollama.
+# Uso: python -m benchmarks.presupuesto_contexto
+
+import json
+import time
+from backend_context import ContextBudgeter, estimate_tokens
+from backend_mercado import build_market_prompt
+
+QUESTION = "¿Qué mercados internacionales podrían estar interesados en mi producto?"
+LIST_SIZES = [5, 20, 100, 500, 2000]
+REPEAT = 1000
+
+def market_names(count):
+    return [f"Mercado internacional {i:04d}" for i in range(count)]
+
+def main():
+    results = []
+    for size in LIST_SIZES:
+        names = market_names(size)
+        unbounded = ContextBudgeter(enabled=False).fit("mercado", "Mercados internacionales potenciales: ", names, suffix=".")
+        budgeter = ContextBudgeter()
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            bounded = budgeter.fit("mercado", "Mercados internacionales potenciales: ", names, suffix=".")
+        fit_us = (time.perf_counter() - start) / REPEAT * 1e6
+        result = {
+            "elementos": size,
+            "tokens_prompt_sin_presupuesto": estimate_tokens(build_market_prompt(QUESTION, unbounded)),
+            "tokens_prompt_con_presupuesto": estimate_tokens(build_market_prompt(QUESTION, bounded)),
+            "recorte_us": round(fit_us, 1),
+        }
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+    return results
+
+if __name__ == "__main__":
+    main()
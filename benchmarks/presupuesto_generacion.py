@@ -0,0 +1,59 @@
+# benchmarks/presupuesto_generacion.py
+# Compara la latencia media con y sin presupuesto de generación (corte al cuarto párrafo).
+# Uso: python -m benchmarks.presupuesto_generacion
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import time
+from benchmarks.fake_ollama import FakeOllamaServer, free_port
+
+PORT = free_port()
+os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{PORT}"
+# Medir siempre contra el modelo: sin cachés de respuestas
+os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "0"
+
+import backend_budget  # noqa: E402
+import backend_ollama  # noqa: E402
+
+MODEL_NAME = "llama3.2:3b"
+PROMPT = "¿Qué documentos necesito para un préstamo?"
+REQUESTS = 20
+
+# Respuesta larga: el modelo sigue escribiendo varios párrafos después del tercero
+LONG_TEXT = "\n\n".join(
+    f"Párrafo {i} de la respuesta simulada con bastante contenido para que el modelo tarde en producirlo."
+    for i in range(1, 8)
+)
+
+async def run_mode(enabled):
+    backend_budget.GENERATION_BUDGET_ENABLED = enabled
+    backend_budget.reset_generation_stats()
+    latencies = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        await backend_ollama.generate_response_async(PROMPT, MODEL_NAME, "financiero")
+        latencies.append(time.perf_counter() - start)
+    stats = backend_budget.get_generation_stats()["financiero"]
+    return {
+        "presupuesto": enabled,
+        "peticiones": REQUESTS,
+        "latencia_media_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+        "tokens_generados_por_peticion": round(stats["tokens_generados"] / REQUESTS, 1),
+        "tokens_descartados_por_peticion": round(stats["tokens_descartados"] / REQUESTS, 1),
+        "cortes_anticipados": stats["cortes_anticipados"],
+    }
+
+async def main():
+    for enabled in (False, True):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = await run_mode(enabled)
+        print(json.dumps(result, ensure_ascii=False))
+    await backend_ollama.close_async_client()
+
+if __name__ == "__main__":
+    with FakeOllamaServer(port=PORT, ttft=0.05, token_delay=0.005, text=LONG_TEXT):
+        asyncio.run(main())
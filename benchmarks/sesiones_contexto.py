@@ -0,0 +1,74 @@
+# benchmarks/sesiones_contexto.py
+# Compara el coste de evaluar el prompt turno a turno en una sesión: reenviando el 'context'
+# de Ollama frente a reenviar la transcripción completa.
+# Uso: python -m benchmarks.sesiones_contexto            (Ollama simulado)
+#      OLLAMA_HOST=http://host:11434 python -m benchmarks.sesiones_contexto --real
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+from benchmarks.fake_ollama import FakeOllamaServer, free_port
+
+REAL = "--real" in sys.argv
+PORT = free_port()
+if not REAL:
+    # El cliente de ollama lee OLLAMA_HOST al crearse
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{PORT}"
+# Medir siempre contra el modelo: sin cachés de respuestas
+os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "0"
+
+import backend_ollama  # noqa: E402
+import backend_sessions  # noqa: E402
+from backend_financiero import ANSWER_LABEL, build_financial_prompt  # noqa: E402
+
+MODEL_NAME = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
+QUESTIONS = [
+    "¿Qué documentos necesito para un préstamo?",
+    "¿Y si mi negocio tiene menos de un año?",
+    "¿Cuánto tarda normalmente la aprobación?",
+    "¿Qué pasa si ya tengo otra deuda?",
+    "¿Me conviene un aval o una garantía?",
+    "Resume los pasos que debo seguir.",
+]
+DATA = "Documentos necesarios: DNI, RUC, estados financieros de los últimos 6 meses, declaración de impuestos"
+
+async def run_session(reuse):
+    backend_sessions.SESSION_CONTEXT_REUSE = reuse
+    session = backend_sessions.get_session_store().create("financiero")
+    turns = []
+    for question in QUESTIONS:
+        prompt = backend_sessions.session_prompt(session, build_financial_prompt(question, DATA), question, DATA, ANSWER_LABEL)
+        final = None
+        async for event in backend_ollama.stream_response_async(prompt, MODEL_NAME, "financiero", question=question, session=session):
+            if event["tipo"] == "fin":
+                final = event
+        turns.append({
+            "turno": session.turns,
+            "prompt_tokens": final["tokens"]["prompt"],
+            "prompt_eval_ms": final["tokens"]["prompt_eval_ms"],
+            "generacion_ms": final["tiempos"]["generacion_ms"],
+        })
+    return {
+        "modo": "contexto" if reuse else "transcripcion",
+        "turnos": turns,
+        "prompt_tokens_ultimo_turno": turns[-1]["prompt_tokens"],
+        "prompt_eval_ms_total": round(sum(t["prompt_eval_ms"] or 0 for t in turns), 1),
+    }
+
+async def main():
+    for reuse in (False, True):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = await run_session(reuse)
+        print(json.dumps(result, ensure_ascii=False))
+    await backend_ollama.close_async_client()
+
+if __name__ == "__main__":
+    if REAL:
+        asyncio.run(main())
+    else:
+        with FakeOllamaServer(port=PORT, ttft=0.02, token_delay=0.001, prompt_eval_delay=0.002):
+            asyncio.run(main())
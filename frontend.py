@@ -0,0 +1,14 @@
+# frontend.py
+# Aplicación única de Streamlit con los tres agentes como páginas; las respuestas vienen del API (main.py).
+# Uso: streamlit run frontend.py   (API_URL=http://localhost:8000 por defecto)
+
+import streamlit as st
+
+st.set_page_config(page_title="Agentes de negocio", page_icon="💼")
+
+pages = st.navigation([
+    st.Page("frontend_financiero.py", title="Agente Financiero", icon="💰", default=True),
+    st.Page("frontend_marketing.py", title="Agente de Marketing", icon="📣"),
+    st.Page("frontend_mercado.py", title="Agente de Mercado", icon="📊"),
+])
+pages.run()
@@ -0,0 +1,91 @@
+# frontend_cliente.py
+
+import json
+import os
+import uuid
+import requests
+import streamlit as st
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+# Dirección del servicio FastAPI (main.py)
+API_URL = os.getenv("API_URL", "http://localhost:8000").rstrip("/")
+# Segundos para conectar y máximos entre dos fragmentos del stream
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "300"))
+
+API_CONNECTION_ERROR = "No se pudo conectar con el servicio de agentes. Inténtalo de nuevo en unos momentos."
+
+# Una sola sesión HTTP por proceso de Streamlit: reutiliza las conexiones entre usuarios y ejecuciones
+@st.cache_resource
+def get_http_session():
+    return requests.Session()
+
+# Todas las peticiones salen de este proceso: X-Client-Id separa a cada usuario en el límite por cliente
+# (el servicio sólo la acepta si la IP de este frontend está en RATE_LIMIT_TRUSTED_PROXIES; loopback por defecto)
+def client_id():
+    if "client_id" not in st.session_state:
+        st.session_state.client_id = uuid.uuid4().hex
+    return st.session_state.client_id
+
+def post(path, payload, stream=False):
+    return get_http_session().post(
+        f"{API_URL}{path}", json=payload, stream=stream,
+        headers={"X-Client-Id": client_id()},
+        timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT),
+    )
+
+# Sesión de conversación del servicio para este usuario y agente (se crea al primer mensaje)
+def conversation_session(agent, renew=False):
+    key = f"session_id_{agent}"
+    if renew or key not in st.session_state:
+        response = post("/sesiones", {"agente": agent})
+        response.raise_for_status()
+        st.session_state[key] = response.json()["session_id"]
+    return st.session_state[key]
+
+# Eventos NDJSON de un endpoint /stream; si la sesión caducó en el servicio, se abre otra y se reintenta
+def stream_events(agent, payload):
+    payload = {**payload, "session_id": conversation_session(agent)}
+    response = post(f"/agente_{agent}/stream", payload, stream=True)
+    if response.status_code == 404:
+        response.close()
+        payload["session_id"] = conversation_session(agent, renew=True)
+        response = post(f"/agente_{agent}/stream", payload, stream=True)
+    with response:
+        if response.status_code in (429, 503):
+            yield {"tipo": "error", "detalle": response.json().get("detail", API_CONNECTION_ERROR)}
+            return
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                yield json.loads(line)
+
+# Pedir la respuesta en streaming y pintarla a medida que llegan los tokens; devuelve el texto final
+def stream_answer(agent, payload, label):
+    placeholder = st.empty()
+    text = ""
+    try:
+        for event in stream_events(agent, payload):
+            if event["tipo"] == "token":
+                text += event["texto"]
+                placeholder.markdown(f"**{label}:** {text}▌")
+            elif event["tipo"] == "fin":
+                text = event["respuesta"]
+            elif event["tipo"] == "error":
+                text = event["detalle"]
+    except (requests.RequestException, ValueError):
+        text = API_CONNECTION_ERROR
+    placeholder.empty()
+    return text
+
+# Conversación guardada en el estado de la sesión de Streamlit
+def show_conversation(conversation, label):
+    st.markdown("### Conversación:")
+    for msg in conversation:
+        if msg["role"] == "user":
+            st.markdown(f"**Tú:** {msg['content']}")
+        elif msg["role"] == "assistant":
+            st.markdown(f"**{label}:** {msg['content']}")
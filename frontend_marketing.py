@@ -1,5 +1,6 @@
 import streamlit as st
-from backend_marketing import marketing_agent
+from backend_intents import required_params
+from frontend_cliente import show_conversation, stream_answer
 
 st.title("Agente de Marketing 📣")
 st.markdown("Haz tus preguntas sobre marketing y recibe consejos expertos.")
@@ -17,25 +18,23 @@ objetivo = None
 presupuesto = None
 
 # Mostrar campos adicionales si la pregunta lo requiere
-if "crear" in user_input.lower() and "campaña de marketing" in user_input.lower():
+if "presupuesto" in required_params("marketing", user_input):
     st.markdown("### Información adicional requerida:")
     producto = st.text_input("Ingresa el nombre de tu producto:", key="producto_marketing")
     objetivo = st.text_input("Ingresa el objetivo de tu campaña:", key="objetivo_marketing")
     presupuesto = st.number_input("Ingresa tu presupuesto:", min_value=0.0, key="presupuesto_marketing")
 
+# Mostrar la conversación
+show_conversation(st.session_state.conversation_marketing, "Agente de Marketing")
+
 if st.button("Enviar", key="send_button_marketing"):
     if user_input.strip():
         # Agregar la entrada del usuario a la conversación
         st.session_state.conversation_marketing.append({"role": "user", "content": user_input})
-        # Obtener la respuesta del agente de marketing
-        assistant_reply = marketing_agent(st.session_state.conversation_marketing, producto, objetivo, presupuesto)
+        st.markdown(f"**Tú:** {user_input}")
+        # Obtener la respuesta del agente de marketing en streaming desde el API
+        payload = {"user_input": user_input, "producto": producto, "objetivo": objetivo, "presupuesto": presupuesto}
+        assistant_reply = stream_answer("marketing", payload, "Agente de Marketing")
         # Agregar la respuesta del agente a la conversación
         st.session_state.conversation_marketing.append({"role": "assistant", "content": assistant_reply})
-
-# Mostrar la conversación
-st.markdown("### Conversación:")
-for msg in st.session_state.conversation_marketing:
-    if msg['role'] == 'user':
-        st.markdown(f"**Tú:** {msg['content']}")
-    elif msg['role'] == 'assistant':
-        st.markdown(f"**Agente de Marketing:** {msg['content']}")
+        st.rerun()
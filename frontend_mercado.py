@@ -1,5 +1,6 @@
 import streamlit as st
-from backend_mercado import market_agent
+from backend_intents import required_params
+from frontend_cliente import show_conversation, stream_answer
 
 st.title("Agente de Mercado 📊")
 st.markdown("Realiza consultas sobre el mercado y obtén análisis especializados.")
@@ -16,24 +17,23 @@ categoria = None
 ubicacion = None
 
 # Mostrar campos adicionales si la pregunta lo requiere
-if "precio promedio" in user_input.lower() and "producto similar" in user_input.lower():
+campos = required_params("mercado", user_input)
+if "categoria" in campos:
     categoria = st.text_input("Ingresa la categoría de tu producto:", key="categoria_mercado")
-if "competitivo" in user_input.lower() and "mi zona" in user_input.lower():
+if "ubicacion" in campos:
     ubicacion = st.text_input("Ingresa tu ubicación geográfica:", key="ubicacion_mercado")
 
+# Mostrar la conversación
+show_conversation(st.session_state.conversation_mercado, "Agente de Mercado")
+
 if st.button("Enviar", key="send_button_mercado"):
     if user_input.strip():
         # Agregar la entrada del usuario a la conversación
         st.session_state.conversation_mercado.append({"role": "user", "content": user_input})
-        # Obtener la respuesta del agente de mercado
-        assistant_reply = market_agent(st.session_state.conversation_mercado, categoria, ubicacion)
+        st.markdown(f"**Tú:** {user_input}")
+        # Obtener la respuesta del agente de mercado en streaming desde el API
+        payload = {"user_input": user_input, "categoria": categoria, "ubicacion": ubicacion}
+        assistant_reply = stream_answer("mercado", payload, "Agente de Mercado")
         # Agregar la respuesta del agente a la conversación
         st.session_state.conversation_mercado.append({"role": "assistant", "content": assistant_reply})
-
-# Mostrar la conversación
-st.markdown("### Conversación:")
-for msg in st.session_state.conversation_mercado:
-    if msg['role'] == 'user':
-        st.markdown(f"**Tú:** {msg['content']}")
-    elif msg['role'] == 'assistant':
-        st.markdown(f"**Agente de Mercado:** {msg['content']}")
+        st.rerun()
@@ -1,13 +1,56 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+import backend_financiero
+import backend_marketing
+import backend_mercado
+from backend_financiero import financial_agent_async, financial_agent_stream
+from backend_marketing import marketing_agent_async, marketing_agent_stream
+from backend_mercado import market_agent_async, market_agent_stream
+from backend_budget import get_generation_stats
+from backend_db import get_pool_stats, run_db
+from backend_deadline import REASON_DEADLINE, REASON_DISCONNECT, REQUEST_DEADLINE, REQUEST_DEADLINE_MAX, DeadlineExceeded, enter_scope, scope_from_headers
+from backend_cache import get_cache_stats, invalidate_responses, resolve_agent
+from backend_semantic_cache import get_semantic_cache_stats, invalidate_semantic
+from backend_facts import get_facts_stats, stop_facts
+from backend_hosts import get_host_stats, start_health_checks, stop_health_checks
+from backend_ollama import close_async_client
+from backend_scheduler import RATE_LIMIT_TRUSTED_PROXIES, AdmissionError, get_rate_limiter, get_scheduler, get_scheduler_stats
+from backend_coalesce import get_coalescing_stats
+from backend_context import get_context_stats
+from backend_tiers import get_tier_stats, tier_models
+from backend_tracing import TracingMiddleware, get_profiles, get_slow_requests
+from backend_sessions import SessionNotFound, get_session_store
+from backend_warmup import get_readiness, start_warmup, stop_warmup
+from backend_batch import BATCH_MAX_ITEMS, run_batch
+from backend_fanout import ask_all, ask_all_collect
+from backend_logging import configure_logging
+from backend_metrics import gauge, render_metrics
+from typing import List, Literal, Optional, Union  # Asegúrate de que este import esté presente
 from pydantic import BaseModel
-from backend_financiero import financial_agent
-from backend_marketing import marketing_agent
-from backend_mercado import market_agent
-from typing import Optional  # Asegúrate de que este import esté presente
-from pydantic import BaseModel
+# Logs con nivel (LOG_LEVEL) y formato texto o JSON (LOG_FORMAT)
+configure_logging()
+
+# Modelos que usan los agentes, más el pequeño si hay niveles (se cargan en Ollama al arrancar)
+AGENT_MODELS = sorted({backend_financiero.MODEL_NAME, backend_marketing.MODEL_NAME, backend_mercado.MODEL_NAME, *tier_models()})
+
+# Arranque: cargar el modelo, abrir las conexiones y los hechos en segundo plano; /ready indica cuándo terminó
+@asynccontextmanager
+async def lifespan(app):
+    start_warmup(AGENT_MODELS)
+    start_health_checks()
+    yield
+    await stop_warmup()
+    await stop_health_checks()
+    await run_db(stop_facts)
+    await close_async_client()
+
 # Crear instancia de FastAPI
-app = FastAPI(title="API de Agentes", version="1.0")
+app = FastAPI(title="API de Agentes", version="1.0", lifespan=lifespan)
 
 # Configuración de CORS
 app.add_middleware(
@@ -16,54 +59,414 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],        # Permitir todos los métodos (GET, POST, etc.)
     allow_headers=["*"],        # Permitir todos los encabezados
+    expose_headers=["Server-Timing"],
 )
 
+# Cabecera Server-Timing con el tiempo de cada etapa (db_connect, db_query, prompt, queue, ttft, generate)
+# y registro de las peticiones lentas en /debug/lentas
+app.add_middleware(TracingMiddleware)
+
+# Sondas: /live sólo indica que el proceso responde; /ready, que el modelo y la BD están listos
+@app.get("/live")
+async def live():
+    return {"vivo": True}
+
+@app.get("/ready")
+async def ready():
+    readiness = get_readiness()
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=readiness.stats())
+
+# Rechazos de admisión (cola llena, sin turno o límite por cliente): 429/503 con Retry-After
+@app.exception_handler(AdmissionError)
+async def admission_error_handler(request: Request, exc: AdmissionError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Plazo de la petición vencido (X-Deadline-Ms o REQUEST_DEADLINE): 504
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+# El cliente cerró la conexión antes de la respuesta: nadie la leerá (499, como nginx)
+class ClientDisconnected(Exception):
+    pass
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    return Response(status_code=499)
+
+# Con el cuerpo ya leído, el siguiente mensaje ASGI de la petición es http.disconnect
+async def wait_disconnect(request: Request):
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+# Ejecutar una respuesta no streaming con el plazo de la petición; si vence o el cliente se va,
+# se cancela: la petición a Ollama se aborta y su hueco del planificador queda libre
+async def guarded(request: Request, work):
+    scope = enter_scope(scope_from_headers(request.headers))
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({task, watcher}, timeout=scope.remaining(), return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return task.result()
+        scope.reason = REASON_DISCONNECT if watcher in done else REASON_DEADLINE
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    if scope.reason == REASON_DEADLINE:
+        raise DeadlineExceeded("Plazo agotado antes de terminar la respuesta.")
+    raise ClientDisconnected()
+
+# Identificar al cliente por su IP y aplicar su límite de peticiones; la cabecera X-Client-Id sólo
+# cuenta si la envía un frontend de confianza (RATE_LIMIT_TRUSTED_PROXIES), si no cualquiera la cambiaría
+# en cada petición para saltarse el límite
+def client_id(request: Request):
+    host = request.client.host if request.client else "anonimo"
+    if host in RATE_LIMIT_TRUSTED_PROXIES:
+        forwarded = request.headers.get("x-client-id")
+        if forwarded:
+            return f"{host}/{forwarded}"
+    return host
+
+async def admit(request: Request):
+    get_rate_limiter().check(client_id(request))
+
+# En streaming las cabeceras salen antes de generar: rechazar en la puerta si la cola está llena
+async def admit_stream(request: Request):
+    get_rate_limiter().check(client_id(request))
+    get_scheduler().check_capacity()
+
 # Modelos de datos para las solicitudes y respuestas
+# Modo de respuesta: "plantilla" responde sin el modelo cuando los datos de la BD ya bastan,
+# "modelo" lo usa siempre; sin indicar, decide TEMPLATE_INTENTS para cada intención
+ResponseMode = Optional[Literal["plantilla", "modelo"]]
+
 class FinancialRequest(BaseModel):
     user_input: str
+    session_id: Optional[str] = None
+    modo: ResponseMode = None
 
 class MarketingRequest(BaseModel):
     user_input: str
     producto: Optional[str] = None
     objetivo: Optional[str] = None
     presupuesto: Optional[float] = None
+    session_id: Optional[str] = None
+    modo: ResponseMode = None
 
 class MarketRequest(BaseModel):
     user_input: str
     categoria: Optional[str] = None
     ubicacion: Optional[str] = None
+    session_id: Optional[str] = None
+    modo: ResponseMode = None
 
-# Rutas de la API
+class AllAgentsRequest(BaseModel):
+    user_input: str
+    producto: Optional[str] = None
+    objetivo: Optional[str] = None
+    presupuesto: Optional[float] = None
+    categoria: Optional[str] = None
+    ubicacion: Optional[str] = None
+    # Plazo común en segundos (por defecto FANOUT_DEADLINE, como mucho REQUEST_DEADLINE_MAX) y resumen
+    # opcional de las tres respuestas
+    plazo_s: Optional[float] = Field(None, gt=0, le=REQUEST_DEADLINE_MAX)
+    resumen: bool = False
+    modo: ResponseMode = None
+
+class BatchItem(BaseModel):
+    id: Optional[Union[int, str]] = None
+    agente: Literal["financiero", "marketing", "mercado"]
+    user_input: str
+    producto: Optional[str] = None
+    objetivo: Optional[str] = None
+    presupuesto: Optional[float] = None
+    categoria: Optional[str] = None
+    ubicacion: Optional[str] = None
+    modo: ResponseMode = None
+
+class BatchRequest(BaseModel):
+    peticiones: List[BatchItem]
+    concurrencia: Optional[int] = None
 
-@app.post("/agente_financiero/")
-async def agente_financiero(request: FinancialRequest):
+class SessionRequest(BaseModel):
+    agente: Optional[str] = None
+
+# Sesión de conversación indicada en la petición (None si no se indicó)
+# Con agent, la sesión tiene que ser de ese agente (409 si es de otro): su historial y su modelo
+# no valen para otro experto. Una sesión creada sin agente queda ligada al primero que la usa
+def resolve_session(session_id, agent=None):
+    if session_id is None:
+        return None
     try:
-        response = financial_agent(request.user_input)
+        session = get_session_store().get(session_id)
+    except SessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if agent is not None:
+        if session.agent is None:
+            session.agent = agent
+        elif session.agent != agent:
+            raise HTTPException(status_code=409, detail=f"La sesión {session_id} es del agente {session.agent}, no de {agent}.")
+    return session
+
+# Respuesta no streaming; con sesión se devuelve también su identificador
+def agent_response(response, session):
+    if session is None:
         return {"respuesta": response}
+    return {"respuesta": response, "session_id": session.id, "turno": session.turns}
+
+# Rutas de la API
+
+@app.post("/agente_financiero/", dependencies=[Depends(admit)])
+async def agente_financiero(request: FinancialRequest, http_request: Request):
+    session = resolve_session(request.session_id, "financiero")
+    try:
+        response = await guarded(http_request, financial_agent_async(request.user_input, session, request.modo))
+        return agent_response(response, session)
+    except (AdmissionError, DeadlineExceeded, ClientDisconnected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/agente_marketing/")
-async def agente_marketing(request: MarketingRequest):
+@app.post("/agente_marketing/", dependencies=[Depends(admit)])
+async def agente_marketing(request: MarketingRequest, http_request: Request):
+    session = resolve_session(request.session_id, "marketing")
     try:
-        response = marketing_agent(
+        response = await guarded(http_request, marketing_agent_async(
             user_input=request.user_input,
             producto=request.producto,
             objetivo=request.objetivo,
-            presupuesto=request.presupuesto
-        )
-        return {"respuesta": response}
+            presupuesto=request.presupuesto,
+            session=session,
+            modo=request.modo
+        ))
+        return agent_response(response, session)
+    except (AdmissionError, DeadlineExceeded, ClientDisconnected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/agente_mercado/")
-async def agente_mercado(request: MarketRequest):
+@app.post("/agente_mercado/", dependencies=[Depends(admit)])
+async def agente_mercado(request: MarketRequest, http_request: Request):
+    session = resolve_session(request.session_id, "mercado")
     try:
-        response = market_agent(
+        response = await guarded(http_request, market_agent_async(
             user_input=request.user_input,
             categoria=request.categoria,
-            ubicacion=request.ubicacion
-        )
-        return {"respuesta": response}
+            ubicacion=request.ubicacion,
+            session=session,
+            modo=request.modo
+        ))
+        return agent_response(response, session)
+    except (AdmissionError, DeadlineExceeded, ClientDisconnected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+# Métricas en formato de texto de Prometheus: contadores e histogramas por agente más el estado actual
+gauge("llm_generaciones_en_curso", "Generaciones ocupando un hueco del planificador.", lambda: get_scheduler_stats()["en_ejecucion"])
+gauge("llm_peticiones_en_cola", "Peticiones esperando turno para generar.", lambda: get_scheduler_stats()["en_cola"])
+gauge("bd_conexiones", "Conexiones abiertas en el pool de PostgreSQL.", lambda: get_pool_stats()["tamano"])
+gauge("bd_conexiones_en_uso", "Conexiones del pool prestadas en este momento.", lambda: get_pool_stats().get("en_uso", 0))
+gauge("ollama_host_en_curso", "Generaciones en curso por servidor de Ollama.",
+      lambda: {(host["host"],): host["en_curso"] for host in get_host_stats()["hosts"]}, ("host",))
+gauge("ollama_host_sano", "1 si el servidor de Ollama está en el reparto.",
+      lambda: {(host["host"],): int(host["sano"]) for host in get_host_stats()["hosts"]}, ("host",))
+gauge("servicio_listo", "1 si el calentamiento terminó y /ready responde 200.", lambda: int(get_readiness().ready))
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# La misma pregunta a los tres agentes a la vez, con un plazo común y tiempos por agente
+def all_agents_args(request: AllAgentsRequest):
+    return dict(
+        user_input=request.user_input,
+        producto=request.producto,
+        objetivo=request.objetivo,
+        presupuesto=request.presupuesto,
+        categoria=request.categoria,
+        ubicacion=request.ubicacion,
+        deadline=request.plazo_s,
+        summary=request.resumen,
+        modo=request.modo,
+    )
+
+@app.post("/agentes", dependencies=[Depends(admit)])
+async def agentes(request: AllAgentsRequest, http_request: Request):
+    return await guarded(http_request, ask_all_collect(**all_agents_args(request)))
+
+# En streaming, los eventos de cada agente llegan intercalados con su campo "agente"
+@app.post("/agentes/stream", dependencies=[Depends(admit_stream)])
+async def agentes_stream(request: AllAgentsRequest, http_request: Request):
+    return stream_events(ask_all(**all_agents_args(request)), http_request)
+
+# Lote de preguntas (trabajos nocturnos): consultas a la BD agrupadas y sin repetir, generaciones
+# con paralelismo acotado y resultados en NDJSON según van terminando, con el id de cada petición
+@app.post("/agentes/batch", dependencies=[Depends(admit)])
+async def agentes_batch(request: BatchRequest, http_request: Request):
+    if len(request.peticiones) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BATCH_MAX_ITEMS} peticiones por lote")
+    # Los lotes no tienen plazo salvo que el cliente lo pida con la cabecera
+    return stream_events(run_batch(request.peticiones, request.concurrencia), http_request, default_deadline=None)
+
+# Sesiones de conversación: el servidor guarda el historial y el contexto de Ollama entre turnos
+
+@app.post("/sesiones")
+async def crear_sesion(request: Optional[SessionRequest] = None):
+    session = get_session_store().create(request.agente if request else None)
+    return session.to_dict()
+
+@app.get("/sesiones/{session_id}")
+async def ver_sesion(session_id: str):
+    return resolve_session(session_id).to_dict()
+
+@app.delete("/sesiones/{session_id}")
+async def borrar_sesion(session_id: str):
+    if not get_session_store().delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Sesión no encontrada o caducada: {session_id}")
+    return {"borrada": session_id}
+
+@app.get("/metricas/sesiones")
+async def metricas_sesiones():
+    return get_session_store().stats()
+
+# Tokens generados, descartados y ahorrados por el presupuesto de generación
+@app.get("/metricas/generacion")
+async def metricas_generacion():
+    return get_generation_stats()
+
+# Servidores de Ollama: reparto, salud, generaciones en curso y reintentos por host
+@app.get("/metricas/ollama")
+async def metricas_ollama():
+    return get_host_stats()
+
+# Estado del pool de conexiones a PostgreSQL (para dimensionarlo)
+@app.get("/metricas/db")
+async def metricas_db():
+    return get_pool_stats()
+
+# Aciertos, fallos y expulsiones de la caché exacta y de la semántica
+@app.get("/metricas/cache")
+async def metricas_cache():
+    return {**get_cache_stats(), "semantica": get_semantic_cache_stats()}
+
+# Cola de generación: en ejecución, en espera, tiempos de espera por agente y rechazos
+@app.get("/metricas/cola")
+async def metricas_cola():
+    return get_scheduler_stats()
+
+# Peticiones idénticas que se unieron a una ejecución en curso, por agente
+@app.get("/metricas/coalescencia")
+async def metricas_coalescencia():
+    return get_coalescing_stats()
+
+# Datos de la BD recortados del prompt por el presupuesto de contexto, por agente
+@app.get("/metricas/contexto")
+async def metricas_contexto():
+    return get_context_stats()
+
+# Nivel de modelo elegido (pequeño o grande) por agente y motivo, y latencia de generación por modelo
+@app.get("/metricas/modelos")
+async def metricas_modelos():
+    return get_tier_stats()
+
+# Antigüedad y duración de recarga de la instantánea de hechos
+@app.get("/metricas/hechos")
+async def metricas_hechos():
+    return get_facts_stats()
+
+# Últimas peticiones que superaron TRACE_SLOW_MS, con el tiempo de cada etapa
+@app.get("/debug/lentas")
+async def debug_lentas(limite: Optional[int] = None):
+    return get_slow_requests(limite)
+
+# Perfiles de cProfile de las peticiones lentas más lentas (con TRACE_PROFILE_RATE > 0)
+@app.get("/debug/perfiles")
+async def debug_perfiles():
+    return get_profiles()
+
+# Invalidar la caché cuando cambian las tablas agente_*; sin parámetro se vacía entera
+@app.post("/cache/invalidar")
+async def invalidar_cache(agente: Optional[str] = None):
+    try:
+        agente = resolve_agent(agente)
+        return {
+            "invalidadas": invalidate_responses(agente),
+            "invalidadas_semanticas": invalidate_semantic(agente),
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# Rutas en streaming: NDJSON por defecto, Server-Sent Events si el cliente pide text/event-stream
+
+async def guarded_events(events, scope):
+    enter_scope(scope)
+    try:
+        while True:
+            timeout = scope.remaining()
+            try:
+                if timeout is None:
+                    event = await events.__anext__()
+                else:
+                    event = await asyncio.wait_for(events.__anext__(), max(timeout, 0))
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                scope.reason = REASON_DEADLINE
+                yield {"tipo": "error", "detalle": "Plazo agotado antes de terminar la respuesta."}
+                return
+            yield event
+    finally:
+        await events.aclose()
+
+# En streaming el plazo se comprueba entre eventos; al vencer se avisa con un evento de error.
+# Si el cliente se desconecta, Starlette cancela la respuesta y aclose() cancela la generación
+def stream_events(events, request: Request, default_deadline=REQUEST_DEADLINE):
+    events = guarded_events(events, scope_from_headers(request.headers, default_deadline))
+    if "text/event-stream" in request.headers.get("accept", ""):
+        async def sse():
+            async for event in events:
+                yield f"event: {event['tipo']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        return StreamingResponse(sse(), media_type="text/event-stream")
+
+    async def ndjson():
+        async for event in events:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.post("/agente_financiero/stream", dependencies=[Depends(admit_stream)])
+async def agente_financiero_stream(request: FinancialRequest, http_request: Request):
+    session = resolve_session(request.session_id, "financiero")
+    return stream_events(financial_agent_stream(request.user_input, session, request.modo), http_request)
+
+@app.post("/agente_marketing/stream", dependencies=[Depends(admit_stream)])
+async def agente_marketing_stream(request: MarketingRequest, http_request: Request):
+    events = marketing_agent_stream(
+        user_input=request.user_input,
+        producto=request.producto,
+        objetivo=request.objetivo,
+        presupuesto=request.presupuesto,
+        session=resolve_session(request.session_id, "marketing"),
+        modo=request.modo
+    )
+    return stream_events(events, http_request)
+
+@app.post("/agente_mercado/stream", dependencies=[Depends(admit_stream)])
+async def agente_mercado_stream(request: MarketRequest, http_request: Request):
+    events = market_agent_stream(
+        user_input=request.user_input,
+        categoria=request.categoria,
+        ubicacion=request.ubicacion,
+        session=resolve_session(request.session_id, "mercado"),
+        modo=request.modo
+    )
+    return stream_events(events, http_request)
@@ -0,0 +1,26 @@
+-- migrations/001_notificar_cambios.sql
+-- Avisa por NOTIFY agentes_cambios (payload = nombre de la tabla) cada vez que cambia una tabla agente_*.
+-- backend_facts escucha el canal para recargar los hechos e invalidar las cachés de respuestas.
+-- Uso: psql -d <base> -f migrations/001_notificar_cambios.sql
+
+CREATE OR REPLACE FUNCTION notificar_cambio_agentes() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('agentes_cambios', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS agente_financiero_cambios ON agente_financiero;
+CREATE TRIGGER agente_financiero_cambios
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON agente_financiero
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio_agentes();
+
+DROP TRIGGER IF EXISTS agente_marketing_cambios ON agente_marketing;
+CREATE TRIGGER agente_marketing_cambios
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON agente_marketing
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio_agentes();
+
+DROP TRIGGER IF EXISTS agente_mercado_cambios ON agente_mercado;
+CREATE TRIGGER agente_mercado_cambios
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON agente_mercado
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio_agentes();
@@ -0,0 +1,18 @@
+-- migrations/002_indices_agentes.sql
+-- Índices para los filtros de igualdad de los agentes (precio promedio por categoría,
+-- competidores por zona y opciones de financiamiento por tipo de negocio).
+-- CONCURRENTLY no bloquea escrituras; no ejecutar dentro de una transacción (psql sin -1).
+-- Uso: psql -d <base> -f migrations/002_indices_agentes.sql
+
+-- INCLUDE (precio) permite resolver AVG(precio) por categoría con un index-only scan
+CREATE INDEX CONCURRENTLY IF NOT EXISTS agente_mercado_categoria_idx
+    ON agente_mercado (categoria) INCLUDE (precio);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS agente_mercado_ubicacion_idx
+    ON agente_mercado (ubicacion_geografica);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS agente_financiero_tipo_negocio_idx
+    ON agente_financiero (tipo_negocio);
+
+ANALYZE agente_mercado;
+ANALYZE agente_financiero;
@@ -0,0 +1,9 @@
+-- migrations/003_indice_presupuesto_marketing.sql
+-- Índice para la búsqueda de la campaña con presupuesto más cercano (backend_marketing.SQL_CAMPANAS_CERCANAS).
+-- Cada sonda lee unas pocas entradas a partir del presupuesto pedido en lugar de ordenar la tabla entera.
+-- Uso: psql -d <base> -f migrations/003_indice_presupuesto_marketing.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS agente_marketing_presupuesto_idx
+    ON agente_marketing (presupuesto, rendimiento DESC);
+
+ANALYZE agente_marketing;
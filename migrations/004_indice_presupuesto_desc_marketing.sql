@@ -0,0 +1,11 @@
+-- migrations/004_indice_presupuesto_desc_marketing.sql
+-- Índice para la sonda "por debajo" de backend_marketing.SQL_CAMPANAS_CERCANAS (ORDER BY presupuesto DESC,
+-- rendimiento DESC). El de migrations/003 (presupuesto, rendimiento DESC) sólo sirve a la sonda "por encima":
+-- recorrido hacia atrás da presupuesto DESC pero rendimiento ASC, y PostgreSQL tendría que ordenar.
+-- CONCURRENTLY no bloquea escrituras; no ejecutar dentro de una transacción (psql sin -1).
+-- Uso: psql -d <base> -f migrations/004_indice_presupuesto_desc_marketing.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS agente_marketing_presupuesto_desc_idx
+    ON agente_marketing (presupuesto DESC, rendimiento DESC);
+
+ANALYZE agente_marketing;